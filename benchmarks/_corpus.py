@@ -0,0 +1,92 @@
+"""
+Synthetic product names and channel messages shared by the benchmarks.
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+# Add src/ to path for imports
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+BRANDS = [
+    "apple", "samsung", "xiaomi", "sony", "lg", "philips", "dyson", "lenovo", "asus", "huawei",
+    "nintendo", "garmin", "bose", "logitech", "braun", "oneplus", "google", "amazon", "msi", "acer",
+]
+MODELS = [
+    "galaxy", "iphone", "airpods", "redmi", "bravia", "oled", "vacuum", "thinkpad", "zenbook",
+    "switch", "forerunner", "quietcomfort", "mx master", "series", "nord", "pixel", "kindle",
+    "echo", "watch", "buds", "tab", "book", "monitor", "router", "speaker", "camera",
+]
+FILLER = (
+    "offerta imperdibile spedizione gratuita solo oggi sconto coupon prezzo minimo storico "
+    "disponibile su amazon link in bio approfitta subito ultimi pezzi nuovo modello garanzia "
+    "italia venduto e spedito da"
+).split()
+
+
+def product_names(n: int, seed: int = 1) -> list[str]:
+    """Return n distinct product names like 'samsung galaxy s24'."""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        names.add(f"{rng.choice(BRANDS)} {rng.choice(MODELS)} {rng.choice('sxap')}{rng.randint(1, 99)}")
+    return sorted(names)
+
+
+def _typo(rng: random.Random, name: str) -> str:
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[i + 1:]
+
+
+def messages(n: int, names: list[str], hit_rate: float = 0.3, typo_rate: float = 0.1,
+             seed: int = 2) -> list[str]:
+    """Return n deal-like messages; some mention a product, some with a typo."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        words = [rng.choice(FILLER) for _ in range(rng.randint(10, 40))]
+        roll = rng.random()
+        if roll < hit_rate:
+            name = rng.choice(names)
+            if roll < typo_rate:
+                name = _typo(rng, name)
+            words.insert(rng.randrange(len(words)), name.title())
+        words.append(f"{rng.randint(9, 1999)},{rng.randint(0, 99):02d}€")
+        out.append(" ".join(words))
+    return out
+
+
+def timed(fn, *args) -> float:
+    """Run fn(*args) and return the elapsed seconds."""
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def price_corpora(n: int, size: int = 4096, seed: int = 5) -> dict[str, list[str]]:
+    """Realistic and adversarial inputs for the price parser, n messages each.
+
+    Adversarial messages are size characters long: digit runs, "1.234.567..."
+    dumps (nested quantifier backtracking), thousands of € tokens, and long
+    realistic posts.
+    """
+    rng = random.Random(seed)
+    names = product_names(200, seed=seed)
+    realistic = messages(n, names, seed=seed)
+    long_posts = []
+    for text in messages(n * 8, names, seed=seed + 1):
+        if not long_posts or len(long_posts[-1]) >= size:
+            long_posts.append("")
+        long_posts[-1] += text + "\n"
+    return {
+        "realistic": realistic,
+        "long_posts_4k": [text[:size] for text in long_posts[:n]],
+        "digit_runs": ["".join(rng.choice("0123456789") for _ in range(size)) for _ in range(n)],
+        "digit_dot_dump": [("123." * size)[:size] for _ in range(n)],
+        "digit_dot_comma": [("1.234,5 " * size)[:size] for _ in range(n)],
+        "euro_tokens": [("€ " * size)[:size] for _ in range(n)],
+        "euro_amounts": [("€1 EUR 2 3 euro " * size)[:size] for _ in range(n)],
+        "spaces_before_euro": [("9" + " " * 64) * (size // 65) + "€" for _ in range(n)],
+    }
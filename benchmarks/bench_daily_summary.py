@@ -0,0 +1,180 @@
+"""
+Benchmark: building and sending the daily summaries, per-user queries vs one grouped query.
+
+Seeds --users users with 1-3 products each and --matches price history rows
+found today, on a file database. Building: the previous scheduler (one
+query per user, product names looked up one by one) against the single
+windowed query of DailySummaryScheduler. Sending: the summaries sent one
+after another against the NotificationDispatcher fan-out, to a fake bot
+whose send_message takes --latency seconds.
+
+Usage: python benchmarks/bench_daily_summary.py [--users 10000] [--matches 100000] [--latency 0.02] [--send-limit 2000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import _corpus  # noqa: F401  (adds src/ to the path)
+
+from sqlalchemy import create_engine, event, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from database import Base, async_url
+from models import ChannelMessage, PriceHistory, Product, User
+from notifier import NotificationDispatcher
+from scheduler import DailySummaryScheduler
+from translations import t
+
+SINCE = 1735689600000  # 2025-01-01 00:00 UTC
+
+
+def seed(url, users, matches):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    rng = random.Random(4)
+    products = []
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": uid, "user_id": uid, "username": f"user{uid}"} for uid in range(1, users + 1)])
+        for uid in range(1, users + 1):
+            for _ in range(rng.randint(1, 3)):
+                products.append((len(products) + 1, uid))
+        conn.execute(insert(Product), [{"id": pid, "user_id": uid, "name": f"product {pid}"} for pid, uid in products])
+        conn.execute(insert(ChannelMessage), [
+            {"id": c, "chat_id": -1000000000000 - c, "message_id": c, "channel": f"channel{c % 30}",
+             "text": "deal", "link": f"https://t.me/c/{c}"}
+            for c in range(1, 1001)
+        ])
+        for start in range(0, matches, 10000):
+            rows = []
+            for _ in range(start, min(matches, start + 10000)):
+                pid, uid = rng.choice(products)
+                rows.append({"product_id": pid, "user_id": uid, "price": rng.uniform(10, 1000),
+                             "channel_message_id": rng.randint(1, 1000),
+                             "found_at": SINCE + rng.randint(0, 20 * 3_600_000)})
+            conn.execute(insert(PriceHistory), rows)
+        # Yesterday's rows the summary must skip
+        conn.execute(insert(PriceHistory), [
+            {"product_id": pid, "user_id": uid, "price": 1.0, "channel_message_id": 1, "found_at": SINCE - 3_600_000}
+            for pid, uid in products
+        ])
+    engine.dispose()
+
+
+class Collector:
+    """Stands in for the dispatcher while building: keeps the queued summaries."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, chat_id, text, priority=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+async def per_user(factory, notifier):
+    """The previous _send_summaries: one query per user, one product lookup per match."""
+    async with factory() as session:
+        users = (await session.scalars(select(User).where(User.paused == False))).all()  # noqa: E712
+        user_data = [(u.user_id, u.lang_code) for u in users]
+    for uid, lang in user_data:
+        async with factory() as session:
+            entries = (await session.execute(
+                select(PriceHistory.product_id, PriceHistory.price, ChannelMessage.channel, ChannelMessage.link)
+                .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+                .where(PriceHistory.user_id == uid, PriceHistory.found_at >= SINCE)
+                .order_by(PriceHistory.found_at.desc())
+            )).all()
+            if not entries:
+                continue
+            by_product = {}
+            for e in entries:
+                product = await session.get(Product, e.product_id)
+                by_product.setdefault(product.name, []).append(e)
+            lines = [t("summary_header", lang, count=len(entries))]
+            for name, found in by_product.items():
+                lines.append(t("summary_product", lang, name=name, count=len(found)))
+                for m in found[:5]:
+                    lines.append(f"  {m.price:.2f} in {m.channel} ")
+                if len(found) > 5:
+                    lines.append(t("summary_more", lang, count=len(found) - 5))
+        notifier.send(uid, "\n".join(lines))
+
+
+async def build(url, grouped):
+    """Build every summary; returns (seconds, queries, summaries)."""
+    engine = create_async_engine(async_url(url))
+    queries = 0
+
+    def count(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    notifier = Collector()
+    started = time.perf_counter()
+    if grouped:
+        await DailySummaryScheduler(None, factory, notifier=notifier)._send_summaries(since=SINCE)
+    else:
+        await per_user(factory, notifier)
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return elapsed, queries, notifier.sent
+
+
+class FakeBot:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+async def send(summaries, latency, fan_out):
+    """Deliver the summaries to a fake bot; returns seconds."""
+    bot = FakeBot(latency)
+    started = time.perf_counter()
+    if fan_out:
+        # No rate limit here: the fake bot has no flood control to respect
+        dispatcher = NotificationDispatcher(bot, global_rate=1e9, chat_rate=1e9)
+        for chat_id, text in summaries:
+            dispatcher.send(chat_id, text)
+        await dispatcher.join()
+        await dispatcher.stop()
+    else:
+        for chat_id, text in summaries:
+            await bot.send_message(chat_id, text)
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--matches", type=int, default=100000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--send-limit", type=int, default=2000, help="summaries to send in the sending stage")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        seed(url, args.users, args.matches)
+        print(f"{args.users} users, {args.matches} matches today")
+        print(f"{'build':<12} {'seconds':>8} {'queries':>8} {'summaries':>10}")
+        results = {}
+        for label, grouped in (("per user", False), ("grouped", True)):
+            elapsed, queries, summaries = await build(url, grouped)
+            results[label] = summaries
+            print(f"{label:<12} {elapsed:>8.2f} {queries:>8} {len(summaries):>10}")
+        assert sorted(results["per user"]) == sorted(results["grouped"]), "summaries differ"
+
+    summaries = results["grouped"][:args.send_limit]
+    print(f"\nsending {len(summaries)} summaries, {args.latency * 1000:.0f} ms per send_message")
+    for label, fan_out in (("one by one", False), ("dispatcher", True)):
+        print(f"{label:<12} {await send(summaries, args.latency, fan_out):>8.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
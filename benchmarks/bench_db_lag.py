@@ -0,0 +1,127 @@
+"""
+Benchmark: event-loop lag while handlers query the database.
+
+Runs the /stats queries for many users concurrently, once through the sync
+SessionLocal-style sessions (the query blocks the loop) and once through the
+aiosqlite async sessions, while a ticker task measures how late the loop
+wakes it up (the delay seen by Telethon updates).
+
+Usage: python benchmarks/bench_db_lag.py [--rows 200000] [--users 50] [--queries 200]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import _corpus  # noqa: F401  (adds src/ to the path)
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, async_url
+from models import ChannelMessage, PriceHistory, Product, User
+
+
+def seed(url, rows, users):
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    rng = random.Random(1)
+    with sessionmaker(bind=engine)() as session:
+        for uid in range(1, users + 1):
+            session.add(User(id=uid, user_id=uid, username=f"user{uid}"))
+            session.add(Product(id=uid, user_id=uid, name=f"product {uid}"))
+        session.flush()
+        session.execute(insert(ChannelMessage), [
+            {"id": c, "chat_id": -1000000000000 - c, "message_id": c, "channel": f"channel{c}", "text": "deal"}
+            for c in range(1, 21)
+        ])
+        session.execute(insert(PriceHistory), [
+            {
+                "product_id": (i % users) + 1, "user_id": (i % users) + 1,
+                "price": rng.uniform(10, 1000), "channel_message_id": rng.randint(1, 20),
+                "found_at": 1735732800000 + rng.randint(0, 27) * 86_400_000,  # 2025-01-01..28 12:00 UTC
+            }
+            for i in range(rows)
+        ])
+        session.commit()
+    engine.dispose()
+
+
+def _stats_queries(uid):
+    return [
+        select(func.count()).select_from(PriceHistory).where(PriceHistory.user_id == uid),
+        select(ChannelMessage.channel, func.count(PriceHistory.id))
+        .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+        .where(PriceHistory.user_id == uid)
+        .group_by(ChannelMessage.channel)
+        .order_by(func.count(PriceHistory.id).desc())
+        .limit(1),
+    ]
+
+
+async def measure(run_queries, queries, users, concurrency=10):
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    async def worker(n):
+        for _ in range(n):
+            await run_queries(random.randint(1, users))
+
+    tick = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(queries // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done = True
+    await tick
+    return elapsed, lag
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+        seed(url, args.rows, args.users)
+        print(f"{args.rows} price history rows, {args.users} users, {args.queries} /stats calls")
+
+        sync_engine = create_engine(url)
+        SyncSession = sessionmaker(bind=sync_engine)
+
+        async def sync_queries(uid):
+            with SyncSession() as session:
+                for query in _stats_queries(uid):
+                    session.execute(query).all()
+
+        async_engine = create_async_engine(async_url(url))
+        AsyncSession = async_sessionmaker(bind=async_engine)
+
+        async def async_queries(uid):
+            async with AsyncSession() as session:
+                for query in _stats_queries(uid):
+                    (await session.execute(query)).all()
+
+        for label, fn in (("sync sessions", sync_queries), ("async sessions", async_queries)):
+            elapsed, lag = await measure(fn, args.queries, args.users)
+            print(f"  {label:<16} {args.queries / elapsed:>8.0f} calls/s   max loop lag {lag * 1000:7.1f} ms")
+
+        sync_engine.dispose()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
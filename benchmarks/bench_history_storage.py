@@ -0,0 +1,145 @@
+"""
+Benchmark: price history storage size and insert throughput, inline text vs channel_messages.
+
+Writes the matches of --posts channel posts, each matched by --users-per-post
+users, once with the old layout (every price_history row carries the post's
+text, channel and link) and once through PriceHistoryWriter, which stores
+each post once in channel_messages and references it. Both write batches of
+100 rows per transaction on a file database.
+
+Usage: python benchmarks/bench_history_storage.py [--posts 20000] [--users-per-post 5]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from _corpus import messages, product_names
+
+from sqlalchemy import (
+    BigInteger, Column, Float, Integer, MetaData, String, Table, create_engine, insert, text,
+)
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, async_url
+from history_writer import PriceHistoryWriter
+from models import Product, User
+
+BATCH = 100
+
+# price_history before channel_messages
+_inline = Table(
+    "price_history_inline", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("product_id", Integer, nullable=False, index=True),
+    Column("user_id", Integer, nullable=False, index=True),
+    Column("price", Float),
+    Column("channel", String, nullable=False),
+    Column("message_text", String, nullable=False),
+    Column("message_link", String),
+    Column("source", String, nullable=False),
+    Column("found_at", BigInteger, nullable=False, index=True),
+)
+
+
+def matches(posts: int, users_per_post: int, users: int) -> list[dict]:
+    """Queued-row dicts as the listener builds them: users_per_post rows per post."""
+    rng = random.Random(5)
+    texts = messages(posts, product_names(200))
+    rows = []
+    for post, body in enumerate(texts):
+        channel = f"Offerte {rng.randint(1, 30)}"
+        for uid in rng.sample(range(1, users + 1), users_per_post):
+            rows.append({
+                "product_id": uid, "user_id": uid, "price": rng.uniform(10, 1000), "source": "realtime",
+                "found_at": 1735732800000 + post * 1000, "chat_id": -1001000 - post % 30, "message_id": post,
+                "channel": channel, "message_text": body[:500], "message_link": f"https://t.me/offerte/{post}",
+            })
+    return rows
+
+
+def seed_users(url: str, users: int) -> None:
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all([User(id=uid, user_id=uid, username=f"user{uid}") for uid in range(1, users + 1)])
+        session.flush()
+        session.add_all([Product(id=uid, user_id=uid, name=f"product {uid}") for uid in range(1, users + 1)])
+        session.commit()
+    engine.dispose()
+
+
+def size_mb(url: str, tables: list[str]) -> float:
+    """Pages used by the tables and their indexes (dbstat)."""
+    engine = create_engine(url)
+    with engine.connect() as conn:
+        size = sum(
+            conn.execute(text(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = :t)"
+            ), {"t": table}).scalar() or 0
+            for table in tables
+        )
+    engine.dispose()
+    return size / 1e6
+
+
+async def run_inline(url: str, rows: list[dict]) -> float:
+    engine = create_async_engine(async_url(url))
+    async with engine.begin() as conn:
+        await conn.run_sync(_inline.create)
+    factory = async_sessionmaker(bind=engine)
+    started = time.perf_counter()
+    for i in range(0, len(rows), BATCH):
+        async with factory() as session:
+            await session.execute(insert(_inline), [
+                {k: v for k, v in row.items() if k not in ("chat_id", "message_id")} for row in rows[i:i + BATCH]
+            ])
+            await session.commit()
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return elapsed
+
+
+async def run_writer(url: str, rows: list[dict]) -> float:
+    engine = create_async_engine(async_url(url))
+    writer = PriceHistoryWriter(async_sessionmaker(bind=engine), batch_size=BATCH, max_queue=len(rows))
+    started = time.perf_counter()
+    for i in range(0, len(rows), BATCH):
+        for row in rows[i:i + BATCH]:
+            writer.add(**row)
+        await writer.flush()
+    elapsed = time.perf_counter() - started
+    await writer.stop()
+    await engine.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--users-per-post", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = matches(args.posts, args.users_per_post, args.users)
+    print(f"{args.posts} posts x {args.users_per_post} users = {len(rows)} price history rows")
+    print(f"{'layout':<20} {'rows/s':>10} {'size (MB)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'inline.sqlite3')}"
+        seed_users(url, args.users)
+        elapsed = asyncio.run(run_inline(url, rows))
+        print(f"{'inline text':<20} {len(rows) / elapsed:>10,.0f} {size_mb(url, ['price_history_inline']):>10.1f}")
+
+        url = f"sqlite:///{os.path.join(tmp, 'messages.sqlite3')}"
+        seed_users(url, args.users)
+        elapsed = asyncio.run(run_writer(url, rows))
+        size = size_mb(url, ["price_history", "channel_messages"])
+        print(f"{'channel_messages':<20} {len(rows) / elapsed:>10,.0f} {size:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
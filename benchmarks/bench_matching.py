@@ -0,0 +1,114 @@
+"""
+Benchmark: product matching throughput in messages/sec.
+
+Compares the per-product check_product_match loop (the original listener
+path) with the per-channel matchers: exact Aho-Corasick automaton, and
+automaton + trigram-indexed fuzzy matcher with one typo allowed per product.
+A naive fuzzy scan (edit distance against every product) is measured on a
+small sample to show why the index is needed. The last section measures
+the prefilter (anchor trigrams + currency check) ahead of the automaton on
+a channel with --channel-products products, most messages being chatter.
+
+Usage: python benchmarks/bench_matching.py [--products 2000] [--messages 2000] [--channel-products 20]
+"""
+
+import argparse
+
+from _corpus import messages, product_names, timed
+
+from fuzzy import FuzzyMatcher, substring_distance, trigrams
+from matcher import PreparedMessage, ProductMatcher, ProductRecord, check_product_match, normalize
+from prefilter import MessagePrefilter
+
+
+def run_check_product_match(records, texts):
+    for text in texts:
+        for record in records:
+            check_product_match(record, text)
+
+
+def run_automaton(matcher, texts):
+    for text in texts:
+        matcher.find(PreparedMessage(text).norm)
+
+
+def run_automaton_fuzzy(matcher, fuzzy, texts):
+    for text in texts:
+        norm = PreparedMessage(text).norm
+        matcher.find(norm)
+        fuzzy.find(norm, trigrams(norm))
+
+
+def run_prefiltered(prefilter, matcher, texts):
+    skipped = 0
+    for text in texts:
+        message = PreparedMessage(text)
+        if prefilter.check(message) is not None:
+            skipped += 1
+            continue
+        matcher.find(message.norm)
+    return skipped
+
+
+def run_naive_fuzzy(records, texts):
+    for text in texts:
+        norm = normalize(text)
+        for record in records:
+            substring_distance(record.name_norm, norm, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--channel-products", type=int, default=20)
+    args = parser.parse_args()
+
+    names = product_names(args.products)
+    texts = messages(args.messages, names)
+    records = [ProductRecord.create(i, 1, name, None, typo_tolerance=1) for i, name in enumerate(names)]
+    exact_records = [ProductRecord.create(i, 1, name, None) for i, name in enumerate(names)]
+
+    matcher = ProductMatcher()
+    fuzzy = FuzzyMatcher()
+    for record in records:
+        matcher.add(record.id, record.name)
+        fuzzy.add(record.id, record.name_norm, record.typo_tolerance)
+    matcher.find("")  # build failure links outside the timed section
+
+    print(f"{args.products} products, {args.messages} messages")
+    results = [
+        ("check_product_match loop (exact)", timed(run_check_product_match, exact_records, texts), len(texts)),
+        ("automaton (exact)", timed(run_automaton, matcher, texts), len(texts)),
+        ("automaton + trigram fuzzy (k=1)", timed(run_automaton_fuzzy, matcher, fuzzy, texts), len(texts)),
+    ]
+    sample = texts[:max(1, min(50, len(texts)))]
+    results.append(("naive fuzzy scan (k=1)", timed(run_naive_fuzzy, records, sample), len(sample)))
+
+    for label, elapsed, count in results:
+        print(f"  {label:<36} {count / elapsed:>10.0f} msg/s")
+
+    # One channel: a few products, 5% of the messages mention one of them
+    channel = exact_records[:args.channel_products]
+    channel_texts = messages(args.messages, [r.name for r in channel], hit_rate=0.05, typo_rate=0)
+    channel_matcher = ProductMatcher()
+    for record in channel:
+        channel_matcher.add(record.id, record.name)
+    channel_matcher.find("")
+    with_target = [ProductRecord.create(r.id, r.user_id, r.name, 100.0) for r in channel]
+    chatter = [text.rsplit(" ", 1)[0] for text in channel_texts]  # same messages without the price
+
+    print(f"\none channel, {args.channel_products} products, 5% hit rate")
+    for label, prefilter, corpus in (
+        ("tokens only", MessagePrefilter(channel), channel_texts),
+        ("tokens + currency (no prices)", MessagePrefilter(with_target), chatter),
+    ):
+        base = timed(run_automaton, channel_matcher, corpus)
+        skipped = run_prefiltered(prefilter, channel_matcher, corpus)
+        elapsed = timed(run_prefiltered, prefilter, channel_matcher, corpus)
+        print(f"  {label:<30} automaton {len(corpus) / base:>8.0f} msg/s, prefilter + automaton "
+              f"{len(corpus) / elapsed:>8.0f} msg/s, skipped {skipped / len(corpus):.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: extract_prices throughput on realistic and adversarial corpora.
+
+Reports messages/sec and MB/sec per corpus, and a scaling check: each
+adversarial input is also timed at 4x its length, and a time ratio well
+above 4 means super-linear backtracking. Results can be saved as the
+committed baseline and later runs compared against it.
+
+Usage: python benchmarks/bench_price_parser.py [--messages 200] [--save-baseline] [--check]
+"""
+
+import argparse
+import json
+import platform
+import sys
+from pathlib import Path
+
+from _corpus import price_corpora, timed
+
+from price_parser import extract_price_layout, extract_prices
+
+BASELINE = Path(__file__).resolve().parent / "baselines" / "price_parser.json"
+
+# 4x the input should take about 4x the time; above this ratio it's super-linear
+MAX_SCALING = 8.0
+
+
+def run(fn, texts):
+    for text in texts:
+        fn(text)
+
+
+def best_of(repeat: int, fn, *args) -> float:
+    return min(timed(fn, *args) for _ in range(repeat))
+
+
+def scaling(text: str) -> float:
+    """Time ratio of parsing the text repeated 4 times vs once."""
+    single = best_of(5, extract_prices, text)
+    quadruple = best_of(5, extract_prices, text * 4)
+    return quadruple / single
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE.name}")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 on super-linear scaling or a >2x slowdown vs the baseline")
+    args = parser.parse_args()
+
+    baseline = json.loads(BASELINE.read_text())["results"] if BASELINE.exists() else {}
+    results = {}
+    failures = []
+
+    print(f"{'corpus':<20} {'msg/s':>10} {'MB/s':>8} {'layout msg/s':>13} {'4x ratio':>9} {'vs baseline':>12}")
+    for name, texts in price_corpora(args.messages).items():
+        size = sum(len(t) for t in texts)
+        elapsed = best_of(3, run, extract_prices, texts)
+        layout = best_of(3, run, extract_price_layout, texts)
+        ratio = scaling(texts[0]) if name != "realistic" else None
+        rate = len(texts) / elapsed
+        results[name] = {"msg_per_sec": round(rate), "mb_per_sec": round(size / elapsed / 1e6, 2),
+                         "scaling_4x": round(ratio, 2) if ratio else None}
+
+        versus = ""
+        if name in baseline:
+            change = rate / baseline[name]["msg_per_sec"]
+            versus = f"{change:.2f}x"
+            if change < 0.5:
+                failures.append(f"{name}: {change:.2f}x the baseline throughput")
+        if ratio and ratio > MAX_SCALING:
+            failures.append(f"{name}: 4x input took {ratio:.1f}x the time")
+        print(f"{name:<20} {rate:>10,.0f} {size / elapsed / 1e6:>8.2f} {len(texts) / layout:>13,.0f} "
+              f"{f'{ratio:.1f}' if ratio else '-':>9} {versus:>12}")
+
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "messages": args.messages,
+            "results": results,
+        }, indent=2) + "\n")
+        print(f"\nBaseline written to {BASELINE}")
+
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if args.check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
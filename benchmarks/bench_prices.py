@@ -0,0 +1,97 @@
+"""
+Benchmark: price extraction throughput in messages/sec.
+
+Compares the flat extract_prices() path (_PRICE_PATTERN.finditer) with
+extract_price_layout(), which also records spans, lines and clauses in the
+same scan, and with the full per-product lookup used by check_price_match
+(layout + mention offsets + nearest price) on multi-deal posts. The batch
+section compares extract_prices() called per message with
+extract_prices_many() (one scan of a joined buffer, array('d') output).
+
+Usage: python benchmarks/bench_prices.py [--messages 20000] [--batch-messages 100000]
+"""
+
+import argparse
+import random
+import sys
+
+from _corpus import messages, product_names, timed
+
+from matcher import PreparedMessage
+from price_parser import extract_price_layout, extract_prices, extract_prices_many
+
+
+def multi_deal_messages(n: int, names: list[str], seed: int = 3) -> list[tuple[str, str, set[str]]]:
+    """Return n (text, product name, names in the post) of posts listing 2-6 deals, one per line or ' / '."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        deals = rng.sample(names, rng.randint(2, 6))
+        sep = rng.choice(["\n", " / ", "\n• "])
+        text = sep.join(f"{name.title()} a {rng.randint(9, 1999)},{rng.randint(0, 99):02d}€" for name in deals)
+        out.append((text, rng.choice(deals), set(deals)))
+    return out
+
+
+def run_flat(texts):
+    for text in texts:
+        extract_prices(text)
+
+
+def run_layout(texts):
+    for text in texts:
+        extract_price_layout(text)
+
+
+def run_per_message(texts, batch_size):
+    for i in range(0, len(texts), batch_size):
+        [extract_prices(text) for text in texts[i:i + batch_size]]
+
+
+def run_many(texts, batch_size):
+    for i in range(0, len(texts), batch_size):
+        extract_prices_many(texts[i:i + batch_size])
+
+
+def run_prices_for(pairs):
+    for text, name, mentioned in pairs:
+        PreparedMessage(text, mentioned=mentioned).prices_for(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch-messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    names = product_names(500)
+    single = messages(args.messages, names)
+    multi = multi_deal_messages(args.messages, names)
+    multi_texts = [text for text, _, _ in multi]
+
+    print(f"{args.messages} messages")
+    print(f"{'corpus':<12} {'path':<28} {'msg/s':>12}")
+    for label, texts in (("single", single), ("multi-deal", multi_texts)):
+        for path, fn in (("extract_prices (finditer)", run_flat), ("extract_price_layout", run_layout)):
+            elapsed = timed(fn, texts)
+            print(f"{label:<12} {path:<28} {len(texts) / elapsed:>12,.0f}")
+    elapsed = timed(run_prices_for, multi)
+    print(f"{'multi-deal':<12} {'prices_for (per product)':<28} {len(multi) / elapsed:>12,.0f}")
+
+    texts = messages(args.batch_messages, names, seed=4)
+    print(f"\n{args.batch_messages} messages, batch extraction")
+    print(f"{'batch size':<12} {'path':<28} {'msg/s':>12}")
+    for batch_size in (100, 1000, args.batch_messages):
+        for path, fn in (("extract_prices per message", run_per_message), ("extract_prices_many", run_many)):
+            elapsed = timed(fn, texts, batch_size)
+            print(f"{batch_size:<12} {path:<28} {len(texts) / elapsed:>12,.0f}")
+
+    lists = [extract_prices(text) for text in texts]
+    list_bytes = sys.getsizeof(lists) + sum(sys.getsizeof(p) + 24 * len(p) for p in lists)
+    batch = extract_prices_many(texts)
+    batch_bytes = sys.getsizeof(batch.values) + sys.getsizeof(batch.offsets)
+    print(f"\nresult size: list of lists {list_bytes / 1e6:.1f} MB, array('d') + offsets {batch_bytes / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
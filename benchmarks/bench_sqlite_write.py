@@ -0,0 +1,115 @@
+"""
+Benchmark: PriceHistory insert throughput under concurrent readers, per SQLite profile.
+
+A writer commits batches of PriceHistory rows (as PriceHistoryWriter does)
+while reader tasks run the /stats queries, all through aiosqlite sessions on
+a file database. Runs once with SQLite's defaults (rollback journal,
+synchronous=FULL) and once with the tuning profile from database.py (WAL,
+synchronous=NORMAL, mmap, cache, busy_timeout, foreign keys).
+
+Usage: python benchmarks/bench_sqlite_write.py [--seconds 5] [--readers 4] [--batch 100] [--rows 100000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import _corpus  # noqa: F401  (adds src/ to the path)
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from bench_db_lag import _stats_queries, seed
+from database import apply_sqlite_pragmas, async_url, sqlite_pragmas
+from models import PriceHistory
+
+DEFAULTS = [("journal_mode", "DELETE"), ("synchronous", "FULL")]
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(url, pragmas, seconds, readers, batch, users):
+    engine = create_async_engine(async_url(url), pool_size=readers + 1)
+    apply_sqlite_pragmas(engine.sync_engine, pragmas)
+    factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    rng = random.Random(2)
+    deadline = time.perf_counter() + seconds
+    written, commits, reads, locked = 0, [], [], 0
+
+    async def writer():
+        nonlocal written, locked
+        while time.perf_counter() < deadline:
+            rows = [
+                {"product_id": (i % users) + 1, "user_id": (i % users) + 1, "price": rng.uniform(10, 1000),
+                 "channel_message_id": rng.randint(1, 20), "found_at": 1735732800000 + i}
+                for i in range(written, written + batch)
+            ]
+            started = time.perf_counter()
+            try:
+                async with factory() as session:
+                    await session.execute(insert(PriceHistory), rows)
+                    await session.commit()
+            except OperationalError:
+                locked += 1
+                continue
+            commits.append(time.perf_counter() - started)
+            written += batch
+
+    async def reader():
+        nonlocal locked
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with factory() as session:
+                    for query in _stats_queries(rng.randint(1, users)):
+                        (await session.execute(query)).all()
+            except OperationalError:
+                locked += 1
+                continue
+            reads.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(writer(), *(reader() for _ in range(readers)))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return written / elapsed, len(reads) / elapsed, _percentile(commits, 0.99), _percentile(reads, 0.99), locked
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{args.rows} seeded rows, batches of {args.batch}, {args.readers} readers, {args.seconds:.0f}s per profile")
+    print(f"{'profile':<10} {'rows/s':>10} {'reads/s':>10} {'p99 commit':>12} {'p99 read':>10} {'locked':>8}")
+    for label, pragmas in (("default", DEFAULTS), ("tuned", sqlite_pragmas())):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}"
+            seed(url, args.rows, args.users)
+            # journal_mode is persistent: set it before the timed run
+            setup = create_engine(url)
+            apply_sqlite_pragmas(setup, pragmas)
+            setup.connect().close()
+            setup.dispose()
+            rows_s, reads_s, p99_commit, p99_read, locked = await run(
+                url, pragmas, args.seconds, args.readers, args.batch, args.users,
+            )
+        print(f"{label:<10} {rows_s:>10,.0f} {reads_s:>10,.0f} {p99_commit * 1000:>10.1f}ms "
+              f"{p99_read * 1000:>8.1f}ms {locked:>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
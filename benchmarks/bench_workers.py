@@ -0,0 +1,84 @@
+"""
+Benchmark: in-process matching vs. a MatchWorkerPool on a large product set.
+
+Every product is subscribed to one channel, then a burst of messages is
+matched while a ticker task measures how long the event loop stays blocked
+(the delay seen by Telethon updates and bot commands).
+
+Usage: python benchmarks/bench_workers.py [--products 50000] [--messages 2000] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import time
+
+from _corpus import messages, product_names
+
+from match_workers import MatchWorkerPool
+from matcher import PreparedMessage
+from subscriptions import SubscriptionIndex
+
+
+def build_index(names, workers=None):
+    index = SubscriptionIndex(workers=workers)
+    index.add_user(1)
+    index.subscribe(1, "offerte")
+    for i, name in enumerate(names):
+        index.add_product(i, 1, name, None)
+    return index
+
+
+async def run(index, texts, concurrency):
+    """Match all texts (up to concurrency at a time); return (elapsed, max loop lag)."""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    async def consume(chunk):
+        for text in chunk:
+            await index.match_message("offerte", None, PreparedMessage(text))
+
+    # Warm-up: build the prefilter and automata, ship shards
+    await index.match_message("offerte", None, PreparedMessage(texts[0]))
+    tick = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(consume(texts[i::concurrency]) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done = True
+    await tick
+    return elapsed, lag
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    names = product_names(args.products)
+    texts = messages(args.messages, names)
+    print(f"{args.products} products, {args.messages} messages")
+
+    elapsed, lag = await run(build_index(names), texts, 1)
+    print(f"  {'in-process':<28} {len(texts) / elapsed:>8.0f} msg/s   max loop lag {lag * 1000:7.1f} ms")
+
+    pool = MatchWorkerPool(args.workers)
+    try:
+        index = build_index(names, pool)
+        for concurrency in (1, args.workers * 2):
+            elapsed, lag = await run(index, texts, concurrency)
+            label = f"{args.workers} workers, {concurrency} in flight"
+            print(f"  {label:<28} {len(texts) / elapsed:>8.0f} msg/s   max loop lag {lag * 1000:7.1f} ms")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
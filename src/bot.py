@@ -14,11 +14,20 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 from bot_commands import BotCommands
+from channel_cache import ChannelCache
 from channel_listener import ChannelListener
 from client_commands import ClientCommands
 from config import Config
+from dedup import DealDeduplicator
+from history_writer import PriceHistoryWriter
+from ingest_queue import IngestQueue
+from match_workers import MatchWorkerPool
+from metrics import REGISTRY, MetricsServer
+from notifier import NotificationDispatcher
+from retention import HistoryRetention
 from scheduler import DailySummaryScheduler
-from database import Base, engine, SessionLocal, run_migrations
+from subscriptions import SubscriptionIndex
+from database import Base, engine, SessionLocal, AsyncSessionLocal, async_engine, run_migrations
 
 
 def create_client(session_name: str, api_id: int, api_hash: str, session_string: str = "") -> TelegramClient:
@@ -41,10 +50,36 @@ async def main():
     Base.metadata.create_all(bind=engine)
     run_migrations()
 
+    match_workers = MatchWorkerPool(cf.MATCH_WORKERS) if cf.MATCH_WORKERS > 0 else None
+    subscriptions = SubscriptionIndex(fuzzy=cf.FUZZY_MATCHING, workers=match_workers)
+    subscriptions.load(SessionLocal)
+
     bot_client = create_client(bot_session_name, api_id, api_hash)
     client = create_client(client_session_name, api_id, api_hash, session_string=cf.CLIENT_SESSION_STRING)
-    client_commands = ClientCommands(client, SessionLocal, bot_client)
-    bot_commands = BotCommands(bot_client, client_commands, SessionLocal)
+    deduplicator = DealDeduplicator(window_seconds=cf.DEDUP_WINDOW_MINUTES * 60)
+    history_writer = PriceHistoryWriter(
+        AsyncSessionLocal,
+        batch_size=cf.HISTORY_BATCH_SIZE,
+        flush_interval=cf.HISTORY_FLUSH_SECONDS,
+    )
+    channel_cache = ChannelCache(AsyncSessionLocal, ttl=cf.CHANNEL_CACHE_TTL_MINUTES * 60)
+    await channel_cache.load()
+    notifier = NotificationDispatcher(
+        bot_client,
+        global_rate=cf.NOTIFY_GLOBAL_RATE,
+        chat_rate=cf.NOTIFY_CHAT_RATE,
+        concurrency=cf.NOTIFY_CONCURRENCY,
+    )
+    ingest_queue = IngestQueue(
+        maxsize=cf.INGEST_QUEUE_SIZE,
+        consumers=cf.INGEST_CONSUMERS,
+        policy=cf.INGEST_OVERFLOW_POLICY,
+        low_priority_channels=cf.LOW_PRIORITY_CHANNELS,
+    )
+    client_commands = ClientCommands(
+        client, AsyncSessionLocal, bot_client, subscriptions, deduplicator, history_writer, notifier,
+    )
+    bot_commands = BotCommands(bot_client, client_commands, AsyncSessionLocal, subscriptions)
 
     try:
         if await bot_client.start(bot_token=bot_token):
@@ -63,7 +98,10 @@ async def main():
     try:
         if await client.start(phone=cf.PHONE_NUMBER):
             log.info("Client started!")
-            listener = ChannelListener(client, bot_client, SessionLocal)
+            listener = ChannelListener(
+                client, bot_client, AsyncSessionLocal, subscriptions, deduplicator, history_writer, notifier,
+                channel_cache, ingest_queue,
+            )
             listener.register()
             log.info("Channel listener active!")
         else:
@@ -77,7 +115,10 @@ async def main():
         await asyncio.sleep(e.seconds)
         if await client.start(phone=cf.PHONE_NUMBER):
             log.info("Client started!")
-            listener = ChannelListener(client, bot_client, SessionLocal)
+            listener = ChannelListener(
+                client, bot_client, AsyncSessionLocal, subscriptions, deduplicator, history_writer, notifier,
+                channel_cache, ingest_queue,
+            )
             listener.register()
             log.info("Channel listener active!")
         else:
@@ -86,14 +127,52 @@ async def main():
 
     # Start daily summary scheduler
     scheduler = DailySummaryScheduler(
-        bot_client, SessionLocal,
+        bot_client, AsyncSessionLocal,
         hour=cf.DAILY_SUMMARY_HOUR,
         tz_name=cf.TIMEZONE,
+        notifier=notifier,
     )
     scheduler.start()
+    history_writer.start()
+    notifier.start()
+    retention = None
+    if cf.HISTORY_RETENTION_DAYS > 0:
+        retention = HistoryRetention(
+            AsyncSessionLocal,
+            retention_days=cf.HISTORY_RETENTION_DAYS,
+            batch_size=cf.HISTORY_PRUNE_BATCH,
+            interval=cf.HISTORY_PRUNE_INTERVAL_MINUTES * 60,
+        )
+        retention.start()
+
+    metrics_server = None
+    if cf.METRICS_ENABLED:
+        REGISTRY.gauge("tfp_history_queue_depth", "PriceHistory rows waiting to be written",
+                       fn=lambda: history_writer.queue_depth)
+        REGISTRY.gauge("tfp_ingest_queue_depth", "Channel messages waiting to be matched",
+                       fn=lambda: ingest_queue.queue_depth)
+        REGISTRY.gauge("tfp_notification_queue_depth", "Notifications waiting to be sent",
+                       fn=lambda: notifier.queue_depth)
+        REGISTRY.gauge("tfp_channel_cache_hits", "Channel metadata cache hits", fn=lambda: channel_cache.hits)
+        REGISTRY.gauge("tfp_channel_cache_misses", "Channel metadata cache misses",
+                       fn=lambda: channel_cache.misses)
+        metrics_server = MetricsServer(REGISTRY, cf.METRICS_HOST, cf.METRICS_PORT)
+        await metrics_server.start()
 
-    await bot_client.run_until_disconnected()
-    await client.disconnect()
+    try:
+        await bot_client.run_until_disconnected()
+    finally:
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await ingest_queue.stop()
+        if retention is not None:
+            await retention.stop()
+        await notifier.stop()
+        await history_writer.stop()
+        await client.disconnect()
+        if match_workers is not None:
+            match_workers.close()
+        await async_engine.dispose()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -4,16 +4,26 @@ Bot command handlers for Telegram bot interactions.
 
 import logging
 import re
+from datetime import timezone
 
 log = logging.getLogger(__name__)
 from typing import Optional
+from zoneinfo import ZoneInfo
 from asyncio import TimeoutError as AsyncTimeoutError
 from telethon import events, TelegramClient
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from client_commands import ClientCommands
 from config import Config
-from models import User, Product, PriceHistory, UserChannel, Channel
+from export import FORMATS, export_history, export_name
+from fuzzy import MAX_TOLERANCE, effective_tolerance
+from matcher import normalize
+from models import User, Product, PriceHistory, UserChannel, UserStats, Channel, ChannelMessage
+from retention import daily_history
+from subscriptions import SubscriptionIndex
+from timestamps import format_ms
 from translations import t, resolve_lang, DEFAULT_LANGUAGE
+from user_stats import add_counts, rebuild_stats
 
 _CHANNEL_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]{3,31}$")
 _INVITE_HASH_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
@@ -21,6 +31,20 @@ _INVITE_HASH_RE = re.compile(r"^[a-zA-Z0-9_-]+$")
 _CANCEL_KEYWORDS = {"/cancel", "cancel", "/annulla", "annulla"}
 _SKIP_KEYWORDS = {"/skip", "skip", "/salta", "salta"}
 
+# Matches listed by /history
+_HISTORY_SHOWN = 10
+
+
+def _history_query(product_id: int):
+    """/history: a product's latest matches with the channel they were found in."""
+    return (
+        select(PriceHistory.found_at, PriceHistory.price, ChannelMessage.channel, ChannelMessage.link)
+        .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+        .where(PriceHistory.product_id == product_id)
+        .order_by(PriceHistory.found_at.desc())
+        .limit(_HISTORY_SHOWN)
+    )
+
 
 class BotCommands:
     """Telegram bot command handlers."""
@@ -29,12 +53,15 @@ class BotCommands:
         self,
         bot_client: TelegramClient,
         client_commands: ClientCommands,
-        db_session_factory: sessionmaker,
+        db_session_factory: async_sessionmaker,
+        subscriptions: SubscriptionIndex,
     ):
         self.bot_client = bot_client
         self.client_commands = client_commands
         self._session_factory = db_session_factory
+        self._subscriptions = subscriptions
         self._allowed_users = Config.ALLOWED_USERS
+        self.tz = ZoneInfo(Config.TIMEZONE)
 
     def _is_authorized(self, user_id: int | None) -> bool:
         """Check if user is authorized. If ALLOWED_USERS is empty, everyone is allowed."""
@@ -55,15 +82,19 @@ class BotCommands:
         if user_id is None or username is None:
             return None, None, DEFAULT_LANGUAGE, False
 
-        with self._session_factory() as session:
-            existing = session.get(User, user_id)
+        async with self._session_factory() as session:
+            existing = await session.get(User, user_id)
             if existing is None:
                 session.add(User(id=user_id, user_id=user_id, username=username, lang_code=sender_lang))
-                session.commit()
+                await session.flush()
+                session.add(UserStats(user_id=user_id))
+                await session.commit()
+                self._subscriptions.add_user(user_id, sender_lang)
                 return username, user_id, sender_lang, True
             if existing.lang_code != sender_lang:
                 existing.lang_code = sender_lang
-                session.commit()
+                await session.commit()
+                self._subscriptions.set_lang(user_id, sender_lang)
 
         return username, user_id, sender_lang, False
 
@@ -181,13 +212,12 @@ class BotCommands:
                 await event.respond(t("not_authorized", lang))
                 return
 
-            with self._session_factory() as session:
-                user_channels = (
-                    session.query(Channel.id, Channel.identifier, Channel.title)
+            async with self._session_factory() as session:
+                user_channels = (await session.execute(
+                    select(Channel.id, Channel.identifier, Channel.title)
                     .join(UserChannel, UserChannel.channel_id == Channel.id)
-                    .filter(UserChannel.user_id == user_id)
-                    .all()
-                )
+                    .where(UserChannel.user_id == user_id)
+                )).all()
                 if not user_channels:
                     await event.respond(t("no_channels", lang))
                     return
@@ -197,7 +227,7 @@ class BotCommands:
                 for i, ch in enumerate(user_channels, 1):
                     display = f"{ch.title} ({ch.identifier})" if ch.title else ch.identifier
                     lines.append(f"{i}. {display}")
-                    channel_data.append({"id": ch.id, "display": display})
+                    channel_data.append({"id": ch.id, "identifier": ch.identifier, "display": display})
 
             client_event = event.client
             await event.respond(t("remove_channel_prompt", lang, channels="\n".join(lines)))
@@ -226,13 +256,15 @@ class BotCommands:
 
             chosen = channel_data[idx]
             log.info("/remove_channel '%s' from user_id=%s", chosen["display"], user_id)
-            with self._session_factory() as session:
-                link = session.query(UserChannel).filter_by(
-                    user_id=user_id, channel_id=chosen["id"]
-                ).first()
+            async with self._session_factory() as session:
+                link = await session.scalar(
+                    select(UserChannel).filter_by(user_id=user_id, channel_id=chosen["id"])
+                )
                 if link:
-                    session.delete(link)
-                    session.commit()
+                    await session.delete(link)
+                    await session.run_sync(add_counts, user_id, channels=-1)
+                    await session.commit()
+            self._subscriptions.unsubscribe(user_id, chosen["identifier"])
 
             await event.respond(t("remove_channel_removed", lang, channel=chosen["display"]))
 
@@ -292,22 +324,20 @@ class BotCommands:
                 return
 
             product_name_lower = product_name.lower()
-            with self._session_factory() as session:
-                existing = session.query(Product).filter_by(
-                    user_id=user_id, name=product_name_lower
-                ).first()
+            async with self._session_factory() as session:
+                existing = await session.scalar(
+                    select(Product).filter_by(user_id=user_id, name=product_name_lower)
+                )
                 if existing:
                     await event.respond(t("watch_already_monitoring", lang, product=product_name))
                     return
 
                 # If there's price history for this product, suggest the minimum price
                 if target_price is None:
-                    from sqlalchemy import func
-                    min_price_row = (
-                        session.query(func.min(PriceHistory.price))
+                    min_price_row = await session.scalar(
+                        select(func.min(PriceHistory.price))
                         .join(Product, Product.id == PriceHistory.product_id)
-                        .filter(Product.name == product_name_lower, PriceHistory.price.isnot(None))
-                        .scalar()
+                        .where(Product.name == product_name_lower, PriceHistory.price.isnot(None))
                     )
                     if min_price_row is not None:
                         suggested_price = min_price_row
@@ -334,14 +364,17 @@ class BotCommands:
                     except AsyncTimeoutError:
                         pass
 
-            with self._session_factory() as session:
-                session.add(Product(
+            async with self._session_factory() as session:
+                product = Product(
                     user_id=user_id,
                     name=product_name_lower,
                     target_price=target_price,
                     category=category,
-                ))
-                session.commit()
+                )
+                session.add(product)
+                await session.run_sync(add_counts, user_id, products=1)
+                await session.commit()
+                self._subscriptions.add_product(product.id, user_id, product.name, product.target_price)
 
             price_info = f" at ≤{target_price:.2f}" if target_price else " at any price"
             cat_info = f" [{category}]" if category else ""
@@ -358,8 +391,8 @@ class BotCommands:
                 await event.respond(t("not_authorized", lang))
                 return
 
-            with self._session_factory() as session:
-                products = session.query(Product).filter_by(user_id=user_id).all()
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
 
                 if not products:
                     await event.respond(t("no_products", lang))
@@ -381,8 +414,8 @@ class BotCommands:
                 await event.respond(t("not_authorized", lang))
                 return
 
-            with self._session_factory() as session:
-                products = session.query(Product).filter_by(user_id=user_id).all()
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
 
                 if not products:
                     await event.respond(t("no_products_short", lang))
@@ -422,14 +455,104 @@ class BotCommands:
 
             chosen = product_ids[idx]
             log.info("/unwatch '%s' from user_id=%s", chosen["name"], user_id)
-            with self._session_factory() as session:
-                product = session.query(Product).filter_by(id=chosen["id"]).first()
+            async with self._session_factory() as session:
+                product = await session.get(Product, chosen["id"])
                 if product:
-                    session.delete(product)
-                    session.commit()
+                    await session.delete(product)
+                    await session.flush()
+                    # Its matches leave the counts too: recount the user's
+                    await session.run_sync(rebuild_stats, [user_id])
+                    await session.commit()
+            self._subscriptions.remove_product(chosen["id"])
 
             await event.respond(t("unwatched", lang, product=chosen['name']))
 
+        @self.bot_client.on(events.NewMessage(pattern=r"^/tolerance(?:\s|$)"))
+        async def tolerance_command(event):
+            _, user_id, lang, _ = await self.register_user_if_not_exists(event)
+            if user_id is None:
+                await event.respond(t("start_first", lang))
+                return
+            if not self._is_authorized(user_id):
+                await event.respond(t("not_authorized", lang))
+                return
+            if not Config.FUZZY_MATCHING:
+                await event.respond(t("tolerance_disabled", lang))
+                return
+
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
+
+                if not products:
+                    await event.respond(t("no_products_short", lang))
+                    return
+
+                lines = []
+                product_data = []
+                for i, p in enumerate(products, 1):
+                    lines.append(f"{i}. {p.name} (typos: {p.typo_tolerance or 0})")
+                    product_data.append({"id": p.id, "name": p.name})
+
+            client_event = event.client
+            await event.respond(t("tolerance_prompt", lang, products="\n".join(lines)))
+            try:
+                async with client_event.conversation(event.chat_id, timeout=60) as conv:
+                    resp = await conv.wait_event(events.NewMessage(from_users=user_id))
+                    choice = (resp.raw_text or "").strip()
+
+                    if choice.lower() in _CANCEL_KEYWORDS:
+                        await conv.send_message(t("operation_cancelled", lang))
+                        return
+
+                    try:
+                        idx = int(choice) - 1
+                    except ValueError:
+                        await conv.send_message(t("invalid_choice", lang, command="/tolerance"))
+                        return
+
+                    if idx < 0 or idx >= len(product_data):
+                        await conv.send_message(t("number_out_of_range", lang, command="/tolerance"))
+                        return
+
+                    chosen = product_data[idx]
+                    await conv.send_message(t("tolerance_ask_value", lang, product=chosen["name"]))
+                    resp2 = await conv.wait_event(events.NewMessage(from_users=user_id))
+                    value_text = (resp2.raw_text or "").strip()
+
+                    if value_text.lower() in _CANCEL_KEYWORDS:
+                        await conv.send_message(t("operation_cancelled", lang))
+                        return
+
+                    try:
+                        tolerance = int(value_text)
+                    except ValueError:
+                        await conv.send_message(t("tolerance_invalid", lang))
+                        return
+                    if tolerance < 0 or tolerance > MAX_TOLERANCE:
+                        await conv.send_message(t("tolerance_invalid", lang))
+                        return
+
+            except AsyncTimeoutError:
+                await event.respond(t("timed_out", lang, command="/tolerance"))
+                return
+
+            log.info("/tolerance '%s' -> %d from user_id=%s", chosen["name"], tolerance, user_id)
+            async with self._session_factory() as session:
+                product = await session.get(Product, chosen["id"])
+                if product:
+                    product.typo_tolerance = tolerance
+                    await session.commit()
+                    self._subscriptions.add_product(
+                        product.id, user_id, product.name, product.target_price,
+                        typo_tolerance=tolerance,
+                    )
+
+            effective = effective_tolerance(normalize(chosen["name"]), tolerance)
+            reply = t("tolerance_set", lang, product=chosen["name"], count=tolerance)
+            if effective < tolerance:
+                reply += "\n" + t("tolerance_clamped", lang, count=effective)
+            await event.respond(reply)
+
         @self.bot_client.on(events.NewMessage(pattern=r"^/history(?:\s|$)"))
         async def history_command(event):
             _, user_id, lang, _ = await self.register_user_if_not_exists(event)
@@ -440,8 +563,8 @@ class BotCommands:
                 await event.respond(t("not_authorized", lang))
                 return
 
-            with self._session_factory() as session:
-                products = session.query(Product).filter_by(user_id=user_id).all()
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
                 if not products:
                     await event.respond(t("no_products_short", lang))
                     return
@@ -475,24 +598,33 @@ class BotCommands:
                 chosen = product_data[idx]
 
             log.info("/history '%s' from user_id=%s", chosen["name"], user_id)
-            with self._session_factory() as session:
-                entries = (
-                    session.query(PriceHistory)
-                    .filter_by(product_id=chosen["id"])
-                    .order_by(PriceHistory.found_at.desc())
-                    .limit(10)
-                    .all()
-                )
-                if not entries:
+            async with self._session_factory() as session:
+                entries = (await session.execute(_history_query(chosen["id"]))).all()
+                # Older matches only survive as daily rollups (HISTORY_RETENTION_DAYS)
+                days = []
+                if len(entries) < _HISTORY_SHOWN:
+                    days = await daily_history(
+                        session, chosen["id"], _HISTORY_SHOWN - len(entries),
+                        before=entries[-1].found_at if entries else None,
+                    )
+                if not entries and not days:
                     await event.respond(t("history_empty", lang, product=chosen['name']))
                     return
 
-                lines = [t("history_header", lang, product=chosen['name'], count=len(entries))]
+                count = len(entries) + sum(d.match_count for d in days)
+                lines = [t("history_header", lang, product=chosen['name'], count=count)]
                 for e in entries:
-                    date_str = e.found_at[:16].replace("T", " ")
+                    date_str = format_ms(e.found_at, self.tz)
                     price_str = f"{e.price:.2f}" if e.price else "N/A"
-                    link_str = f" link" if e.message_link else ""
+                    link_str = f" link" if e.link else ""
                     lines.append(f"  {date_str} | {price_str} | {e.channel}{link_str}")
+                for d in days:
+                    if d.price_avg is not None:
+                        price_str = f"{d.price_min:.2f}-{d.price_max:.2f} (~{d.price_avg:.2f})"
+                    else:
+                        price_str = "N/A"
+                    lines.append(t("history_day", lang, date=format_ms(d.day, timezone.utc, "%Y-%m-%d"),
+                                   price=price_str, channels=", ".join(d.channels), count=d.match_count))
                 await event.respond("\n".join(lines))
 
         @self.bot_client.on(events.NewMessage(pattern=r"^/pause(?:\s|$)"))
@@ -506,11 +638,12 @@ class BotCommands:
                 return
 
             log.info("/pause from user_id=%s", user_id)
-            with self._session_factory() as session:
-                user = session.query(User).filter_by(user_id=user_id).first()
+            async with self._session_factory() as session:
+                user = await session.scalar(select(User).filter_by(user_id=user_id))
                 if user:
                     user.paused = True
-                    session.commit()
+                    await session.commit()
+            self._subscriptions.set_paused(user_id, True)
             await event.respond(t("paused", lang))
 
         @self.bot_client.on(events.NewMessage(pattern=r"^/resume(?:\s|$)"))
@@ -524,13 +657,35 @@ class BotCommands:
                 return
 
             log.info("/resume from user_id=%s", user_id)
-            with self._session_factory() as session:
-                user = session.query(User).filter_by(user_id=user_id).first()
+            async with self._session_factory() as session:
+                user = await session.scalar(select(User).filter_by(user_id=user_id))
                 if user:
                     user.paused = False
-                    session.commit()
+                    await session.commit()
+            self._subscriptions.set_paused(user_id, False)
             await event.respond(t("resumed", lang))
 
+        @self.bot_client.on(events.NewMessage(pattern=r"^/duplicates(?:\s|$)"))
+        async def duplicates_command(event):
+            _, user_id, lang, _ = await self.register_user_if_not_exists(event)
+            if user_id is None:
+                await event.respond(t("start_first", lang))
+                return
+            if not self._is_authorized(user_id):
+                await event.respond(t("not_authorized", lang))
+                return
+
+            enabled = True
+            async with self._session_factory() as session:
+                user = await session.scalar(select(User).filter_by(user_id=user_id))
+                if user:
+                    user.dedupe_deals = not user.dedupe_deals
+                    enabled = user.dedupe_deals
+                    await session.commit()
+            self._subscriptions.set_dedupe(user_id, enabled)
+            log.info("/duplicates -> %s from user_id=%s", "skip" if enabled else "notify", user_id)
+            await event.respond(t("duplicates_on" if enabled else "duplicates_off", lang))
+
         @self.bot_client.on(events.NewMessage(pattern=r"^/stats(?:\s|$)"))
         async def stats_command(event):
             _, user_id, lang, _ = await self.register_user_if_not_exists(event)
@@ -542,58 +697,66 @@ class BotCommands:
                 return
 
             log.info("/stats from user_id=%s", user_id)
-            with self._session_factory() as session:
-                from sqlalchemy import func
-                from models import UserChannel
-
-                n_products = session.query(Product).filter_by(user_id=user_id).count()
-                n_channels = session.query(UserChannel).filter_by(user_id=user_id).count()
-                n_matches = session.query(PriceHistory).filter_by(user_id=user_id).count()
+            async with self._session_factory() as session:
+                # One primary-key read of the counters kept by user_stats
+                query = (
+                    select(UserStats, Product.name)
+                    .outerjoin(Product, Product.id == UserStats.top_product_id)
+                    .where(UserStats.user_id == user_id)
+                )
+                row = (await session.execute(query)).first()
+                if row is None:
+                    await session.run_sync(rebuild_stats, [user_id])
+                    await session.commit()
+                    row = (await session.execute(query)).first()
+                stats, top_product = row
 
                 lines = [
                     t("stats_header", lang),
-                    t("stats_products", lang, count=n_products),
-                    t("stats_channels", lang, count=n_channels),
-                    t("stats_matches", lang, count=n_matches),
+                    t("stats_products", lang, count=stats.product_count),
+                    t("stats_channels", lang, count=stats.channel_count),
+                    t("stats_matches", lang, count=stats.match_count),
                 ]
-
-                if n_matches > 0:
-                    # Most matched product
-                    top = (
-                        session.query(Product.name, func.count(PriceHistory.id).label("cnt"))
-                        .join(PriceHistory, PriceHistory.product_id == Product.id)
-                        .filter(PriceHistory.user_id == user_id)
-                        .group_by(Product.name)
-                        .order_by(func.count(PriceHistory.id).desc())
-                        .first()
-                    )
-                    if top:
-                        lines.append(t("stats_top_product", lang, name=top[0], count=top[1]))
-
-                    # Most active channel
-                    top_ch = (
-                        session.query(PriceHistory.channel, func.count(PriceHistory.id).label("cnt"))
-                        .filter(PriceHistory.user_id == user_id)
-                        .group_by(PriceHistory.channel)
-                        .order_by(func.count(PriceHistory.id).desc())
-                        .first()
-                    )
-                    if top_ch:
-                        lines.append(t("stats_top_channel", lang, name=top_ch[0], count=top_ch[1]))
-
-                    # Last match
-                    last = (
-                        session.query(PriceHistory)
-                        .filter_by(user_id=user_id)
-                        .order_by(PriceHistory.found_at.desc())
-                        .first()
-                    )
-                    if last:
-                        date_str = last.found_at[:16].replace("T", " ")
-                        lines.append(t("stats_last_match", lang, date=date_str))
+                if stats.match_count > 0:
+                    if top_product:
+                        lines.append(t("stats_top_product", lang, name=top_product, count=stats.top_product_count))
+                    if stats.top_channel:
+                        lines.append(t("stats_top_channel", lang, name=stats.top_channel,
+                                       count=stats.top_channel_count))
+                    if stats.last_match_at is not None:
+                        lines.append(t("stats_last_match", lang, date=format_ms(stats.last_match_at, self.tz)))
 
                 await event.respond("\n".join(lines))
 
+        @self.bot_client.on(events.NewMessage(pattern=r"^/export(?:\s|$)"))
+        async def export_command(event):
+            _, user_id, lang, _ = await self.register_user_if_not_exists(event)
+            if user_id is None:
+                await event.respond(t("start_first", lang))
+                return
+            if not self._is_authorized(user_id):
+                await event.respond(t("not_authorized", lang))
+                return
+
+            args = (event.raw_text or "").split()[1:]
+            fmt = args[0].lower() if args else "csv"
+            if fmt not in FORMATS or len(args) > 1:
+                await event.respond(t("export_usage", lang))
+                return
+
+            log.info("/export %s from user_id=%s", fmt, user_id)
+            async with self._session_factory() as session:
+                file, rows = await export_history(session, user_id, fmt, self.tz)
+            with file:
+                if not rows:
+                    await event.respond(t("export_empty", lang))
+                    return
+                # Uploaded in parts straight from the spooled file
+                uploaded = await self.bot_client.upload_file(file, file_name=export_name(fmt))
+                await self.bot_client.send_file(
+                    event.chat_id, uploaded, force_document=True, caption=t("export_caption", lang, count=rows),
+                )
+
         @self.bot_client.on(events.NewMessage(pattern=r"^/list_categories(?:\s|$)"))
         async def list_categories_command(event):
             _, user_id, lang, _ = await self.register_user_if_not_exists(event)
@@ -604,8 +767,8 @@ class BotCommands:
                 await event.respond(t("not_authorized", lang))
                 return
 
-            with self._session_factory() as session:
-                products = session.query(Product).filter_by(user_id=user_id).all()
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
                 if not products:
                     await event.respond(t("no_products_short", lang))
                     return
@@ -0,0 +1,140 @@
+"""
+Cache of channel metadata (title, username, message link prefix) by chat id.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telethon import utils
+from telethon.tl.types import PeerChannel
+
+from models import Channel
+
+log = logging.getLogger(__name__)
+
+
+def message_link_prefix(channel_username: str | None, channel_id: int | None) -> str | None:
+    """Return the link prefix that a message id is appended to, or None if unknown."""
+    if channel_username:
+        return f"https://t.me/{channel_username}/"
+    if channel_id:
+        # For private channels: remove the -100 prefix
+        clean_id = str(channel_id)
+        if clean_id.startswith("-100"):
+            clean_id = clean_id[4:]
+        return f"https://t.me/c/{clean_id}/"
+    return None
+
+
+class ChannelInfo:
+    """What the listener needs to know about a channel."""
+
+    __slots__ = ("id", "title", "username", "link_prefix", "expires")
+
+    def __init__(self, channel_id: int | None, title: str | None, username: str | None, expires: float):
+        self.id = channel_id
+        self.title = title
+        self.username = username
+        self.link_prefix = message_link_prefix(username, channel_id)
+        self.expires = expires
+
+    @property
+    def name(self) -> str:
+        return self.title or self.username or "Unknown channel"
+
+    def link(self, message_id: int) -> str | None:
+        return f"{self.link_prefix}{message_id}" if self.link_prefix else None
+
+
+class ChannelCache:
+    """TTL + LRU cache of ChannelInfo keyed by event.chat_id.
+
+    Entries are refreshed with get_chat() once they are older than ttl
+    seconds; at most max_size channels are kept. Titles and chat ids are
+    written to the channels table, and load() reads them back so a restart
+    does not start cold.
+    """
+
+    def __init__(
+        self,
+        db_session_factory: async_sessionmaker | None = None,
+        ttl: float = 3600,
+        max_size: int = 1024,
+        clock=time.monotonic,
+    ):
+        self._session_factory = db_session_factory
+        self.ttl = ttl
+        self.max_size = max_size
+        self._clock = clock
+        self._entries: OrderedDict[int, ChannelInfo] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def load(self) -> None:
+        """Warm the cache with the channels whose chat id is known."""
+        if self._session_factory is None:
+            return
+        async with self._session_factory() as session:
+            rows = (await session.execute(
+                select(Channel.chat_id, Channel.identifier, Channel.title).where(Channel.chat_id.isnot(None))
+            )).all()
+        expires = self._clock() + self.ttl
+        for chat_id, identifier, title in rows[-self.max_size:]:
+            username = None if identifier.lstrip("-").isdigit() else identifier
+            key = utils.get_peer_id(PeerChannel(chat_id))
+            self._entries[key] = ChannelInfo(chat_id, title, username, expires)
+        log.info("Channel cache warmed with %d channels", len(self._entries))
+
+    def peek(self, chat_id: int) -> ChannelInfo | None:
+        """Return the cached metadata of a channel without fetching or touching the LRU order."""
+        return self._entries.get(chat_id)
+
+    async def get(self, event) -> ChannelInfo:
+        """Return the metadata of the event's channel, calling get_chat() only on a miss."""
+        return await self.get_by_id(event.chat_id, event.get_chat)
+
+    async def get_by_id(self, chat_id: int, fetch) -> ChannelInfo:
+        """Return the metadata of a channel by chat id; await fetch() for the chat on a miss."""
+        key = chat_id
+        info = self._entries.get(key)
+        now = self._clock()
+        if info is not None and info.expires > now:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return info
+
+        self.misses += 1
+        chat = await fetch()
+        fresh = ChannelInfo(
+            getattr(chat, "id", None), getattr(chat, "title", None), getattr(chat, "username", None),
+            now + self.ttl,
+        )
+        self._entries[key] = fresh
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        if info is None or (info.title, info.username, info.id) != (fresh.title, fresh.username, fresh.id):
+            await self._persist(fresh)
+        return fresh
+
+    async def _persist(self, info: ChannelInfo) -> None:
+        if self._session_factory is None or info.id is None:
+            return
+        identifiers = [str(info.id)] + ([info.username] if info.username else [])
+        values = {"chat_id": info.id}
+        if info.title:
+            values["title"] = info.title
+        try:
+            async with self._session_factory() as session:
+                await session.execute(
+                    update(Channel).where(Channel.identifier.in_(identifiers)).values(**values)
+                )
+                await session.commit()
+        except Exception as e:
+            log.error("Error saving metadata of channel %s: %s", info.id, e)
@@ -2,62 +2,25 @@
 Listen to monitored channel messages and notify users on product matches.
 """
 
-import re
+import functools
 import logging
+import time
 from telethon import events, TelegramClient
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 log = logging.getLogger(__name__)
 
-from models import Product, Channel, UserChannel, User, PriceHistory
-from price_parser import extract_prices
+from channel_cache import ChannelCache
+from dedup import DealDeduplicator
+from history_writer import PriceHistoryWriter
+from ingest_queue import IngestQueue, IngestRecord
+from metrics import INGEST_DELAY_SECONDS, MATCHES, MESSAGES, STAGE_SECONDS
+from matcher import PreparedMessage, check_price_match, check_product_match  # noqa: F401
+from notifier import NotificationDispatcher, PRIORITY_MATCH, PRIORITY_TARGET
+from subscriptions import SubscriptionIndex
 from translations import t, DEFAULT_LANGUAGE
 
 
-def _normalize(text: str) -> str:
-    """Normalize text for fuzzy matching: lowercase, remove hyphens/underscores, collapse spaces."""
-    text = text.lower()
-    text = re.sub(r"[-_]", "", text)
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
-
-
-def check_product_match(product: Product, message_text: str) -> dict | None:
-    """Check if a message matches a product.
-
-    Returns a dict with notification info, or None if no match.
-    """
-    text_norm = _normalize(message_text)
-    product_norm = _normalize(product.name)
-    if product_norm not in text_norm:
-        return None
-
-    if product.target_price is not None:
-        prices = extract_prices(message_text)
-        if not prices or min(prices) > product.target_price:
-            return None
-        return {
-            "matched": True,
-            "price_found": min(prices),
-            "target_price": product.target_price,
-        }
-
-    return {"matched": True, "price_found": None, "target_price": None}
-
-
-def _build_message_link(channel_username: str | None, channel_id: int | None, message_id: int) -> str | None:
-    """Build a direct link to a channel message."""
-    if channel_username:
-        return f"https://t.me/{channel_username}/{message_id}"
-    if channel_id:
-        # For private channels: remove the -100 prefix
-        clean_id = str(channel_id)
-        if clean_id.startswith("-100"):
-            clean_id = clean_id[4:]
-        return f"https://t.me/c/{clean_id}/{message_id}"
-    return None
-
-
 class ChannelListener:
     """Listen to new messages in channels and check for product matches."""
 
@@ -65,14 +28,27 @@ class ChannelListener:
         self,
         client: TelegramClient,
         bot_client: TelegramClient,
-        db_session_factory: sessionmaker,
+        db_session_factory: async_sessionmaker,
+        subscriptions: SubscriptionIndex,
+        deduplicator: DealDeduplicator = None,
+        history_writer: PriceHistoryWriter = None,
+        notifier: NotificationDispatcher = None,
+        channel_cache: ChannelCache = None,
+        ingest_queue: IngestQueue = None,
     ):
         self.client = client
         self.bot_client = bot_client
         self._session_factory = db_session_factory
+        self._subscriptions = subscriptions
+        self._deduplicator = deduplicator if deduplicator is not None else DealDeduplicator()
+        self._history = history_writer if history_writer is not None else PriceHistoryWriter(db_session_factory)
+        self._notifier = notifier if notifier is not None else NotificationDispatcher(bot_client)
+        self._channels = channel_cache if channel_cache is not None else ChannelCache(db_session_factory)
+        self._queue = ingest_queue if ingest_queue is not None else IngestQueue()
 
     def register(self):
-        """Register the handler for new channel messages."""
+        """Register the handler for new channel messages and start the queue consumers."""
+        self._queue.start(self.process)
 
         @self.client.on(events.NewMessage(func=lambda e: e.is_channel))
         async def on_channel_message(event):
@@ -80,69 +56,102 @@ class ChannelListener:
             if not text:
                 return
 
-            chat = await event.get_chat()
-            channel_name = getattr(chat, "title", None) or getattr(chat, "username", None) or "Unknown channel"
-            channel_username = getattr(chat, "username", None)
-            channel_id = getattr(chat, "id", None)
-            message_id = event.id
-            log.info("Message from channel '%s' (@%s): %s", channel_name, channel_username, text[:80])
-
-            message_link = _build_message_link(channel_username, channel_id, message_id)
-
-            with self._session_factory() as session:
-                # Filter products only for users subscribed to this channel and not paused
-                # Match by username or numeric channel ID
-                possible_ids = []
-                if channel_username:
-                    possible_ids.append(channel_username)
-                if channel_id:
-                    possible_ids.append(str(channel_id))
-
-                if possible_ids:
-                    products = (
-                        session.query(Product, User.lang_code)
-                        .join(UserChannel, UserChannel.user_id == Product.user_id)
-                        .join(Channel, Channel.id == UserChannel.channel_id)
-                        .join(User, User.user_id == Product.user_id)
-                        .filter(Channel.identifier.in_(possible_ids))
-                        .filter(User.paused == False)  # noqa: E712
-                        .all()
-                    )
-                else:
-                    products = []
-
-                for product, user_lang_code in products:
-                    lang = user_lang_code or DEFAULT_LANGUAGE
-                    result = check_product_match(product, text)
-                    if result is None:
-                        continue
-
-                    # Save to price history
-                    session.add(PriceHistory(
-                        product_id=product.id,
-                        user_id=product.user_id,
-                        price=result["price_found"],
-                        channel=channel_name,
-                        message_text=text[:500],
-                        message_link=message_link,
-                        source="realtime",
-                    ))
-                    session.commit()
-
-                    if result["price_found"] is not None:
-                        price_line = t("notify_price_line", lang, price=result['price_found'], target=result['target_price'])
-                    else:
-                        price_line = ""
-
-                    link_line = t("notify_link_line", lang, link=message_link) if message_link else ""
-
-                    notification = t(
-                        "notify_match", lang,
-                        product=product.name, channel=channel_name,
-                        price_line=price_line, text=text, link_line=link_line,
-                    )
-                    log.info("MATCH '%s' for user_id=%s in '%s'", product.name, product.user_id, channel_name)
-                    try:
-                        await self.bot_client.send_message(product.user_id, notification)
-                    except Exception as e:
-                        log.error("Error sending notification to %s: %s", product.user_id, e)
+            MESSAGES.inc(path="realtime")
+            posted = getattr(event.message, "date", None)
+            origin = posted.timestamp() if posted else None
+            if origin is not None:
+                INGEST_DELAY_SECONDS.observe(max(0.0, time.time() - origin))
+
+            # Only enqueue here: matching runs in the queue's consumer tasks
+            cached = self._channels.peek(event.chat_id)
+            low_priority = self._queue.is_low_priority(event.chat_id, cached.username if cached else None)
+            await self._queue.put(IngestRecord(event.chat_id, event.id, text, origin, low_priority))
+
+    async def process(self, record: IngestRecord):
+        """Match a queued channel message and notify the subscribed users."""
+        STAGE_SECONDS.observe(time.perf_counter() - record.queued_at, path="realtime", stage="ingest_queue")
+        text = record.text
+        origin = record.origin
+
+        with STAGE_SECONDS.time(path="realtime", stage="get_chat"):
+            channel = await self._channels.get_by_id(
+                record.chat_id, functools.partial(self.client.get_entity, record.chat_id)
+            )
+        channel_name = channel.name
+        channel_username = channel.username
+        channel_id = channel.id
+        log.info("Message from channel '%s' (@%s): %s", channel_name, channel_username, text[:80])
+
+        message_link = channel.link(record.message_id)
+
+        # Only active products of users subscribed to this channel are indexed
+        products = self._subscriptions.channel_products(channel_username, channel_id)
+        if not products:
+            return
+        message = PreparedMessage(text)
+
+        # Deals forwarded across channels are matched and notified once per product;
+        # an exact copy of a deal already sighted is known without matching it again
+        deal = self._deduplicator.repeat(message, channel_name)
+        if deal is not None and deal.settled(products, self._subscriptions.dedupe_enabled):
+            log.info("Duplicate deal in '%s': its products were already checked", channel_name)
+            return
+
+        # Messages none of the products can match are dropped by the channel's prefilter
+        with STAGE_SECONDS.time(path="realtime", stage="match"):
+            matches = await self._subscriptions.match_message(channel_username, channel_id, message)
+        if not matches:
+            if deal is not None:
+                deal.checked.update(products)
+            return
+        if deal is None:
+            # Fingerprinted only once it matched: most channel chatter never gets here
+            with STAGE_SECONDS.time(path="realtime", stage="dedup"):
+                deal = self._deduplicator.sighting(message, channel_name)
+        if deal is not None:
+            deal.checked.update(products)
+
+        started = time.perf_counter()
+        for product in matches:
+            lang = product.lang_code or DEFAULT_LANGUAGE
+            result = check_price_match(product, message)
+            if result is None:
+                continue
+
+            if deal is not None:
+                if product.id in deal.notified and self._subscriptions.dedupe_enabled(product.user_id):
+                    log.info("Duplicate '%s' for user_id=%s in '%s': sighting only",
+                             product.name, product.user_id, channel_name)
+                    continue
+                deal.notified.add(product.id)
+
+            # Save to price history (written in batches, the notification doesn't wait)
+            self._history.add(
+                product_id=product.id,
+                user_id=product.user_id,
+                price=result["price_found"],
+                chat_id=record.chat_id,
+                message_id=record.message_id,
+                channel=channel_name,
+                message_text=text[:500],
+                message_link=message_link,
+                source="realtime",
+            )
+
+            if result["price_found"] is not None:
+                price_line = t("notify_price_line", lang, price=result['price_found'], target=result['target_price'])
+            else:
+                price_line = ""
+
+            link_line = t("notify_link_line", lang, link=message_link) if message_link else ""
+
+            notification = t(
+                "notify_match", lang,
+                product=product.name, channel=channel_name,
+                price_line=price_line, text=text, link_line=link_line,
+            )
+            log.info("MATCH '%s' for user_id=%s in '%s'", product.name, product.user_id, channel_name)
+            priority = PRIORITY_TARGET if result["target_price"] is not None else PRIORITY_MATCH
+            self._notifier.send(product.user_id, notification, priority, origin=origin)
+            MATCHES.inc(path="realtime")
+        STAGE_SECONDS.observe(time.perf_counter() - started, path="realtime", stage="notify")
@@ -3,35 +3,66 @@ Telegram user client commands (join/leave channels, backfill).
 """
 
 import logging
-from telethon import TelegramClient
+import time
+from telethon import TelegramClient, utils
 
 log = logging.getLogger(__name__)
+
+# Backfilled messages are matched in batches, with one price scan per batch
+_BACKFILL_BATCH = 100
+
 from telethon.tl.functions.channels import LeaveChannelRequest, JoinChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest, CheckChatInviteRequest
 from telethon.errors import RPCError, FloodWaitError, UserAlreadyParticipantError
-from sqlalchemy.orm import Session, sessionmaker
-from models import UserChannel, Channel, Product, PriceHistory, User
-from channel_listener import check_product_match
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from channel_cache import message_link_prefix
+from config import Config
+from dedup import DealDeduplicator
+from history_writer import PriceHistoryWriter
+from fuzzy import FuzzyMatcher
+from models import UserChannel, Channel, Product, User
+from metrics import MATCHES, MESSAGES, PREFILTER_SKIPPED, STAGE_SECONDS
+from matcher import PreparedMessage, ProductMatcher, ProductRecord, check_price_match
+from notifier import NotificationDispatcher, PRIORITY_BACKFILL
+from prefilter import MessagePrefilter
+from price_parser import extract_prices_many
+from subscriptions import SubscriptionIndex
 from translations import t, DEFAULT_LANGUAGE
+from user_stats import add_counts
 
 
 class ClientCommands:
     """Telegram user client operations (channel management, backfill)."""
 
-    def __init__(self, client: TelegramClient, db_session_factory: sessionmaker, bot_client: TelegramClient = None):
+    def __init__(
+        self,
+        client: TelegramClient,
+        db_session_factory: async_sessionmaker,
+        bot_client: TelegramClient = None,
+        subscriptions: SubscriptionIndex = None,
+        deduplicator: DealDeduplicator = None,
+        history_writer: PriceHistoryWriter = None,
+        notifier: NotificationDispatcher = None,
+    ):
         self.client = client
         self._session_factory = db_session_factory
         self.bot_client = bot_client
+        self._subscriptions = subscriptions if subscriptions is not None else SubscriptionIndex()
+        self._deduplicator = deduplicator if deduplicator is not None else DealDeduplicator()
+        self._history = history_writer if history_writer is not None else PriceHistoryWriter(db_session_factory)
+        if notifier is None and bot_client is not None:
+            notifier = NotificationDispatcher(bot_client)
+        self._notifier = notifier
 
     async def list_channels(self, user_id: int) -> list[str]:
         """Return the list of channels associated with the given user."""
-        with self._session_factory() as session:
-            user_channels = (
-                session.query(Channel.identifier, Channel.title)
+        async with self._session_factory() as session:
+            user_channels = (await session.execute(
+                select(Channel.identifier, Channel.title)
                 .join(UserChannel, UserChannel.channel_id == Channel.id)
-                .filter(UserChannel.user_id == user_id)
-                .all()
-            )
+                .where(UserChannel.user_id == user_id)
+            )).all()
             result = []
             for ch in user_channels:
                 if ch.title:
@@ -48,6 +79,7 @@ class ClientCommands:
         db_identifier = channel_identifier
         display_name = channel_identifier
         channel_title = None
+        channel_chat_id = None
 
         try:
             if invite_hash:
@@ -60,37 +92,41 @@ class ClientCommands:
 
                 db_identifier = str(chat.id)
                 channel_title = getattr(chat, "title", None)
+                channel_chat_id = chat.id
                 display_name = channel_title or f"Channel {db_identifier}"
             else:
                 await self.client(JoinChannelRequest(channel_identifier))
                 try:
                     entity = await self.client.get_entity(channel_identifier)
                     channel_title = getattr(entity, "title", None)
+                    channel_chat_id = getattr(entity, "id", None)
                 except Exception:
                     pass
         except RPCError as e:
             log.error("JoinChannel error for '%s': %s", channel_identifier or invite_hash, e)
             return False, t("join_channel_failed", lang), ""
 
-        with self._session_factory() as session:
-            channel_db = session.query(Channel).filter_by(
-                identifier=db_identifier).one_or_none()
+        async with self._session_factory() as session:
+            channel_db = await session.scalar(select(Channel).filter_by(identifier=db_identifier))
             if channel_db is None:
-                channel_db = Channel(identifier=db_identifier, title=channel_title)
+                channel_db = Channel(identifier=db_identifier, title=channel_title, chat_id=channel_chat_id)
                 session.add(channel_db)
-                session.flush()
-            elif channel_title and not channel_db.title:
-                channel_db.title = channel_title
-
-            link_exists = (
-                session.query(UserChannel)
-                .filter_by(user_id=user_id, channel_id=channel_db.id)
-                .first()
+                await session.flush()
+            else:
+                if channel_title and not channel_db.title:
+                    channel_db.title = channel_title
+                if channel_chat_id and not channel_db.chat_id:
+                    channel_db.chat_id = channel_chat_id
+
+            link_exists = await session.scalar(
+                select(UserChannel).filter_by(user_id=user_id, channel_id=channel_db.id)
             )
             if link_exists is None:
                 session.add(UserChannel(user_id=user_id, channel_id=channel_db.id))
+                await session.run_sync(add_counts, user_id, channels=1)
 
-            session.commit()
+            await session.commit()
+        self._subscriptions.subscribe(user_id, db_identifier)
 
         return True, t("join_channel_success", lang, channel=display_name), db_identifier
 
@@ -99,84 +135,120 @@ class ClientCommands:
 
         Returns the number of matches found.
         """
-        import asyncio
-
-        with self._session_factory() as session:
-            products = session.query(Product).filter_by(user_id=user_id).all()
-            if not products:
-                return 0
-            product_data = [{"id": p.id, "name": p.name, "target_price": p.target_price, "user_id": p.user_id} for p in products]
-            user = session.query(User).filter_by(user_id=user_id).first()
-            user_lang = user.lang_code if user else DEFAULT_LANGUAGE
+        with STAGE_SECONDS.time(path="backfill", stage="db_read"):
+            async with self._session_factory() as session:
+                products = (await session.scalars(select(Product).filter_by(user_id=user_id))).all()
+                user = await session.scalar(select(User).filter_by(user_id=user_id))
+        if not products:
+            return 0
+        user_lang = user.lang_code if user else DEFAULT_LANGUAGE
+        records = {
+            p.id: ProductRecord.create(
+                p.id, p.user_id, p.name, p.target_price, user_lang,
+                typo_tolerance=p.typo_tolerance if Config.FUZZY_MATCHING else 0,
+            )
+            for p in products
+        }
+        prefilter = MessagePrefilter(records.values())
+        matcher = ProductMatcher()
+        fuzzy = FuzzyMatcher()
+        for record in records.values():
+            matcher.add(record.id, record.name)
+            if record.typo_tolerance:
+                fuzzy.add(record.id, record.name_norm, record.typo_tolerance)
 
         matches_found = 0
         try:
             # Resolve entity: numeric ID or username
-            try:
-                entity = await self.client.get_entity(int(channel_identifier))
-            except (ValueError, TypeError):
-                entity = await self.client.get_entity(channel_identifier)
+            with STAGE_SECONDS.time(path="backfill", stage="get_chat"):
+                try:
+                    entity = await self.client.get_entity(int(channel_identifier))
+                except (ValueError, TypeError):
+                    entity = await self.client.get_entity(channel_identifier)
             channel_name = getattr(entity, "title", channel_identifier)
-            channel_username = getattr(entity, "username", None)
-            channel_id = getattr(entity, "id", None)
-
-            async for message in self.client.iter_messages(entity, limit=limit):
-                if not message.text:
-                    continue
-
-                for pd in product_data:
-                    # Create a Product-like object for check_product_match
-                    class _FakeProduct:
-                        pass
-                    fp = _FakeProduct()
-                    fp.name = pd["name"]
-                    fp.target_price = pd["target_price"]
-
-                    result = check_product_match(fp, message.text)
-                    if result is None:
+            link_prefix = message_link_prefix(getattr(entity, "username", None), getattr(entity, "id", None))
+            chat_id = utils.get_peer_id(entity)  # marked id, as event.chat_id in the listener
+
+            def scan(batch: list) -> None:
+                nonlocal matches_found
+                started = time.perf_counter()
+                prices = extract_prices_many([message.text for message in batch])
+                for i, message in enumerate(batch):
+                    prepared = PreparedMessage(message.text, prices[i])
+                    deal = self._deduplicator.repeat(prepared, channel_name)
+                    if deal is not None:
+                        if deal.settled(records, self._subscriptions.dedupe_enabled):
+                            continue
+                        deal.checked.update(records)
+                    skip = prefilter.check(prepared)
+                    if skip is not None:
+                        PREFILTER_SKIPPED.inc(reason=skip)
                         continue
+                    matched_ids = matcher.find(prepared.norm) | fuzzy.find(prepared.norm, prepared.grams)
+                    if matched_ids and deal is None:
+                        deal = self._deduplicator.sighting(prepared, channel_name)
+                        if deal is not None:
+                            deal.checked.update(records)
+                    prepared.mentioned = {records[product_id].name_norm for product_id in matched_ids}
+                    for product_id in sorted(matched_ids):
+                        product = records[product_id]
+                        result = check_price_match(product, prepared)
+                        if result is None:
+                            continue
+
+                        if deal is not None:
+                            if product.id in deal.notified and self._subscriptions.dedupe_enabled(user_id):
+                                continue
+                            deal.notified.add(product.id)
+
+                        msg_link = f"{link_prefix}{message.id}" if link_prefix else None
 
-                    # Build message link
-                    msg_link = None
-                    if channel_username:
-                        msg_link = f"https://t.me/{channel_username}/{message.id}"
-                    elif channel_id:
-                        clean_id = str(channel_id)
-                        if clean_id.startswith("-100"):
-                            clean_id = clean_id[4:]
-                        msg_link = f"https://t.me/c/{clean_id}/{message.id}"
-
-                    with self._session_factory() as session:
-                        session.add(PriceHistory(
-                            product_id=pd["id"],
-                            user_id=pd["user_id"],
+                        self._history.add(
+                            product_id=product.id,
+                            user_id=product.user_id,
                             price=result["price_found"],
+                            chat_id=chat_id,
+                            message_id=message.id,
                             channel=channel_name,
                             message_text=message.text[:500],
                             message_link=msg_link,
                             source="backfill",
-                        ))
-                        session.commit()
-
-                    matches_found += 1
-
-                    # Notify via bot
-                    if self.bot_client:
-                        if result["price_found"] is not None:
-                            price_line = t("notify_backfill_price_line", user_lang, price=result['price_found'], target=result['target_price'])
-                        else:
-                            price_line = ""
-                        link_line = f"\n\n {msg_link}" if msg_link else ""
-                        notification = t(
-                            "notify_backfill_match", user_lang,
-                            product=pd['name'], channel=channel_name,
-                            price_line=price_line, text=message.text[:300], link_line=link_line,
                         )
-                        try:
-                            await self.bot_client.send_message(pd["user_id"], notification)
-                            await asyncio.sleep(0.5)  # Rate limit
-                        except Exception as e:
-                            log.error("Error sending backfill notification: %s", e)
+
+                        matches_found += 1
+                        MATCHES.inc(path="backfill")
+
+                        # Notify via bot
+                        if self._notifier:
+                            if result["price_found"] is not None:
+                                price_line = t("notify_backfill_price_line", user_lang, price=result['price_found'], target=result['target_price'])
+                            else:
+                                price_line = ""
+                            link_line = f"\n\n {msg_link}" if msg_link else ""
+                            notification = t(
+                                "notify_backfill_match", user_lang,
+                                product=product.name, channel=channel_name,
+                                price_line=price_line, text=message.text[:300], link_line=link_line,
+                            )
+                            self._notifier.send(product.user_id, notification, PRIORITY_BACKFILL)
+                STAGE_SECONDS.observe(time.perf_counter() - started, path="backfill", stage="match")
+
+            batch = []
+            try:
+                fetch_started = time.perf_counter()
+                async for message in self.client.iter_messages(entity, limit=limit):
+                    STAGE_SECONDS.observe(time.perf_counter() - fetch_started, path="backfill", stage="fetch")
+                    if message.text:
+                        MESSAGES.inc(path="backfill")
+                        batch.append(message)
+                        if len(batch) >= _BACKFILL_BATCH:
+                            scan(batch)
+                            batch = []
+                    fetch_started = time.perf_counter()
+            finally:
+                # Messages fetched before a FloodWait/RPC error are still scanned
+                if batch:
+                    scan(batch)
 
         except FloodWaitError as e:
             log.warning("FloodWait during backfill: waiting %ds", e.seconds)
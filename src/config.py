@@ -26,6 +26,19 @@ class Config:
     CLIENT_SESSION_NAME = str(DATA_DIR / os.getenv("CLIENT_SESSION_NAME", "client_session"))
     CLIENT_SESSION_STRING = os.getenv("CLIENT_SESSION_STRING", "")
     DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DATA_DIR / 'db.sqlite3'}")
+    # Connection pool per engine for server databases (PostgreSQL)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+    # SQLite pragmas applied on every new connection (empty value = SQLite default)
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").strip()
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip()
+    SQLITE_MMAP_SIZE = os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)).strip()
+    SQLITE_CACHE_SIZE = os.getenv("SQLITE_CACHE_SIZE", "-65536").strip()  # negative = KiB
+    SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY").strip()
+    SQLITE_BUSY_TIMEOUT_MS = os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000").strip()
+    SQLITE_FOREIGN_KEYS = os.getenv("SQLITE_FOREIGN_KEYS", "true").strip().lower() in ("1", "true", "yes")
     PHONE_NUMBER = os.getenv("PHONE_NUMBER", "")
     USERNAME = os.getenv("USERNAME", "")
     ALLOWED_USERS = [
@@ -35,3 +48,24 @@ class Config:
     ]
     TIMEZONE = os.getenv("TIMEZONE", "UTC")
     DAILY_SUMMARY_HOUR = int(os.getenv("DAILY_SUMMARY_HOUR", "21"))
+    DEDUP_WINDOW_MINUTES = int(os.getenv("DEDUP_WINDOW_MINUTES", "60"))
+    HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+    HISTORY_FLUSH_SECONDS = float(os.getenv("HISTORY_FLUSH_SECONDS", "1.0"))
+    HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "0"))  # 0 = keep raw rows forever
+    HISTORY_PRUNE_BATCH = int(os.getenv("HISTORY_PRUNE_BATCH", "500"))
+    HISTORY_PRUNE_INTERVAL_MINUTES = int(os.getenv("HISTORY_PRUNE_INTERVAL_MINUTES", "60"))
+    NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+    NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+    NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+    CHANNEL_CACHE_TTL_MINUTES = int(os.getenv("CHANNEL_CACHE_TTL_MINUTES", "60"))
+    MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", "0"))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+    INGEST_CONSUMERS = int(os.getenv("INGEST_CONSUMERS", "4"))
+    INGEST_OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "block").strip().lower()
+    LOW_PRIORITY_CHANNELS = [
+        c.strip() for c in os.getenv("LOW_PRIORITY_CHANNELS", "").split(",") if c.strip()
+    ]
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+    FUZZY_MATCHING = os.getenv("FUZZY_MATCHING", "false").strip().lower() in ("1", "true", "yes")
@@ -3,52 +3,419 @@ Database configuration and migrations.
 """
 
 import logging
+from contextlib import contextmanager
+
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import BigInteger, Integer, MetaData, Table, create_engine, event, inspect, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from config import Config as config
+from timestamps import iso_to_ms
 
 log = logging.getLogger(__name__)
 
 DATABASE_URL = config.DATABASE_URL
 
-_connect_args = {}
-if DATABASE_URL.startswith("sqlite"):
-    _connect_args["check_same_thread"] = False
-engine = create_engine(DATABASE_URL, connect_args=_connect_args, pool_pre_ping=True)
+
+def sync_url(url: str) -> str:
+    """Return the URL with the sync driver used here (postgresql -> psycopg 3)."""
+    for prefix in ("postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix):]
+    return url
+
+
+def async_url(url: str) -> str:
+    """Return the asyncio-driver variant of a database URL (sqlite -> aiosqlite, postgresql -> asyncpg)."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql://", "postgres://", "postgresql+psycopg://", "postgresql+psycopg2://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+def engine_options(url: str, pool_size: int | None = None) -> dict:
+    """create_engine() keyword arguments for the backend of url.
+
+    SQLite connections are shared across threads (aiosqlite, the sync
+    startup code). Server databases get a bounded pool: with several bot
+    instances on one Postgres, each opens at most pool_size + max_overflow
+    connections per engine.
+    """
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}, "pool_pre_ping": True}
+    return {
+        "pool_size": pool_size if pool_size is not None else config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+    }
+
+
+# The sync engine only serves startup and scripts: a small pool is enough
+engine = create_engine(sync_url(DATABASE_URL), **engine_options(DATABASE_URL, pool_size=2))
+
+
+def sqlite_pragmas() -> list[tuple[str, str]]:
+    """The SQLite tuning profile from the config, as (pragma, value) pairs.
+
+    WAL lets bot command reads run while the listener commits;
+    synchronous=NORMAL is durable in WAL mode except for the last commits
+    on power loss. foreign_keys makes the ondelete="CASCADE" clauses work.
+    """
+    pragmas = [
+        ("journal_mode", config.SQLITE_JOURNAL_MODE),
+        ("synchronous", config.SQLITE_SYNCHRONOUS),
+        ("mmap_size", config.SQLITE_MMAP_SIZE),
+        ("cache_size", config.SQLITE_CACHE_SIZE),
+        ("temp_store", config.SQLITE_TEMP_STORE),
+        ("busy_timeout", config.SQLITE_BUSY_TIMEOUT_MS),
+        ("foreign_keys", "ON" if config.SQLITE_FOREIGN_KEYS else "OFF"),
+    ]
+    return [(name, value) for name, value in pragmas if value]
+
+
+def apply_sqlite_pragmas(bind, pragmas=None) -> None:
+    """Run the pragmas on every new connection of a (sync) SQLite engine; no-op for other databases."""
+    if bind.dialect.name != "sqlite":
+        return
+    pragmas = list(sqlite_pragmas() if pragmas is None else pragmas)
+
+    @event.listens_for(bind, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+apply_sqlite_pragmas(engine)
 
 Base = declarative_base()
 
+# Sync sessions: startup (migrations, index load), CLI scripts and tests
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
-def run_migrations():
-    """Add missing columns to existing tables (SQLite)."""
-    inspector = inspect(engine)
-    with engine.begin() as conn:
-        # users.paused
-        if "users" in inspector.get_table_names():
-            cols = [c["name"] for c in inspector.get_columns("users")]
-            if "paused" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN paused BOOLEAN NOT NULL DEFAULT 0"))
-                log.info("Migration: added column users.paused")
-
-        # users.lang_code
-        if "users" in inspector.get_table_names():
-            cols = [c["name"] for c in inspector.get_columns("users")]
-            if "lang_code" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN lang_code VARCHAR NOT NULL DEFAULT 'en'"))
-                log.info("Migration: added column users.lang_code")
-
-        # products.category
-        if "products" in inspector.get_table_names():
-            cols = [c["name"] for c in inspector.get_columns("products")]
-            if "category" not in cols:
-                conn.execute(text("ALTER TABLE products ADD COLUMN category VARCHAR"))
-                log.info("Migration: added column products.category")
-
-        # channels.title
-        if "channels" in inspector.get_table_names():
-            cols = [c["name"] for c in inspector.get_columns("channels")]
-            if "title" not in cols:
-                conn.execute(text("ALTER TABLE channels ADD COLUMN title VARCHAR"))
-                log.info("Migration: added column channels.title")
+# Async sessions: everything that runs on the event loop
+async_engine = create_async_engine(async_url(DATABASE_URL), **engine_options(DATABASE_URL))
+apply_sqlite_pragmas(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Bumped by every entry appended to _MIGRATIONS
+SCHEMA_VERSION = 7
+
+# Columns added before migrations were versioned: (table, column, DDL type)
+_LEGACY_COLUMNS = [
+    ("users", "paused", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("users", "lang_code", "VARCHAR NOT NULL DEFAULT 'en'"),
+    ("users", "dedupe_deals", "BOOLEAN NOT NULL DEFAULT TRUE"),
+    ("products", "category", "VARCHAR"),
+    ("products", "typo_tolerance", "INTEGER NOT NULL DEFAULT 0"),
+    ("channels", "title", "VARCHAR"),
+    ("channels", "chat_id", "BIGINT"),
+]
+
+
+def _migrate_legacy_columns(conn) -> None:
+    """Add the columns that older databases may lack (the only introspection left)."""
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    for table, column, ddl in _LEGACY_COLUMNS:
+        if table not in tables:
+            continue
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            log.info("Migration: added column %s.%s", table, column)
+
+
+def _migrate_composite_indexes(conn) -> None:
+    """Composite indexes for the hot queries; they supersede the single-column ones."""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_price_history_user_found ON price_history (user_id, found_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_price_history_product_found ON price_history (product_id, found_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_channels_channel_user ON user_channels (channel_id, user_id)"
+    ))
+    conn.execute(text("DROP INDEX IF EXISTS ix_price_history_user_id"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_price_history_product_id"))
+
+
+# ISO 8601 string columns turned into epoch-millisecond integers
+_EPOCH_COLUMNS = [
+    ("users", "added_at"),
+    ("channels", "added_at"),
+    ("products", "added_at"),
+    ("price_history", "found_at"),
+]
+
+# Rows copied per round trip when a table is rebuilt
+_COPY_CHUNK = 5000
+
+
+def _rebuild_with_epoch_column(conn, name: str, column: str) -> None:
+    """Rebuild a table with column as BIGINT epoch ms, converting rows in id chunks.
+
+    SQLite can't change a column's type in place (and a TEXT column would
+    store integers as text), so the table is copied into a new one, which
+    then takes its name and indexes.
+    """
+    metadata = MetaData()  # shared, so foreign keys of the copy resolve to the reflected parents
+    old = Table(name, metadata, autoload_with=conn)
+    if isinstance(old.c[column].type, Integer):
+        return
+    new = old.to_metadata(metadata, name=f"{name}_new")
+    new.c[column].type = BigInteger()
+    new.indexes.clear()
+    new.create(conn)
+
+    copied, last_id = 0, None
+    while True:
+        query = select(old).order_by(old.c.id).limit(_COPY_CHUNK)
+        if last_id is not None:
+            query = query.where(old.c.id > last_id)
+        rows = [dict(row) for row in conn.execute(query).mappings()]
+        if not rows:
+            break
+        for row in rows:
+            row[column] = iso_to_ms(row[column])
+        conn.execute(new.insert(), rows)
+        copied += len(rows)
+        last_id = rows[-1]["id"]
+
+    old.drop(conn)
+    conn.execute(text(f"ALTER TABLE {name}_new RENAME TO {name}"))
+    for index in old.indexes:
+        index.create(conn)
+    log.info("Migration: %s.%s converted to epoch ms (%d rows)", name, column, copied)
+
+
+def _swap_epoch_column(conn, name: str, column: str) -> None:
+    """Convert column to BIGINT epoch ms through a new column filled in id chunks (not SQLite).
+
+    Dropping the old column drops its indexes, which are recreated on the
+    new one.
+    """
+    inspector = inspect(conn)
+    if isinstance(next(c["type"] for c in inspector.get_columns(name) if c["name"] == column), Integer):
+        return
+    indexes = [ix for ix in inspector.get_indexes(name) if column in ix["column_names"]]
+    conn.execute(text(f"ALTER TABLE {name} ADD COLUMN {column}_ms BIGINT"))
+    converted, last_id = 0, 0
+    while True:
+        rows = conn.execute(text(
+            f"SELECT id, {column} FROM {name} WHERE id > :last ORDER BY id LIMIT :n"
+        ), {"last": last_id, "n": _COPY_CHUNK}).all()
+        if not rows:
+            break
+        conn.execute(text(f"UPDATE {name} SET {column}_ms = :ms WHERE id = :id"),
+                     [{"id": row_id, "ms": iso_to_ms(value)} for row_id, value in rows])
+        converted += len(rows)
+        last_id = rows[-1][0]
+    conn.execute(text(f"ALTER TABLE {name} DROP COLUMN {column}"))
+    conn.execute(text(f"ALTER TABLE {name} RENAME COLUMN {column}_ms TO {column}"))
+    conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {column} SET NOT NULL"))
+    for ix in indexes:
+        conn.execute(text(f"CREATE INDEX {ix['name']} ON {name} ({', '.join(ix['column_names'])})"))
+    log.info("Migration: %s.%s converted to epoch ms (%d rows)", name, column, converted)
+
+
+def _migrate_epoch_timestamps(conn) -> None:
+    """Store added_at/found_at as integer epoch milliseconds instead of ISO strings."""
+    tables = set(inspect(conn).get_table_names())
+    convert = _rebuild_with_epoch_column if conn.dialect.name == "sqlite" else _swap_epoch_column
+    for name, column in _EPOCH_COLUMNS:
+        if name in tables:
+            convert(conn, name, column)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_price_history_found_at ON price_history (found_at)"))
+
+
+def _migrate_orphan_rows(conn) -> None:
+    """Delete rows whose parent was removed while foreign keys weren't enforced."""
+    statements = [
+        "DELETE FROM products WHERE user_id NOT IN (SELECT user_id FROM users)",
+        "DELETE FROM user_channels WHERE user_id NOT IN (SELECT user_id FROM users) "
+        "OR channel_id NOT IN (SELECT id FROM channels)",
+        "DELETE FROM price_history WHERE product_id NOT IN (SELECT id FROM products) "
+        "OR user_id NOT IN (SELECT user_id FROM users)",
+    ]
+    for statement in statements:
+        deleted = conn.execute(text(statement)).rowcount
+        if deleted:
+            log.info("Migration: %s (%d rows)", statement.split(" WHERE")[0], deleted)
+
+
+def _migrate_channel_messages(conn) -> None:
+    """Move the post text/link/channel out of price_history into channel_messages, one row per post.
+
+    Posts are deduplicated on (channel, link, text) by a single INSERT ...
+    SELECT, then price_history is pointed at them in id ranges; the
+    migrated posts have no chat/message id.
+    """
+    columns = {c["name"] for c in inspect(conn).get_columns("price_history")}
+    if "message_text" not in columns:
+        return
+    if "channel_message_id" not in columns:
+        conn.execute(text(
+            "ALTER TABLE price_history ADD COLUMN channel_message_id INTEGER "
+            "REFERENCES channel_messages (id) ON DELETE CASCADE"
+        ))
+    posts = conn.execute(text(
+        "INSERT INTO channel_messages (channel, text, link) "
+        "SELECT channel, message_text, message_link FROM price_history "
+        "GROUP BY channel, message_text, message_link ORDER BY MIN(id)"
+    )).rowcount
+    # Only needed for the lookups below
+    conn.execute(text("CREATE INDEX ix_channel_messages_migrate ON channel_messages (channel, text)"))
+    first_id, last_id = conn.execute(text("SELECT MIN(id), MAX(id) FROM price_history")).one()
+    moved = 0
+    for start in range((first_id or 1) - 1, last_id or 0, _COPY_CHUNK):
+        moved += conn.execute(text(
+            "UPDATE price_history SET channel_message_id = ("
+            "SELECT MIN(m.id) FROM channel_messages m "
+            "WHERE m.chat_id IS NULL AND m.channel = price_history.channel "
+            "AND m.text = price_history.message_text "
+            "AND (m.link = price_history.message_link OR m.link IS NULL AND price_history.message_link IS NULL)"
+            ") WHERE id > :start AND id <= :end"
+        ), {"start": start, "end": start + _COPY_CHUNK}).rowcount
+    conn.execute(text("DROP INDEX ix_channel_messages_migrate"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_price_history_channel_message ON price_history (channel_message_id)"
+    ))
+    for column in ("channel", "message_text", "message_link"):
+        conn.execute(text(f"ALTER TABLE price_history DROP COLUMN {column}"))
+    log.info("Migration: %d price history rows now reference %d channel messages", moved, posts)
+
+
+def _migrate_user_stats(conn) -> None:
+    """Fill the /stats counters (user_stats, channel_match_counts, products.match_count) from the history."""
+    from user_stats import rebuild_stats  # user_stats -> models -> this module
+
+    if "match_count" not in {c["name"] for c in inspect(conn).get_columns("products")}:
+        conn.execute(text("ALTER TABLE products ADD COLUMN match_count INTEGER NOT NULL DEFAULT 0"))
+    log.info("Migration: /stats counters built for %d users", rebuild_stats(conn))
+
+
+# Telegram user ids (users.user_id and the columns referencing it), which
+# no longer fit in 32 bits
+_USER_ID_COLUMNS = [
+    ("users", "user_id"),
+    ("user_channels", "user_id"),
+    ("products", "user_id"),
+    ("price_history", "user_id"),
+    ("price_rollups", "user_id"),
+    ("user_stats", "user_id"),
+    ("channel_match_counts", "user_id"),
+]
+
+
+def _migrate_bigint_user_ids(conn) -> None:
+    """Widen the Telegram user id columns to BIGINT.
+
+    SQLite INTEGER columns already store 64-bit values, so only server
+    databases are altered; the referenced users.user_id goes first.
+    """
+    if conn.dialect.name == "sqlite":
+        return
+    inspector = inspect(conn)
+    tables = set(inspector.get_table_names())
+    for name, column in _USER_ID_COLUMNS:
+        if name not in tables:
+            continue
+        if isinstance(next(c["type"] for c in inspector.get_columns(name) if c["name"] == column), BigInteger):
+            continue
+        conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {column} TYPE BIGINT"))
+        log.info("Migration: %s.%s widened to BIGINT", name, column)
+
+
+# (version, description, migration): each runs once, in order, in the same
+# transaction as its version bump
+_MIGRATIONS = [
+    (1, "legacy columns", _migrate_legacy_columns),
+    (2, "composite indexes", _migrate_composite_indexes),
+    (3, "epoch-ms timestamps", _migrate_epoch_timestamps),
+    (4, "orphaned rows", _migrate_orphan_rows),
+    (5, "channel messages", _migrate_channel_messages),
+    (6, "user stats", _migrate_user_stats),
+    (7, "64-bit user ids", _migrate_bigint_user_ids),
+]
+
+
+def schema_version(conn) -> int:
+    """Version recorded in the schema_version table (0 if none)."""
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+@contextmanager
+def _foreign_keys_off(conn):
+    """Disable SQLite foreign key enforcement around migrations.
+
+    Table rebuilds drop the old table, which with enforcement on would
+    cascade-delete every child row. The pragma is ignored inside a
+    transaction, so conn must not have one open.
+    """
+    if conn.dialect.name != "sqlite" or not conn.exec_driver_sql("PRAGMA foreign_keys").scalar():
+        conn.commit()
+        yield
+        return
+    conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+    conn.commit()
+    try:
+        yield
+    finally:
+        violations = conn.exec_driver_sql("PRAGMA foreign_key_check").all()
+        if violations:
+            log.warning("Foreign key violations after migrations: %d rows (first: %s)", len(violations), violations[0])
+        conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+        conn.commit()
+
+
+# Arbitrary key of the PostgreSQL advisory lock held while migrating
+_MIGRATION_LOCK_KEY = 0x7466705F6D6967
+
+
+@contextmanager
+def _migration_lock(conn):
+    """Serialize migrations of bot instances sharing a PostgreSQL database.
+
+    SQLite needs nothing: a file database has a single bot instance.
+    """
+    if conn.dialect.name != "postgresql":
+        yield
+        return
+    conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+    conn.commit()
+    try:
+        yield
+    finally:
+        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATION_LOCK_KEY})
+        conn.commit()
+
+
+def run_migrations(bind=None) -> int:
+    """Apply the migrations newer than the recorded schema version.
+
+    Run after Base.metadata.create_all(). An up to date database costs a
+    single query (plus the lock on PostgreSQL). Returns the number of
+    migrations applied.
+    """
+    bind = bind if bind is not None else engine
+    with bind.connect() as conn, _migration_lock(conn):
+        current = schema_version(conn)
+        conn.commit()
+        pending = [m for m in _MIGRATIONS if m[0] > current]
+        if not pending:
+            return 0
+        with _foreign_keys_off(conn):
+            for version, description, migrate in pending:
+                with conn.begin():
+                    migrate(conn)
+                    conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+                log.info("Migration %d applied: %s", version, description)
+    return len(pending)
@@ -0,0 +1,195 @@
+"""
+Cross-channel duplicate deal detection (SimHash fingerprints in a time window).
+"""
+
+import hashlib
+import logging
+import time
+from collections import deque
+
+from matcher import PreparedMessage, ProductRecord
+
+log = logging.getLogger(__name__)
+
+_BITS = 64
+_BLOCKS = 4
+_BLOCK_BITS = _BITS // _BLOCKS
+
+
+def _token_hash(token: str) -> int:
+    # Not hash(): string hashes are salted per process (PYTHONHASHSEED)
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "big")
+
+
+# Bit counters packed in one integer, _LANE bits each: _SPREAD[k][byte] adds
+# the bits of byte k (least significant first) of a hash to their counters
+_LANE = 16
+_MAX_TOKENS = (1 << _LANE) - 1
+_SPREAD = [
+    [sum(1 << (_LANE * (8 * k + i)) for i in range(8) if byte >> i & 1) for byte in range(256)]
+    for k in range(_BITS // 8)
+]
+
+
+def simhash(tokens: list[str]) -> int:
+    """64-bit SimHash of a token list (each token weighs 1).
+
+    A single pass over the token hashes adds each one's bits to packed
+    counters, eight table lookups per hash.
+    """
+    tokens = tokens[:_MAX_TOKENS]  # far above a 4096-character message; keeps counters in their lanes
+    if not tokens:
+        return 0
+    counters = 0
+    for token in tokens:
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        for table, byte in zip(_SPREAD, reversed(digest)):
+            counters += table[byte]
+    half = len(tokens) / 2
+    mask = (1 << _LANE) - 1
+    value = 0
+    for bit in range(_BITS):
+        if (counters >> (_LANE * bit)) & mask > half:
+            value |= 1 << bit
+    return value
+
+
+def fingerprint(message: PreparedMessage) -> tuple[int, tuple[float, ...]]:
+    """Fingerprint a message: SimHash of its words and word pairs, plus its sorted prices.
+
+    Prices are kept exact, so a repost at a different price is a new deal.
+    """
+    words = message.norm.split()
+    tokens = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return simhash(tokens), tuple(sorted(set(message.prices)))
+
+
+def _blocks(value: int) -> list[tuple[int, int]]:
+    mask = (1 << _BLOCK_BITS) - 1
+    return [(i, (value >> (i * _BLOCK_BITS)) & mask) for i in range(_BLOCKS)]
+
+
+class DealSighting:
+    """A deal seen in one or more channels, the products already checked against it and those notified."""
+
+    __slots__ = ("simhash", "prices", "first_seen", "count", "channels", "checked", "notified", "texts")
+
+    def __init__(self, simhash_value: int, prices: tuple[float, ...], now: float):
+        self.simhash = simhash_value
+        self.prices = prices
+        self.first_seen = now
+        self.count = 0
+        self.channels: set[str] = set()
+        self.checked: set[int] = set()
+        self.notified: set[int] = set()
+        self.texts: list[int] = []  # exact-copy keys pointing at this deal
+
+    def settled(self, products: dict[int, ProductRecord], dedupe_enabled) -> bool:
+        """Whether matching a repeat of this deal against products can't notify anything.
+
+        True once every product was checked against an earlier sighting and
+        all their users skip duplicates (dedupe_enabled(user_id)).
+        """
+        return (
+            self.count > 1
+            and self.checked.issuperset(products)
+            and all(dedupe_enabled(product.user_id) for product in products.values())
+        )
+
+
+class DealDeduplicator:
+    """Time-windowed store of recent deals, looked up by SimHash Hamming distance.
+
+    Fingerprints are split into four 16-bit blocks: two hashes within
+    Hamming distance 3 always share at least one block, so only deals
+    sharing a block are compared. Exact copies of a text already sighted
+    are found by a hash of the text, without fingerprinting them again.
+    """
+
+    def __init__(self, window_seconds: float = 3600, max_distance: int = 3, clock=time.monotonic):
+        if max_distance >= _BLOCKS:
+            raise ValueError(f"max_distance must be lower than {_BLOCKS}")
+        self.window_seconds = window_seconds
+        self.max_distance = max_distance
+        self._clock = clock
+        self._deals: deque[DealSighting] = deque()
+        self._blocks: dict[tuple[int, int], list[DealSighting]] = {}
+        self._texts: dict[int, DealSighting] = {}  # hash(text) -> deal; never persisted, so hash() is fine
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._deals)
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    def repeat(self, message: PreparedMessage, channel: str) -> DealSighting | None:
+        """Return the deal of an exact copy of a text already sighted, recording this sighting.
+
+        Costs a dict lookup: the message is neither fingerprinted nor
+        normalized. Returns None when there is no such deal or
+        deduplication is disabled.
+        """
+        if not self.enabled:
+            return None
+        self._expire(self._clock())
+        deal = self._texts.get(hash(message.text))
+        if deal is not None:
+            self._record(deal, channel, duplicate=True)
+        return deal
+
+    def sighting(self, message: PreparedMessage, channel: str) -> DealSighting | None:
+        """Return the sighting for this message's deal, registering a new one if needed.
+
+        Fingerprints the message unless it is an exact copy (see repeat()),
+        so only call it for messages that matched. Returns None when
+        deduplication is disabled.
+        """
+        deal = self.repeat(message, channel)
+        if deal is not None or not self.enabled:
+            return deal
+        simhash_value, prices = fingerprint(message)
+        deal = self._find(simhash_value, prices)
+        if deal is None:
+            deal = DealSighting(simhash_value, prices, self._clock())
+            self._deals.append(deal)
+            for block in _blocks(simhash_value):
+                self._blocks.setdefault(block, []).append(deal)
+        key = hash(message.text)
+        deal.texts.append(key)
+        self._texts[key] = deal
+        self._record(deal, channel, duplicate=deal.count > 0)
+        return deal
+
+    def _record(self, deal: DealSighting, channel: str, duplicate: bool) -> None:
+        if duplicate:
+            self.duplicates += 1
+            log.info("Duplicate deal seen in '%s' (already in %s)", channel, ", ".join(sorted(deal.channels)))
+        deal.count += 1
+        deal.channels.add(channel)
+
+    def _find(self, simhash_value: int, prices: tuple[float, ...]) -> DealSighting | None:
+        best = None
+        best_distance = self.max_distance + 1
+        for block in _blocks(simhash_value):
+            for deal in self._blocks.get(block, ()):
+                if deal.prices != prices:
+                    continue
+                distance = (deal.simhash ^ simhash_value).bit_count()
+                if distance < best_distance:
+                    best, best_distance = deal, distance
+        return best
+
+    def _expire(self, now: float) -> None:
+        deals = self._deals
+        while deals and now - deals[0].first_seen > self.window_seconds:
+            deal = deals.popleft()
+            for key in deal.texts:
+                if self._texts.get(key) is deal:
+                    del self._texts[key]
+            for block in _blocks(deal.simhash):
+                bucket = self._blocks[block]
+                bucket.remove(deal)
+                if not bucket:
+                    del self._blocks[block]
@@ -0,0 +1,71 @@
+"""
+Streaming export of a user's price history as a gzip-compressed CSV or JSONL file.
+"""
+
+import csv
+import gzip
+import io
+import json
+import tempfile
+from datetime import datetime, tzinfo
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ChannelMessage, PriceHistory, Product
+
+FORMATS = ("csv", "jsonl")
+COLUMNS = ("found_at", "product", "price", "channel", "link", "source", "message")
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH = 1000
+# The export stays in memory up to this size, then moves to a temporary file
+SPOOL_MAX_BYTES = 1 << 20
+
+
+def export_name(fmt: str) -> str:
+    return f"price_history.{fmt}.gz"
+
+
+async def export_history(session: AsyncSession, user_id: int, fmt: str, tz: tzinfo):
+    """Write the user's PriceHistory, oldest first, into a gzip-compressed spooled temp file.
+
+    Rows are streamed EXPORT_BATCH at a time and written as they arrive,
+    so memory use doesn't grow with the history. Returns (file, rows)
+    with the file rewound; the caller closes it. Rolled-up days
+    (HISTORY_RETENTION_DAYS) have no rows and are not exported.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    result = await session.stream(
+        select(PriceHistory.found_at, Product.name, PriceHistory.price, ChannelMessage.channel,
+               ChannelMessage.link, PriceHistory.source, ChannelMessage.text)
+        .join(Product, PriceHistory.product_id == Product.id)
+        .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+        .where(PriceHistory.user_id == user_id)
+        .order_by(PriceHistory.found_at, PriceHistory.id)
+        .execution_options(yield_per=EXPORT_BATCH)
+    )
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    rows = 0
+    try:
+        # Closing the wrapper flushes the gzip trailer but leaves spool open
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=spool, mode="wb"), encoding="utf-8", newline="") as out:
+            writer = csv.writer(out) if fmt == "csv" else None
+            if writer is not None:
+                writer.writerow(COLUMNS)
+            async for partition in result.partitions():
+                for found_at, *values in partition:
+                    record = [datetime.fromtimestamp(found_at / 1000, tz).isoformat(timespec="seconds"), *values]
+                    if writer is not None:
+                        writer.writerow(record)
+                    else:
+                        out.write(json.dumps(dict(zip(COLUMNS, record)), ensure_ascii=False) + "\n")
+                rows += len(partition)
+    except BaseException:
+        spool.close()
+        raise
+    finally:
+        await result.close()
+    spool.seek(0)
+    return spool, rows
@@ -0,0 +1,139 @@
+"""
+Typo-tolerant product matching (trigram index + bounded edit distance).
+"""
+
+MAX_TOLERANCE = 2
+
+# Names shorter than this many characters per allowed typo are matched exactly,
+# otherwise "ipad" with one typo would match "ipa" inside any word.
+_CHARS_PER_TYPO = 5
+
+
+def effective_tolerance(name_norm: str, tolerance: int) -> int:
+    """Clamp a product's typo tolerance to what its name length can support."""
+    return max(0, min(tolerance, MAX_TOLERANCE, len(name_norm) // _CHARS_PER_TYPO))
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the set of character trigrams of a (normalized) text."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def substring_distance(pattern: str, text: str, max_dist: int) -> int | None:
+    """Smallest edit distance between the pattern and any substring of the text.
+
+    Uses Sellers' dynamic programming with Ukkonen's cut-off, so only the rows
+    that can still be within max_dist are computed: O(max_dist * len(text)).
+    Returns None if the distance is greater than max_dist.
+    """
+    m = len(pattern)
+    col = list(range(m + 1))
+    last = min(max_dist, m)  # deepest row whose value may be <= max_dist
+    best = m if last == m else None
+    for ch in text:
+        # A row can only drop to <= max_dist if the row above was in the
+        # previous column, so one row past the band is enough
+        top = min(last + 1, m)
+        prev_diag = 0  # D[i-1][j-1]
+        new = 0        # D[i-1][j]
+        for i in range(1, top + 1):
+            old = col[i]
+            if pattern[i - 1] == ch:
+                new = prev_diag
+            else:
+                new = 1 + min(prev_diag, new, old)
+            prev_diag = old
+            col[i] = new
+        last = top
+        while col[last] > max_dist:
+            last -= 1
+        if last == m and (best is None or col[m] < best):
+            best = col[m]
+            if best == 0:
+                return 0
+    return best
+
+
+class FuzzyMatcher:
+    """Shortlist products through a trigram inverted index, then confirm by edit distance.
+
+    A name with D distinct trigrams that occurs with at most k edits keeps at
+    least D - 3k of its trigrams, so names sharing fewer trigrams with the
+    message are skipped without computing any distance. Same API as
+    ProductMatcher: keys are registered with a name and a tolerance.
+    """
+
+    def __init__(self):
+        self._keys: dict = {}                           # key -> (name_norm, tolerance)
+        self._patterns: dict[tuple[str, int], set] = {}  # (name_norm, tolerance) -> keys
+        self._postings: dict[str, set[tuple[str, int]]] = {}
+        self._thresholds: dict[tuple[str, int], int] = {}
+        self._unfiltered: set[tuple[str, int]] = set()  # too short for the trigram filter
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key, name_norm: str, tolerance: int) -> None:
+        """Register a normalized name with its (already clamped) tolerance."""
+        pattern = (name_norm, tolerance)
+        if self._keys.get(key) == pattern:
+            return
+        self.remove(key)
+        self._keys[key] = pattern
+        keys = self._patterns.get(pattern)
+        if keys is not None:
+            keys.add(key)
+            return
+        self._patterns[pattern] = {key}
+        grams = trigrams(name_norm)
+        threshold = len(grams) - 3 * tolerance
+        if threshold <= 0:
+            self._unfiltered.add(pattern)
+            return
+        self._thresholds[pattern] = threshold
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(pattern)
+
+    def remove(self, key) -> None:
+        """Unregister a key. Unknown keys are ignored."""
+        pattern = self._keys.pop(key, None)
+        if pattern is None:
+            return
+        keys = self._patterns[pattern]
+        keys.discard(key)
+        if keys:
+            return
+        del self._patterns[pattern]
+        if self._thresholds.pop(pattern, None) is None:
+            self._unfiltered.discard(pattern)
+            return
+        for gram in trigrams(pattern[0]):
+            postings = self._postings[gram]
+            postings.discard(pattern)
+            if not postings:
+                del self._postings[gram]
+
+    def candidates(self, text_grams: set[str]) -> list[tuple[str, int]]:
+        """Return the patterns that share enough trigrams with the message to be worth checking."""
+        counts: dict[tuple[str, int], int] = {}
+        postings = self._postings
+        for gram in text_grams:
+            for pattern in postings.get(gram, ()):
+                counts[pattern] = counts.get(pattern, 0) + 1
+        thresholds = self._thresholds
+        shortlist = [p for p, n in counts.items() if n >= thresholds[p]]
+        shortlist.extend(self._unfiltered)
+        return shortlist
+
+    def find(self, text_norm: str, text_grams: set[str] | None = None) -> set:
+        """Return the keys of all products whose name occurs in the text within their tolerance."""
+        if not self._keys:
+            return set()
+        if text_grams is None:
+            text_grams = trigrams(text_norm)
+        keys = set()
+        for pattern in self.candidates(text_grams):
+            name_norm, tolerance = pattern
+            if name_norm in text_norm or substring_distance(name_norm, text_norm, tolerance) is not None:
+                keys |= self._patterns[pattern]
+        return keys
@@ -0,0 +1,221 @@
+"""
+Write-behind writer for PriceHistory rows.
+"""
+
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from metrics import STAGE_SECONDS
+from models import ChannelMessage, PriceHistory
+from timestamps import now_ms
+from user_stats import record_matches
+
+log = logging.getLogger(__name__)
+
+# Keys of a queued row that describe its post; they go to channel_messages
+_MESSAGE_FIELDS = ("chat_id", "message_id", "channel", "message_text", "message_link")
+
+# PostgreSQL: batches of at least this many rows are written with COPY, which
+# skips the ORM column defaults, so every column but id is listed
+_COPY_MIN_ROWS = 20
+_COPY_COLUMNS = ("product_id", "user_id", "channel_message_id", "price", "source", "found_at")
+_COPY_DEFAULTS = {"source": "realtime"}
+
+
+class PriceHistoryWriter:
+    """Queue PriceHistory rows and insert them in batches, one transaction per batch.
+
+    A batch is flushed as soon as batch_size rows are queued, or after
+    flush_interval seconds otherwise. Callers never wait for the commit.
+    Failed batches are retried on the next flush; if the DB stays down the
+    queue is capped at max_queue rows, dropping the oldest. A batch rejected
+    by a constraint (e.g. a product deleted while its match was queued) is
+    written row by row instead, skipping the rows that violate it. The
+    users' /stats counters (user_stats) are updated in the same transaction.
+    """
+
+    def __init__(
+        self,
+        db_session_factory: async_sessionmaker,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue: int = 10000,
+    ):
+        self._session_factory = db_session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: list[dict] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._stopping = False
+        self.in_flight = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def metrics(self) -> dict[str, int]:
+        """Snapshot of the writer's counters."""
+        return {
+            "queue_depth": len(self._queue),
+            "in_flight": self.in_flight,
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    def add(self, **row) -> None:
+        """Queue a PriceHistory row (column=value) with its post: chat_id, message_id,
+        channel, message_text and message_link. found_at defaults to now."""
+        row.setdefault("found_at", now_ms())
+        self._queue.append(row)
+        if len(self._queue) > self.max_queue:
+            overflow = len(self._queue) - self.max_queue
+            del self._queue[:overflow]
+            self.dropped += overflow
+            log.error("PriceHistory queue full: dropped %d rows", overflow)
+        self.start()
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        """Start the background flush loop (idempotent, needs a running event loop)."""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        """Stop the flush loop and drain the queue."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._queue:
+            log.error("PriceHistory writer stopped with %d unwritten rows", len(self._queue))
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._stopping:
+                # One more attempt for batches that failed during the drain
+                if self._queue:
+                    await self.flush()
+                return
+
+    async def flush(self) -> None:
+        """Write all queued rows now, batch_size rows per transaction."""
+        async with self._flush_lock:
+            while self._queue:
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+                self.in_flight = len(batch)
+                rejected = self.rejected
+                started = time.perf_counter()
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    self.failures += 1
+                    log.error("Error writing %d PriceHistory rows: %s", len(batch), e)
+                    self._queue[:0] = batch
+                    return
+                finally:
+                    self.in_flight = 0
+                STAGE_SECONDS.observe(time.perf_counter() - started, path="history", stage="db_write")
+                self.written += len(batch) - (self.rejected - rejected)
+                self.batches += 1
+                log.debug("PriceHistory batch written: %d rows (queue depth %d)", len(batch), len(self._queue))
+
+    async def _write(self, batch: list[dict]) -> None:
+        try:
+            async with self._session_factory() as session:
+                await self._insert(session, await self._history_rows(session, batch))
+                await session.run_sync(record_matches, batch)
+                await session.commit()
+        except IntegrityError:
+            await self._write_rows(batch)
+
+    async def _write_rows(self, batch: list[dict]) -> None:
+        """Insert rows one savepoint at a time, skipping those that violate a constraint."""
+        async with self._session_factory() as session:
+            for row in batch:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(insert(PriceHistory), await self._history_rows(session, [row]))
+                        await session.run_sync(record_matches, [row])
+                except IntegrityError as e:
+                    self.rejected += 1
+                    log.warning("PriceHistory row rejected (product_id=%s): %s", row.get("product_id"), e.orig)
+            await session.commit()
+
+    async def _insert(self, session: AsyncSession, rows: list[dict]) -> None:
+        """Bulk insert: COPY on PostgreSQL (asyncpg), one executemany elsewhere."""
+        connection = await session.connection()
+        if connection.dialect.name != "postgresql" or len(rows) < _COPY_MIN_ROWS:
+            await session.execute(insert(PriceHistory), rows)
+            return
+        raw = await connection.get_raw_connection()
+        try:
+            await raw.driver_connection.copy_records_to_table(
+                PriceHistory.__tablename__,
+                columns=_COPY_COLUMNS,
+                records=[tuple(row.get(column, _COPY_DEFAULTS.get(column)) for column in _COPY_COLUMNS)
+                         for row in rows],
+            )
+        except Exception as e:
+            # asyncpg raises its own exceptions here: class 23 is a constraint violation
+            if str(getattr(e, "sqlstate", "")).startswith("23"):
+                raise IntegrityError("COPY price_history", None, e) from e
+            raise
+
+    async def _history_rows(self, session: AsyncSession, batch: list[dict]) -> list[dict]:
+        """PriceHistory rows for the batch, their posts stored in channel_messages (once per post)."""
+        posts = {}
+        for row in batch:
+            posts.setdefault((row["chat_id"], row["message_id"]), row)
+        ids = await self._message_ids(session, posts)
+        missing = [
+            {"chat_id": chat_id, "message_id": message_id, "channel": row["channel"],
+             "text": row["message_text"], "link": row["message_link"]}
+            for (chat_id, message_id), row in posts.items() if (chat_id, message_id) not in ids
+        ]
+        if missing:
+            inserted = await session.execute(
+                insert(ChannelMessage).returning(ChannelMessage.chat_id, ChannelMessage.message_id, ChannelMessage.id),
+                missing,
+            )
+            ids.update(((chat_id, message_id), id_) for chat_id, message_id, id_ in inserted)
+        return [
+            {key: value for key, value in row.items() if key not in _MESSAGE_FIELDS}
+            | {"channel_message_id": ids[(row["chat_id"], row["message_id"])]}
+            for row in batch
+        ]
+
+    @staticmethod
+    async def _message_ids(session: AsyncSession, keys) -> dict[tuple[int, int], int]:
+        rows = await session.execute(
+            select(ChannelMessage.chat_id, ChannelMessage.message_id, ChannelMessage.id)
+            .where(tuple_(ChannelMessage.chat_id, ChannelMessage.message_id).in_(list(keys)))
+        )
+        return {(chat_id, message_id): id_ for chat_id, message_id, id_ in rows}
@@ -0,0 +1,183 @@
+"""
+Bounded queue between the Telegram update handler and the matching consumers.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import INGEST_DROPPED
+
+log = logging.getLogger(__name__)
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_LOW_PRIORITY = "drop_low_priority"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_DROP_LOW_PRIORITY)
+
+
+def normalize_channel(identifier) -> str:
+    """Username without @ (lowercase) or raw numeric id, as stored in Channel.identifier."""
+    value = str(identifier).strip().lstrip("@").lower()
+    if value.startswith("-100") and value[4:].isdigit():
+        value = value[4:]
+    return value
+
+
+class IngestRecord:
+    """What the consumers need from a channel message; the Telethon event is not kept."""
+
+    __slots__ = ("chat_id", "message_id", "text", "origin", "low_priority", "queued_at")
+
+    def __init__(self, chat_id: int, message_id: int, text: str, origin: float | None, low_priority: bool = False):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.origin = origin  # epoch seconds of the post
+        self.low_priority = low_priority
+        self.queued_at = time.perf_counter()
+
+
+class IngestQueue:
+    """Bounded FIFO of IngestRecords drained by a fixed number of consumer tasks.
+
+    When the queue holds maxsize records, put() applies the overflow policy:
+      - block: wait for a free slot (backpressure on the update handler)
+      - drop_oldest: discard the oldest queued record
+      - drop_low_priority: discard the oldest queued record from a
+        low-priority channel, or the new one if it is from such a channel;
+        otherwise wait for a free slot as with block
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        consumers: int = 4,
+        policy: str = POLICY_BLOCK,
+        low_priority_channels=(),
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown overflow policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        if maxsize < 1 or consumers < 1:
+            raise ValueError("maxsize and consumers must be at least 1")
+        self.maxsize = maxsize
+        self.consumers = consumers
+        self.policy = policy
+        self.low_priority_channels = {normalize_channel(c) for c in low_priority_channels if str(c).strip()}
+        self._queue: deque[IngestRecord] = deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._active = 0
+        self._tasks: list[asyncio.Task] = []
+        self._handler = None
+        self.enqueued = 0
+        self.processed = 0
+        self.blocked = 0
+        self.failures = 0
+        self.dropped = {POLICY_DROP_OLDEST: 0, POLICY_DROP_LOW_PRIORITY: 0}
+        self.max_depth = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def metrics(self) -> dict[str, int]:
+        """Snapshot of the queue's counters."""
+        return {
+            "queue_depth": len(self._queue),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "blocked": self.blocked,
+            "failures": self.failures,
+            "dropped_oldest": self.dropped[POLICY_DROP_OLDEST],
+            "dropped_low_priority": self.dropped[POLICY_DROP_LOW_PRIORITY],
+        }
+
+    def is_low_priority(self, chat_id: int | None, username: str | None = None) -> bool:
+        """Whether the channel is listed in low_priority_channels (by id or username)."""
+        if not self.low_priority_channels:
+            return False
+        if chat_id is not None and normalize_channel(chat_id) in self.low_priority_channels:
+            return True
+        return bool(username) and normalize_channel(username) in self.low_priority_channels
+
+    async def put(self, record: IngestRecord) -> bool:
+        """Queue a record. Returns False if the record itself was dropped."""
+        while len(self._queue) >= self.maxsize:
+            if self.policy == POLICY_DROP_OLDEST:
+                self._drop(self._queue.popleft(), POLICY_DROP_OLDEST)
+                break
+            if self.policy == POLICY_DROP_LOW_PRIORITY:
+                victim = next((r for r in self._queue if r.low_priority), None)
+                if victim is not None:
+                    self._queue.remove(victim)
+                    self._drop(victim, POLICY_DROP_LOW_PRIORITY)
+                    break
+                if record.low_priority:
+                    self._drop(record, POLICY_DROP_LOW_PRIORITY)
+                    return False
+            self.blocked += 1
+            self._not_full.clear()
+            await self._not_full.wait()
+
+        record.queued_at = time.perf_counter()
+        self._queue.append(record)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._idle.clear()
+        self._not_empty.set()
+        return True
+
+    def _drop(self, record: IngestRecord, reason: str) -> None:
+        self.dropped[reason] += 1
+        INGEST_DROPPED.inc(reason=reason)
+        log.warning("Ingest queue full (%d): dropped message %s from chat %s (%s)",
+                    self.maxsize, record.message_id, record.chat_id, reason)
+
+    def start(self, handler) -> None:
+        """Start the consumer tasks, each awaiting handler(record) (idempotent)."""
+        if self._tasks:
+            return
+        self._handler = handler
+        self._tasks = [asyncio.ensure_future(self._consume()) for _ in range(self.consumers)]
+
+    async def join(self) -> None:
+        """Wait until the queue is empty and no record is being handled."""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let the consumers drain the queue for up to timeout seconds, then cancel them."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            log.error("Ingest queue stopped with %d unprocessed messages", len(self._queue))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _consume(self) -> None:
+        while True:
+            while not self._queue:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            record = self._queue.popleft()
+            self._not_full.set()
+            self._active += 1
+            try:
+                await self._handler(record)
+                self.processed += 1
+            except Exception as e:
+                self.failures += 1
+                log.error("Error handling message %s from chat %s: %s", record.message_id, record.chat_id, e)
+            finally:
+                self._active -= 1
+                if not self._queue and not self._active:
+                    self._idle.set()
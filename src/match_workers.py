@@ -0,0 +1,266 @@
+"""
+Exact product matching sharded across worker processes.
+
+For deployments with tens of thousands of watched names: each worker owns the
+Aho-Corasick automaton for a shard of the distinct names, so the CPU work of
+scanning a message runs outside the asyncio loop and in parallel.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import zlib
+
+from matcher import ProductMatcher, normalize
+
+log = logging.getLogger(__name__)
+
+
+def _worker_main(conn) -> None:
+    """Worker loop: apply add/remove/clear batches in order, answer find requests."""
+    matcher = ProductMatcher()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        op = message[0]
+        if op == "find":
+            conn.send((message[1], list(matcher.find_patterns(message[2]))))
+        elif op == "sync":
+            for name in message[1]:
+                matcher.remove(name)
+            for name in message[2]:
+                matcher.add(name, name)
+        elif op == "clear":
+            matcher = ProductMatcher()
+        elif op == "stop":
+            return
+
+
+class _Worker:
+    __slots__ = ("process", "conn", "patterns", "added", "removed", "futures", "next_id", "reading")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.patterns: set[str] = set()   # names this shard holds (source of truth for respawns)
+        self.added: list[str] = []        # changes not yet sent to the process
+        self.removed: list[str] = []
+        self.futures: dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.reading = False
+
+
+class MatchWorkerPool:
+    """Persistent worker processes, each matching one shard of the watched names.
+
+    Names are assigned to a shard by CRC32 and reference counted here, so a
+    name watched by many products (or in many channels) is sent to its worker
+    once. Changes are queued and shipped to a worker ahead of its next find
+    request; since a worker handles its pipe in order, a message is always
+    matched against an up to date shard. A worker that dies is respawned and
+    reloaded with its shard.
+    """
+
+    def __init__(self, workers: int):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [self._spawn() for _ in range(workers)]
+        self._refs: dict[str, int] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.requests = 0
+
+    def __len__(self) -> int:
+        return len(self._workers)
+
+    @property
+    def pattern_count(self) -> int:
+        return len(self._refs)
+
+    def _spawn(self) -> _Worker:
+        parent, child = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        return _Worker(process, parent)
+
+    def _shard(self, pattern: str) -> _Worker:
+        return self._workers[zlib.crc32(pattern.encode()) % len(self._workers)]
+
+    # --- Pattern set ---
+
+    def acquire(self, pattern: str) -> None:
+        """Add a reference to a normalized name."""
+        count = self._refs.get(pattern, 0)
+        self._refs[pattern] = count + 1
+        if count == 0:
+            worker = self._shard(pattern)
+            worker.patterns.add(pattern)
+            worker.added.append(pattern)
+
+    def release(self, pattern: str) -> None:
+        """Drop a reference to a normalized name."""
+        count = self._refs.get(pattern, 0)
+        if count > 1:
+            self._refs[pattern] = count - 1
+            return
+        if count == 1:
+            del self._refs[pattern]
+            worker = self._shard(pattern)
+            worker.patterns.discard(pattern)
+            worker.removed.append(pattern)
+
+    def clear(self) -> None:
+        """Drop every name from every worker."""
+        self._refs.clear()
+        for worker in self._workers:
+            worker.patterns.clear()
+            worker.added.clear()
+            worker.removed.clear()
+            self._send(worker, ("clear",))
+
+    # --- Matching ---
+
+    async def find_patterns(self, text_norm: str) -> set[str]:
+        """Return the distinct normalized names occurring in the text, across all shards."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._detach()
+            self._loop = loop
+        futures = []
+        for worker in self._workers:
+            for _ in range(2):  # a second try on a freshly respawned worker
+                self._flush(worker)
+                if not worker.patterns:
+                    break
+                if not worker.reading:
+                    loop.add_reader(worker.conn.fileno(), self._on_response, worker)
+                    worker.reading = True
+                request_id = worker.next_id
+                worker.next_id += 1
+                # The reply is read by the loop, so registering after the send is safe
+                if self._send(worker, ("find", request_id, text_norm)):
+                    futures.append(worker.futures.setdefault(request_id, loop.create_future()))
+                    break
+        self.requests += 1
+        found = set()
+        for result in await asyncio.gather(*futures, return_exceptions=True):
+            if isinstance(result, Exception):
+                log.error("Match worker failed: %s", result)
+                continue
+            found.update(result)
+        return found
+
+    def _flush(self, worker: _Worker) -> None:
+        if worker.added or worker.removed:
+            message = ("sync", worker.removed, worker.added)
+            worker.added, worker.removed = [], []
+            self._send(worker, message)
+
+    def _send(self, worker: _Worker, message: tuple) -> bool:
+        try:
+            worker.conn.send(message)
+            return True
+        except (BrokenPipeError, EOFError, OSError) as e:
+            self._respawn(worker, e)
+            return False
+
+    def _on_response(self, worker: _Worker) -> None:
+        try:
+            request_id, names = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._respawn(worker, e)
+            return
+        future = worker.futures.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result(names)
+
+    def _respawn(self, worker: _Worker, error: Exception) -> None:
+        """Replace a dead worker process and reload its shard."""
+        log.error("Match worker %s died (%s): respawning", worker.process.pid, error)
+        if worker.reading:
+            self._loop.remove_reader(worker.conn.fileno())
+            worker.reading = False
+        for future in worker.futures.values():
+            if not future.done():
+                future.set_exception(RuntimeError("match worker died"))
+        worker.futures.clear()
+        worker.conn.close()
+        fresh = self._spawn()
+        worker.process, worker.conn = fresh.process, fresh.conn
+        worker.added, worker.removed = list(worker.patterns), []
+
+    def _detach(self) -> None:
+        """Stop reading worker replies on the current event loop."""
+        for worker in self._workers:
+            if worker.reading and not self._loop.is_closed():
+                self._loop.remove_reader(worker.conn.fileno())
+            worker.reading = False
+            worker.futures.clear()
+
+    def close(self) -> None:
+        """Stop all worker processes."""
+        self._detach()
+        for worker in self._workers:
+            try:
+                worker.conn.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+            worker.conn.close()
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+class ShardedProductMatcher:
+    """Per-channel stand-in for ProductMatcher when matching runs in a MatchWorkerPool.
+
+    Keeps only the key <-> name bookkeeping; the automaton lives in the
+    workers and is shared by all channels. Use keys_for() on the names
+    returned by MatchWorkerPool.find_patterns().
+    """
+
+    def __init__(self, pool: MatchWorkerPool):
+        self._pool = pool
+        self._keys: dict = {}                 # key -> normalized name
+        self._patterns: dict[str, set] = {}   # normalized name -> keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key, name: str) -> None:
+        """Register a product name under the given key."""
+        pattern = normalize(name)
+        if self._keys.get(key) == pattern:
+            return
+        self.remove(key)
+        self._keys[key] = pattern
+        keys = self._patterns.get(pattern)
+        if keys is None:
+            self._patterns[pattern] = {key}
+            self._pool.acquire(pattern)
+        else:
+            keys.add(key)
+
+    def remove(self, key) -> None:
+        """Unregister a key. Unknown keys are ignored."""
+        pattern = self._keys.pop(key, None)
+        if pattern is None:
+            return
+        keys = self._patterns[pattern]
+        keys.discard(key)
+        if not keys:
+            del self._patterns[pattern]
+            self._pool.release(pattern)
+
+    def keys_for(self, patterns: set[str]) -> set:
+        """Return the keys registered under any of the given names."""
+        keys = set()
+        for pattern in patterns:
+            found = self._patterns.get(pattern)
+            if found:
+                keys |= found
+        return keys
@@ -0,0 +1,318 @@
+"""
+Product matching: message preparation, price filter and multi-pattern matcher.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+
+from fuzzy import effective_tolerance, substring_distance, trigrams
+from price_parser import PriceLayout, extract_price_layout, extract_prices
+from translations import DEFAULT_LANGUAGE
+
+_STRIP_TABLE = str.maketrans("", "", "-_")
+
+
+def normalize(text: str) -> str:
+    """Normalize text for fuzzy matching: lowercase, remove hyphens/underscores, collapse spaces."""
+    return " ".join(text.lower().translate(_STRIP_TABLE).split())
+
+
+def _normalize_with_offsets(text: str) -> tuple[str, list[int]]:
+    """normalize(), also returning the index in text of each normalized character."""
+    chars: list[str] = []
+    offsets: list[int] = []
+    space_at = -1
+    for i, ch in enumerate(text):
+        if ch == "-" or ch == "_":
+            continue
+        if ch.isspace():
+            if chars and space_at < 0:
+                space_at = i
+            continue
+        if space_at >= 0:
+            chars.append(" ")
+            offsets.append(space_at)
+            space_at = -1
+        for low in ch.lower():
+            chars.append(low)
+            offsets.append(i)
+    return "".join(chars), offsets
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """Lightweight copy of a watched product and the owner's language.
+
+    typo_tolerance is already clamped to what the name length supports
+    (0 means exact matching only).
+    """
+    id: int
+    user_id: int
+    name: str
+    name_norm: str
+    target_price: float | None
+    lang_code: str = DEFAULT_LANGUAGE
+    typo_tolerance: int = 0
+
+    @classmethod
+    def create(cls, id: int, user_id: int, name: str, target_price: float | None,
+               lang_code: str = DEFAULT_LANGUAGE, typo_tolerance: int = 0) -> "ProductRecord":
+        name_norm = normalize(name)
+        return cls(id, user_id, name, name_norm, target_price, lang_code,
+                   effective_tolerance(name_norm, typo_tolerance or 0))
+
+
+class PreparedMessage:
+    """A message normalized once and shared by every product it is checked against.
+
+    Everything is computed on first use: the normalized text, its trigrams
+    (prefilter, fuzzy matching), the prices when a product with a target
+    price needs them, and their layout (spans, lines, clauses) only when
+    there are several. mentioned holds the normalized names of the watched
+    products found in the message, as set by the matcher.
+    """
+
+    __slots__ = ("text", "mentioned", "_norm", "_grams", "_prices", "_layout", "_offsets")
+
+    def __init__(self, text: str, prices: list[float] | None = None, mentioned: set[str] | None = None):
+        self.text = text
+        self.mentioned = mentioned or set()
+        self._norm: str | None = None
+        self._grams: set[str] | None = None
+        self._prices = prices  # already extracted (e.g. by extract_prices_many), else lazy
+        self._layout: PriceLayout | None = None
+        self._offsets: tuple[str, list[int]] | None = None
+
+    @property
+    def norm(self) -> str:
+        if self._norm is None:
+            self._norm = normalize(self.text)
+        return self._norm
+
+    @property
+    def grams(self) -> set[str]:
+        if self._grams is None:
+            self._grams = trigrams(self.norm)
+        return self._grams
+
+    @property
+    def prices(self) -> list[float]:
+        if self._prices is None:
+            self._prices = extract_prices(self.text)
+        return self._prices
+
+    @property
+    def layout(self) -> PriceLayout:
+        if self._layout is None:
+            self._layout = extract_price_layout(self.text)
+        return self._layout
+
+    def mention_spans(self, name_norm: str) -> list[tuple[int, int]]:
+        """(start, end) in the original text of each exact mention of a normalized name."""
+        if self._offsets is None:
+            self._offsets = _normalize_with_offsets(self.text)
+        norm, offsets = self._offsets
+        spans = []
+        i = norm.find(name_norm) if name_norm else -1
+        while i >= 0:
+            spans.append((offsets[i], offsets[i + len(name_norm) - 1] + 1))
+            i = norm.find(name_norm, i + 1)
+        return spans
+
+    def prices_for(self, name_norm: str) -> list[float]:
+        """Prices that belong to the product: those between its mentions and the next product.
+
+        Every price in the message is returned when there is at most one,
+        when no other product in mentioned occurs in the message apart from
+        inside this one's mentions, or when the name is not found verbatim
+        (typo-tolerant match).
+        """
+        prices = self.prices
+        if len(prices) < 2 or self.mentioned <= {name_norm}:
+            return prices
+        spans = self.mention_spans(name_norm)
+        if not spans:
+            return prices
+        other_spans = [
+            (start, end)
+            for other in self.mentioned if other != name_norm
+            for start, end in self.mention_spans(other)
+            if not any(start < own_end and own_start < end for own_start, own_end in spans)
+        ]
+        if not other_spans:
+            return prices
+        return self.layout.prices_for(spans, other_spans)
+
+
+def check_product_match(product, message: str | PreparedMessage) -> dict | None:
+    """Check if a message matches a product (ORM Product or ProductRecord).
+
+    Products with a typo tolerance also match names misspelled by up to that
+    many edits.
+
+    Returns a dict with notification info, or None if no match.
+    """
+    if isinstance(message, str):
+        message = PreparedMessage(message)
+    name_norm = getattr(product, "name_norm", None)
+    if name_norm is None:
+        name_norm = normalize(product.name)
+    if name_norm not in message.norm:
+        tolerance = effective_tolerance(name_norm, product.typo_tolerance or 0)
+        if not tolerance or substring_distance(name_norm, message.norm, tolerance) is None:
+            return None
+    return check_price_match(product, message)
+
+
+def check_price_match(product, message: PreparedMessage) -> dict | None:
+    """Apply the target price filter to a message already known to mention the product.
+
+    In posts about several watched products (message.mentioned) only the
+    prices following the product's mentions are considered, so in
+    "AirPods 129€ / iPhone 899€" the iPhone costs 899; otherwise the lowest
+    price counts, so "iPhone 15, listino 1.099€, in offerta a 899€" costs 899.
+
+    Returns a dict with notification info, or None if the price is too high.
+    """
+    if product.target_price is not None:
+        name_norm = getattr(product, "name_norm", None)
+        if name_norm is None:
+            name_norm = normalize(product.name)
+        prices = message.prices_for(name_norm)
+        if not prices or min(prices) > product.target_price:
+            return None
+        return {
+            "matched": True,
+            "price_found": min(prices),
+            "target_price": product.target_price,
+        }
+
+    return {"matched": True, "price_found": None, "target_price": None}
+
+
+class ProductMatcher:
+    """Find every watched product mentioned in a message with a single scan.
+
+    Products are registered by key (e.g. the product id) together with their
+    name. Names are normalized and deduplicated, so a name watched by many
+    users is a single pattern in the automaton. Adding a new name extends the
+    trie in place; removing the last key of a name triggers a rebuild on the
+    next lookup.
+    """
+
+    def __init__(self):
+        self._keys: dict = {}                 # key -> normalized name
+        self._patterns: dict[str, set] = {}   # normalized name -> keys
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._terminal: list[str | None] = [None]
+        self._out: list[tuple[str, ...]] = [()]
+        self._needs_rebuild = False
+        self._links_stale = False
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @property
+    def pattern_count(self) -> int:
+        """Number of distinct normalized names in the automaton."""
+        return len(self._patterns)
+
+    def add(self, key, name: str) -> None:
+        """Register a product name under the given key."""
+        pattern = normalize(name)
+        if self._keys.get(key) == pattern:
+            return
+        if key in self._keys:
+            self.remove(key)
+        self._keys[key] = pattern
+        keys = self._patterns.get(pattern)
+        if keys is not None:
+            keys.add(key)
+            return
+        self._patterns[pattern] = {key}
+        if not self._needs_rebuild:
+            self._insert(pattern)
+
+    def remove(self, key) -> None:
+        """Unregister a key. Unknown keys are ignored."""
+        pattern = self._keys.pop(key, None)
+        if pattern is None:
+            return
+        keys = self._patterns[pattern]
+        keys.discard(key)
+        if not keys:
+            del self._patterns[pattern]
+            self._needs_rebuild = True
+
+    def sync(self, names: dict) -> None:
+        """Bring the matcher in line with a {key: name} mapping, applying only the differences."""
+        for key in [k for k in self._keys if k not in names]:
+            self.remove(key)
+        for key, name in names.items():
+            self.add(key, name)
+
+    def find(self, text_norm: str) -> set:
+        """Return the keys of all products whose name occurs in the normalized text."""
+        keys = set()
+        for pattern in self.find_patterns(text_norm):
+            keys |= self._patterns[pattern]
+        return keys
+
+    def find_patterns(self, text_norm: str) -> set[str]:
+        """Return the distinct normalized names that occur in the normalized text."""
+        self._prepare()
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set(out[0])
+        state = 0
+        for ch in text_norm:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+    def _insert(self, pattern: str) -> None:
+        goto = self._goto
+        state = 0
+        for ch in pattern:
+            nxt = goto[state].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto[state][ch] = nxt
+                goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+            state = nxt
+        self._terminal[state] = pattern
+        self._links_stale = True
+
+    def _prepare(self) -> None:
+        if self._needs_rebuild:
+            self._goto, self._fail, self._terminal = [{}], [0], [None]
+            self._needs_rebuild = False
+            for pattern in self._patterns:
+                self._insert(pattern)
+        if self._links_stale:
+            self._build_links()
+
+    def _build_links(self) -> None:
+        """Compute failure links and merged outputs breadth-first."""
+        goto, fail = self._goto, self._fail
+        out = [(p,) if p is not None else () for p in self._terminal]
+        queue = deque(goto[0].values())
+        for state in queue:
+            fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            if fail[state] and out[fail[state]]:
+                out[state] += out[fail[state]]
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if state else 0
+                queue.append(nxt)
+        self._out = out
+        self._links_stale = False
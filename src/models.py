@@ -2,10 +2,9 @@
 Database models (SQLAlchemy ORM).
 """
 
-from datetime import datetime, timezone
-
-from sqlalchemy import Boolean, Column, Float, Integer, String, ForeignKey, UniqueConstraint
+from sqlalchemy import BigInteger, Boolean, Column, Float, Index, Integer, String, ForeignKey, UniqueConstraint
 from database import Base
+from timestamps import now_ms
 
 
 class User(Base):
@@ -13,12 +12,12 @@ class User(Base):
     __tablename__ = "users"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, unique=True, index=True, nullable=False)
+    user_id = Column(BigInteger, unique=True, index=True, nullable=False)
     username = Column(String)
     paused = Column(Boolean, nullable=False, default=False)
     lang_code = Column(String, nullable=False, default="en")
-    added_at = Column(String, nullable=False,
-                      default=lambda: datetime.now(timezone.utc).isoformat())
+    dedupe_deals = Column(Boolean, nullable=False, default=True)
+    added_at = Column(BigInteger, nullable=False, default=now_ms)  # epoch ms, UTC
 
 
 class Channel(Base):
@@ -28,15 +27,19 @@ class Channel(Base):
     id = Column(Integer, primary_key=True, index=True)
     identifier = Column(String, unique=True, index=True, nullable=False)
     title = Column(String, nullable=True)
-    added_at = Column(String, nullable=False,
-                      default=lambda: datetime.now(timezone.utc).isoformat())
+    chat_id = Column(BigInteger, nullable=True)  # Telegram channel id, for the metadata cache
+    added_at = Column(BigInteger, nullable=False, default=now_ms)  # epoch ms, UTC
 
 
 class UserChannel(Base):
     """User-channel association (many-to-many)."""
     __tablename__ = "user_channels"
+    __table_args__ = (
+        # The primary key covers lookups by user; this one the subscribers of a channel
+        Index("ix_user_channels_channel_user", "channel_id", "user_id"),
+    )
 
-    user_id = Column(Integer, ForeignKey(
+    user_id = Column(BigInteger, ForeignKey(
         "users.user_id", ondelete="CASCADE"), primary_key=True)
     channel_id = Column(Integer, ForeignKey(
         "channels.id", ondelete="CASCADE"), primary_key=True)
@@ -50,28 +53,111 @@ class Product(Base):
     )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey(
+    user_id = Column(BigInteger, ForeignKey(
         "users.user_id", ondelete="CASCADE"), nullable=False, index=True)
     name = Column(String, nullable=False)
     target_price = Column(Float, nullable=True)
     category = Column(String, nullable=True)
-    added_at = Column(String, nullable=False,
-                      default=lambda: datetime.now(timezone.utc).isoformat())
+    typo_tolerance = Column(Integer, nullable=False, default=0)
+    match_count = Column(Integer, nullable=False, default=0)  # history + rollups, kept by user_stats
+    added_at = Column(BigInteger, nullable=False, default=now_ms)  # epoch ms, UTC
+
+
+class ChannelMessage(Base):
+    """A channel post that matched, stored once for all the PriceHistory rows it produced."""
+    __tablename__ = "channel_messages"
+    __table_args__ = (
+        UniqueConstraint("chat_id", "message_id", name="uq_channel_message"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # Marked Telegram chat id (-100...) and message id; NULL for posts migrated
+    # from before this table, which only had the text and link
+    chat_id = Column(BigInteger, nullable=True)
+    message_id = Column(BigInteger, nullable=True)
+    channel = Column(String, nullable=False)  # channel title when the post was seen
+    text = Column(String, nullable=False)
+    link = Column(String, nullable=True)
 
 
 class PriceHistory(Base):
     """Price history entries found in channels."""
     __tablename__ = "price_history"
+    __table_args__ = (
+        # Daily summary / stats (user_id, found_at range) and /history (product_id, latest first)
+        Index("ix_price_history_user_found", "user_id", "found_at"),
+        Index("ix_price_history_product_found", "product_id", "found_at"),
+        # Range scans on found_at alone (retention, global time windows)
+        Index("ix_price_history_found_at", "found_at"),
+        # Cascades from channel_messages and the orphan check after pruning
+        Index("ix_price_history_channel_message", "channel_message_id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey(
-        "products.id", ondelete="CASCADE"), nullable=False, index=True)
-    user_id = Column(Integer, ForeignKey(
-        "users.user_id", ondelete="CASCADE"), nullable=False, index=True)
+        "products.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey(
+        "users.user_id", ondelete="CASCADE"), nullable=False)
+    channel_message_id = Column(Integer, ForeignKey(
+        "channel_messages.id", ondelete="CASCADE"), nullable=False)
     price = Column(Float, nullable=True)
-    channel = Column(String, nullable=False)
-    message_text = Column(String, nullable=False)
-    message_link = Column(String, nullable=True)
     source = Column(String, nullable=False, default="realtime")
-    found_at = Column(String, nullable=False,
-                      default=lambda: datetime.now(timezone.utc).isoformat())
+    found_at = Column(BigInteger, nullable=False, default=now_ms)  # epoch ms, UTC
+
+
+class PriceRollup(Base):
+    """Daily aggregate of the PriceHistory rows pruned by retention.
+
+    One row per product, channel and UTC day; the raw rows are deleted
+    once rolled up.
+    """
+    __tablename__ = "price_rollups"
+    __table_args__ = (
+        # Also serves /history (product_id, latest day first)
+        UniqueConstraint("product_id", "day", "channel", name="uq_price_rollup"),
+        Index("ix_price_rollups_user_day", "user_id", "day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, ForeignKey(
+        "products.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey(
+        "users.user_id", ondelete="CASCADE"), nullable=False)
+    channel = Column(String, nullable=False)
+    day = Column(BigInteger, nullable=False)  # epoch ms of the UTC midnight
+    match_count = Column(Integer, nullable=False, default=0)
+    priced_count = Column(Integer, nullable=False, default=0)  # matches with a price
+    price_min = Column(Float, nullable=True)
+    price_max = Column(Float, nullable=True)
+    price_sum = Column(Float, nullable=False, default=0.0)
+
+    @property
+    def price_avg(self) -> float | None:
+        return self.price_sum / self.priced_count if self.priced_count else None
+
+
+class UserStats(Base):
+    """A user's /stats counters, updated with the rows they count (see user_stats.py)."""
+    __tablename__ = "user_stats"
+
+    user_id = Column(BigInteger, ForeignKey(
+        "users.user_id", ondelete="CASCADE"), primary_key=True)
+    product_count = Column(Integer, nullable=False, default=0)
+    channel_count = Column(Integer, nullable=False, default=0)
+    match_count = Column(Integer, nullable=False, default=0)
+    top_product_id = Column(Integer, ForeignKey(
+        "products.id", ondelete="SET NULL"), nullable=True)
+    top_product_count = Column(Integer, nullable=False, default=0)
+    top_channel = Column(String, nullable=True)
+    top_channel_count = Column(Integer, nullable=False, default=0)
+    last_match_at = Column(BigInteger, nullable=True)  # epoch ms, UTC
+
+
+class ChannelMatchCount(Base):
+    """A user's matches per channel (history + rollups), to keep UserStats.top_channel current."""
+    __tablename__ = "channel_match_counts"
+
+    user_id = Column(BigInteger, ForeignKey(
+        "users.user_id", ondelete="CASCADE"), primary_key=True)
+    channel = Column(String, primary_key=True)
+    match_count = Column(Integer, nullable=False, default=0)
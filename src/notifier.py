@@ -0,0 +1,297 @@
+"""
+Outbound notification dispatcher (rate limits, FloodWait, retries, priorities).
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+from telethon import TelegramClient
+from telethon.errors import (
+    ChatWriteForbiddenError,
+    FloodWaitError,
+    InputUserDeactivatedError,
+    PeerIdInvalidError,
+    UserIsBlockedError,
+)
+
+from metrics import FRESHNESS_SECONDS, NOTIFICATIONS, STAGE_SECONDS
+
+log = logging.getLogger(__name__)
+
+# Lower value = sent first
+PRIORITY_TARGET = 0    # realtime match under the user's target price
+PRIORITY_MATCH = 1     # realtime match on a product without target price
+PRIORITY_BACKFILL = 2  # matches found in channel history
+PRIORITY_SUMMARY = 3   # daily summaries
+
+# Metrics label of each priority
+_PATHS = {PRIORITY_TARGET: "realtime", PRIORITY_MATCH: "realtime", PRIORITY_BACKFILL: "backfill",
+          PRIORITY_SUMMARY: "summary"}
+
+# Errors that a retry cannot fix
+_PERMANENT_ERRORS = (
+    ChatWriteForbiddenError,
+    InputUserDeactivatedError,
+    PeerIdInvalidError,
+    UserIsBlockedError,
+)
+
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second, up to capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+
+    def _refill(self) -> float:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self) -> float:
+        """Take a token if available. Returns 0 on success, else the seconds to wait."""
+        delay = self.wait_time()
+        if delay == 0:
+            self._tokens -= 1
+        return delay
+
+
+class _Notification:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "attempts", "origin", "queued_at")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict, priority: int, origin: float | None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.attempts = 0
+        self.origin = origin  # epoch seconds of the channel post, for freshness metrics
+        self.queued_at = time.perf_counter()
+
+
+class _Lane:
+    """Pending notifications for one chat, sent one at a time."""
+
+    __slots__ = ("chat_id", "queue", "bucket", "paused_until", "busy", "scheduled")
+
+    def __init__(self, chat_id: int, bucket: TokenBucket):
+        self.chat_id = chat_id
+        self.queue: list[tuple[int, int, _Notification]] = []  # heap of (priority, seq, notification)
+        self.bucket = bucket
+        self.paused_until = 0.0
+        self.busy = False
+        self.scheduled = False
+
+
+class NotificationDispatcher:
+    """Send bot messages through per-chat lanes with shared rate limits.
+
+    Each chat has its own token bucket and at most one message in flight, so
+    messages to a chat keep their priority order. A global bucket caps the
+    total rate and a semaphore caps concurrent requests. A FloodWaitError
+    pauses only the chat that received it; the client's flood_sleep_threshold
+    is set to 0 so Telethon raises every FloodWait instead of sleeping through
+    short ones while holding a concurrency slot. Failed sends are retried with
+    backoff; after max_retries (or on permanent errors such as a blocked bot)
+    the notification is logged and kept in dead_letters.
+
+    Defaults follow the Bot API limits: about 30 messages per second overall
+    and one message per second to the same chat.
+    """
+
+    def __init__(
+        self,
+        bot_client: TelegramClient,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: int = 3,
+        concurrency: int = 8,
+        max_retries: int = 3,
+        retry_delay: float = 2.0,
+        clock=time.monotonic,
+    ):
+        self.bot_client = bot_client
+        bot_client.flood_sleep_threshold = 0
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._clock = clock
+        self._global = TokenBucket(global_rate, max(1, global_rate), clock)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lanes: dict[int, _Lane] = {}
+        self._ready: list[tuple[int, int, int]] = []        # (priority, seq, chat_id)
+        self._waiting: list[tuple[float, int, int]] = []    # (not_before, seq, chat_id)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task: asyncio.Task | None = None
+        self._pending = 0
+        self.sent = 0
+        self.retries = 0
+        self.flood_waits = 0
+        self.dead_letters: deque[tuple[int, str, str]] = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    def metrics(self) -> dict[str, int]:
+        """Snapshot of the dispatcher's counters."""
+        return {
+            "queue_depth": self._pending,
+            "sent": self.sent,
+            "retries": self.retries,
+            "flood_waits": self.flood_waits,
+            "dead": len(self.dead_letters),
+        }
+
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_MATCH, origin: float | None = None,
+             **kwargs) -> None:
+        """Queue a message for chat_id. kwargs are passed to bot_client.send_message.
+
+        origin is the time (epoch seconds) of the post that triggered it, if any.
+        """
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane(chat_id, TokenBucket(self.chat_rate, self.chat_burst, self._clock))
+        heapq.heappush(lane.queue, (priority, next(self._seq), _Notification(chat_id, text, kwargs, priority, origin)))
+        self._pending += 1
+        self._idle.clear()
+        self._schedule(lane)
+        self.start()
+
+    def start(self) -> None:
+        """Start the dispatch loop (idempotent, needs a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def join(self) -> None:
+        """Wait until every queued message has been sent or dead-lettered."""
+        await self._idle.wait()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Give queued messages up to timeout seconds, then stop the loop."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            log.error("Notification dispatcher stopped with %d unsent messages", self._pending)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _schedule(self, lane: _Lane) -> None:
+        """Put an idle lane with pending messages in the ready or waiting heap."""
+        if lane.busy or lane.scheduled or not lane.queue:
+            return
+        lane.scheduled = True
+        not_before = max(lane.paused_until, self._clock() + lane.bucket.wait_time())
+        if not_before <= self._clock():
+            heapq.heappush(self._ready, (lane.queue[0][0], next(self._seq), lane.chat_id))
+        else:
+            heapq.heappush(self._waiting, (not_before, next(self._seq), lane.chat_id))
+        self._wakeup.set()
+
+    async def _loop(self) -> None:
+        while True:
+            now = self._clock()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._waiting)
+                lane = self._lanes[chat_id]
+                heapq.heappush(self._ready, (lane.queue[0][0], next(self._seq), chat_id))
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.take()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            await self._semaphore.acquire()
+            _, _, chat_id = heapq.heappop(self._ready)
+            lane = self._lanes[chat_id]
+            lane.scheduled = False
+            lane.bucket.take()
+            _, _, notification = heapq.heappop(lane.queue)
+            lane.busy = True
+            asyncio.ensure_future(self._deliver(lane, notification))
+
+    async def _deliver(self, lane: _Lane, notification: _Notification) -> None:
+        path = _PATHS.get(notification.priority, "other")
+        started = time.perf_counter()
+        STAGE_SECONDS.observe(started - notification.queued_at, path=path, stage="send_queue")
+        done = True
+        outcome = "sent"
+        try:
+            await self.bot_client.send_message(notification.chat_id, notification.text, **notification.kwargs)
+            self.sent += 1
+            if notification.origin is not None:
+                FRESHNESS_SECONDS.observe(max(0.0, time.time() - notification.origin), path=path)
+        except FloodWaitError as e:
+            outcome = "flood_wait"
+            self.flood_waits += 1
+            log.warning("FloodWait for chat %s: pausing it for %ss", lane.chat_id, e.seconds)
+            lane.paused_until = self._clock() + e.seconds
+            done = False
+        except _PERMANENT_ERRORS as e:
+            outcome = "dead"
+            self._dead_letter(notification, e)
+        except Exception as e:
+            notification.attempts += 1
+            if notification.attempts > self.max_retries:
+                outcome = "dead"
+                self._dead_letter(notification, e)
+            else:
+                outcome = "retry"
+                self.retries += 1
+                log.warning("Error sending to %s (attempt %d): %s", lane.chat_id, notification.attempts, e)
+                lane.paused_until = self._clock() + self.retry_delay * 2 ** (notification.attempts - 1)
+                done = False
+        finally:
+            self._semaphore.release()
+            STAGE_SECONDS.observe(time.perf_counter() - started, path=path, stage="send")
+            NOTIFICATIONS.inc(outcome=outcome)
+
+        if done:
+            self._pending -= 1
+        else:
+            # Back at the head of its priority, ahead of newer messages
+            heapq.heappush(lane.queue, (notification.priority, -next(self._seq), notification))
+        lane.busy = False
+        self._schedule(lane)
+        if self._pending == 0:
+            self._idle.set()
+
+    def _dead_letter(self, notification: _Notification, error: Exception) -> None:
+        log.error(
+            "Dropping notification to %s after %d attempts: %s | %s",
+            notification.chat_id, notification.attempts + 1, error, notification.text[:80],
+        )
+        self.dead_letters.append((notification.chat_id, notification.text, repr(error)))
@@ -0,0 +1,69 @@
+"""
+Cheap checks that rule out messages no watched product can match.
+"""
+
+from fuzzy import trigrams
+from matcher import PreparedMessage
+from price_parser import has_currency
+
+SKIP_NO_CURRENCY = "no_currency"
+SKIP_NO_TOKENS = "no_tokens"
+
+# Letters from most to least frequent in Italian/English product posts:
+# the anchor of a name is its trigram made of the rarest characters.
+_COMMON = " eaoinrtlscdupmvghfbqzkwyxj"
+_RANK = {ch: i for i, ch in enumerate(_COMMON)}
+
+# Up to this many anchors, substring searches beat building the message's trigram set
+_SCAN_LIMIT = 64
+
+
+def _rarity(gram: str) -> int:
+    return sum(_RANK.get(ch, len(_COMMON)) for ch in gram)
+
+
+class MessagePrefilter:
+    """Necessary conditions for a message to match any of a set of products.
+
+    - Currency: if every product has a target price, a message without
+      €/EUR/euro can't pass the price filter.
+    - Tokens: an exact name occurring in the message brings all its
+      trigrams, so each name contributes one anchor trigram (its rarest);
+      a name with k allowed typos keeps at least D - 3k of its D trigrams,
+      so all of them are anchors. A message sharing no anchor with the set
+      is skipped. Names too short for this disable the token check.
+
+    Both checks can only skip messages that would not have matched.
+    """
+
+    __slots__ = ("needs_price", "anchors", "filter_tokens", "_anchor_list")
+
+    def __init__(self, records=()):
+        records = list(records)
+        self.needs_price = bool(records) and all(r.target_price is not None for r in records)
+        self.anchors: set[str] = set()
+        self.filter_tokens = bool(records)
+        for record in records:
+            grams = trigrams(record.name_norm)
+            if record.typo_tolerance:
+                if len(grams) - 3 * record.typo_tolerance <= 0:
+                    self.filter_tokens = False
+                self.anchors |= grams
+            elif grams:
+                self.anchors.add(max(grams, key=_rarity))
+            else:
+                self.filter_tokens = False
+        self._anchor_list = list(self.anchors) if len(self.anchors) <= _SCAN_LIMIT else None
+
+    def check(self, message: PreparedMessage) -> str | None:
+        """Return why the message can't match (SKIP_*), or None if it may."""
+        if self.needs_price and not has_currency(message.text):
+            return SKIP_NO_CURRENCY
+        if self.filter_tokens:
+            if self._anchor_list is not None:
+                norm = message.norm
+                if not any(anchor in norm for anchor in self._anchor_list):
+                    return SKIP_NO_TOKENS
+            elif self.anchors.isdisjoint(message.grams):
+                return SKIP_NO_TOKENS
+        return None
@@ -3,18 +3,36 @@ Extract prices from text (European/Italian formats).
 """
 
 import re
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
 
 # Pattern for European price formats:
 # €123 | 123€ | €123,50 | 123.50€ | EUR 123 | 123 euro | 1.234,56€ | etc.
+# Thousands groups are capped at 4 (up to 999.999.999.999.999): with an
+# unbounded (?:\.\d{3})* every start position inside a long "1.234.567..."
+# dump rescans it to the end, which is quadratic in its length. Amounts
+# written without separators ("1099€", "€ 12345") are read whole, up to the
+# same 15 digits. Numbers must not start or end next to another digit or
+# ".digit", so larger amounts are skipped instead of being read from their
+# last digits (the lookbehinds follow the first digit so the scan for \d
+# stays fast).
 _PRICE_PATTERN = re.compile(
     r"""
-    (?:€|EUR|euro)\s*(\d{1,3}(?:\.\d{3})*(?:,\d{1,2})?)  # €1.234,56 or EUR 123
+    (?:€|EUR|euro)\s*(\d(?:\d{0,2}(?:\.\d{3}){0,4}|\d{3,14})(?!\.?\d)(?:,\d{1,2})?)  # €1.234,56 or EUR 123
     |
-    (\d{1,3}(?:\.\d{3})*(?:,\d{1,2})?)\s*(?:€|EUR|euro)  # 1.234,56€ or 123 euro
+    (\d(?<!\d\d)(?<!\d\.\d)(?:\d{0,2}(?:\.\d{3}){0,4}|\d{3,14})(?!\.?\d)(?:,\d{1,2})?)\s*(?:€|EUR|euro)  # 1.234,56€ or 123 euro
     """,
     re.IGNORECASE | re.VERBOSE,
 )
 
+_CURRENCY_PATTERN = re.compile(r"€|eur", re.IGNORECASE)
+
+
+def has_currency(text: str) -> bool:
+    """Cheap necessary condition for extract_prices() to find anything."""
+    return _CURRENCY_PATTERN.search(text) is not None
+
 
 def _to_float(raw: str) -> float:
     """Convert '1.234,56' -> 1234.56"""
@@ -29,3 +47,143 @@ def extract_prices(text: str) -> list[float]:
         if raw:
             prices.append(_to_float(raw))
     return prices
+
+
+class PriceBatch:
+    """Prices of many messages in two flat arrays.
+
+    The prices of message i are values[offsets[i]:offsets[i + 1]].
+    """
+
+    __slots__ = ("values", "offsets")
+
+    def __init__(self, values: array, offsets: array):
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> list[float]:
+        return self.values[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+
+def extract_prices_many(texts: list[str]) -> PriceBatch:
+    """extract_prices() for a batch of texts, with a single scan of a joined buffer.
+
+    Texts are joined with NUL, which no price can span.
+    """
+    values = array("d")
+    offsets = array("q", [0])
+    ends = []  # end of each text in the buffer, separator included
+    pos = 0
+    for text in texts:
+        pos += len(text) + 1
+        ends.append(pos)
+    i = 0
+    for match in _PRICE_PATTERN.finditer("\0".join(texts)):
+        start = match.start()
+        while start >= ends[i]:
+            offsets.append(len(values))
+            i += 1
+        values.append(_to_float(match.group(1) or match.group(2)))
+    while len(offsets) <= len(texts):
+        offsets.append(len(values))
+    return PriceBatch(values, offsets)
+
+
+# Prices plus the separators that split a message into segments (lines,
+# bullets, " / ", " | ") and clauses (", " or "; "), matched in one pass.
+# Prices come first so the comma of "1.234,56€" is never a clause break.
+_LAYOUT_PATTERN = re.compile(
+    _PRICE_PATTERN.pattern + r"""
+    |
+    (?P<segment>\n|\s[/|]\s|[•·▪►▶➤➡👉🔹🔸✅✔🔥])
+    |
+    (?P<clause>[,;](?=\s))
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+
+@dataclass(slots=True)
+class PriceSpan:
+    """A price and where it is in the text."""
+    value: float
+    start: int
+    end: int
+    segment: int  # index of the line/bullet containing the price
+    clause: int   # index of the clause (segments are split further at ", " and "; ")
+
+
+class PriceLayout:
+    """Prices of a message with their spans, and its segment/clause boundaries."""
+
+    __slots__ = ("prices", "segment_starts", "clause_starts")
+
+    def __init__(self, prices: list[PriceSpan], segment_starts: list[int], clause_starts: list[int]):
+        self.prices = prices
+        self.segment_starts = segment_starts
+        self.clause_starts = clause_starts
+
+    def prices_for(self, spans: list[tuple[int, int]], other_spans: list[tuple[int, int]]) -> list[float]:
+        """Prices of the product mentioned at text[start:end] for each (start, end) in spans.
+
+        other_spans are the mentions of the other products in the message.
+        When none of them is in a clause of its own, every price is returned.
+        Otherwise each mention takes every price from its clause up to the
+        next clause mentioning another product, or prices_near() if there
+        are none in between.
+        """
+        own = {bisect_right(self.clause_starts, start) - 1 for start, _ in spans}
+        others = sorted({bisect_right(self.clause_starts, start) - 1 for start, _ in other_spans} - own)
+        if not others:
+            return [p.value for p in self.prices]
+        found = []
+        for start, end in spans:
+            first = bisect_right(self.clause_starts, start) - 1
+            stop = next((i for i in others if i > first), len(self.clause_starts))
+            scoped = [p.value for p in self.prices if first <= p.clause < stop]
+            found.extend(scoped or self.prices_near(start, end))
+        return found
+
+    def prices_near(self, start: int, end: int) -> list[float]:
+        """Candidate prices for a product mentioned at text[start:end].
+
+        In order of preference: the prices in the mention's clause, the
+        nearest price in its segment, the first price after it, the last
+        price before it.
+        """
+        clause = bisect_right(self.clause_starts, start) - 1
+        found = [p.value for p in self.prices if p.clause == clause]
+        if found:
+            return found
+        segment = bisect_right(self.segment_starts, start) - 1
+        same_segment = [p for p in self.prices if p.segment == segment]
+        if same_segment:
+            nearest = min(same_segment, key=lambda p: p.start - end if p.start >= end else start - p.end)
+            return [nearest.value]
+        after = [p.value for p in self.prices if p.start >= end]
+        if after:
+            return after[:1]
+        return [self.prices[-1].value] if self.prices else []
+
+
+def extract_price_layout(text: str) -> PriceLayout:
+    """Return the prices of text with their spans, segments and clauses (single scan)."""
+    prices = []
+    segment_starts = [0]
+    clause_starts = [0]
+    for match in _LAYOUT_PATTERN.finditer(text):
+        if match.lastgroup == "segment":
+            segment_starts.append(match.end())
+            clause_starts.append(match.end())
+        elif match.lastgroup == "clause":
+            clause_starts.append(match.end())
+        else:
+            raw = match.group(1) or match.group(2)
+            prices.append(PriceSpan(
+                _to_float(raw), match.start(), match.end(),
+                len(segment_starts) - 1, len(clause_starts) - 1,
+            ))
+    return PriceLayout(prices, segment_starts, clause_starts)
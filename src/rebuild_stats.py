@@ -0,0 +1,29 @@
+"""
+Rebuild the /stats counters (user_stats) from the price history.
+Run after editing the database by hand, or if /stats drifts from /history.
+
+Usage: python src/rebuild_stats.py [user_id ...]
+"""
+
+import sys
+
+from database import Base, engine, run_migrations
+from user_stats import rebuild_stats
+
+
+def main():
+    try:
+        user_ids = [int(arg) for arg in sys.argv[1:]] or None
+    except ValueError:
+        print("Usage: python src/rebuild_stats.py [user_id ...]")
+        sys.exit(1)
+
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
+    with engine.begin() as conn:
+        rebuilt = rebuild_stats(conn, user_ids)
+    print(f"Rebuilt the stats of {rebuilt} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Retention for PriceHistory: old rows are rolled up into daily aggregates and deleted.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+from sqlalchemy import delete, exists, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from metrics import HISTORY_PRUNED
+from models import ChannelMessage, PriceHistory, PriceRollup
+from timestamps import DAY_MS, now_ms, utc_day_ms
+
+log = logging.getLogger(__name__)
+
+
+class HistoryRetention:
+    """Keep raw PriceHistory rows for retention_days, daily rollups (PriceRollup) after that.
+
+    Every interval seconds, rows older than the cutoff (a UTC midnight) are
+    processed oldest first, batch_size rows per transaction: they are added
+    to the rollup of their (product, channel, day) and deleted in the same
+    transaction, along with the posts (channel_messages) no other row
+    references. The task sleeps pause seconds between batches so the
+    history writer's commits interleave with the prune.
+    """
+
+    def __init__(
+        self,
+        db_session_factory: async_sessionmaker,
+        retention_days: int,
+        batch_size: int = 500,
+        interval: float = 3600.0,
+        pause: float = 0.05,
+    ):
+        if retention_days < 1:
+            raise ValueError("retention_days must be at least 1")
+        self._session_factory = db_session_factory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self._task: asyncio.Task | None = None
+        self.pruned = 0
+        self.batches = 0
+        self.failures = 0
+
+    def metrics(self) -> dict[str, int]:
+        """Snapshot of the retention counters."""
+        return {"pruned": self.pruned, "batches": self.batches, "failures": self.failures}
+
+    def cutoff(self, now: int | None = None) -> int:
+        """Rows found before this epoch ms are rolled up: whole UTC days only."""
+        return utc_day_ms(now if now is not None else now_ms()) - self.retention_days * DAY_MS
+
+    def start(self) -> None:
+        """Start the periodic prune (idempotent, needs a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failures += 1
+                log.error("PriceHistory retention failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: int | None = None) -> int:
+        """Roll up and delete every row older than the cutoff. Returns the rows pruned."""
+        cutoff = self.cutoff(now)
+        total = 0
+        while True:
+            async with self._session_factory() as session:
+                pruned = await self._prune_batch(session, cutoff)
+                await session.commit()
+            if not pruned:
+                break
+            total += pruned
+            self.pruned += pruned
+            self.batches += 1
+            HISTORY_PRUNED.inc(pruned)
+            await asyncio.sleep(self.pause)
+        if total:
+            log.info("PriceHistory retention: %d rows older than %d days rolled up", total, self.retention_days)
+        return total
+
+    async def _prune_batch(self, session: AsyncSession, cutoff: int) -> int:
+        rows = (await session.execute(
+            select(PriceHistory.id, PriceHistory.product_id, PriceHistory.user_id, PriceHistory.channel_message_id,
+                   ChannelMessage.channel, PriceHistory.price, PriceHistory.found_at)
+            .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+            .where(PriceHistory.found_at < cutoff)
+            .order_by(PriceHistory.found_at)
+            .limit(self.batch_size)
+        )).all()
+        if not rows:
+            return 0
+
+        groups: dict[tuple, list] = {}
+        for row in rows:
+            key = (row.product_id, utc_day_ms(row.found_at), row.channel)
+            groups.setdefault(key, []).append(row)
+
+        existing = {
+            (r.product_id, r.day, r.channel): r
+            for r in (await session.scalars(
+                select(PriceRollup).where(
+                    tuple_(PriceRollup.product_id, PriceRollup.day, PriceRollup.channel).in_(list(groups))
+                )
+            )).all()
+        }
+        for (product_id, day, channel), group in groups.items():
+            rollup = existing.get((product_id, day, channel))
+            if rollup is None:
+                rollup = PriceRollup(product_id=product_id, user_id=group[0].user_id, channel=channel, day=day,
+                                     match_count=0, priced_count=0, price_sum=0.0)
+                session.add(rollup)
+            prices = [r.price for r in group if r.price is not None]
+            rollup.match_count += len(group)
+            if prices:
+                rollup.priced_count += len(prices)
+                rollup.price_sum += sum(prices)
+                rollup.price_min = min(prices) if rollup.price_min is None else min(rollup.price_min, *prices)
+                rollup.price_max = max(prices) if rollup.price_max is None else max(rollup.price_max, *prices)
+
+        await session.flush()
+        await session.execute(delete(PriceHistory).where(PriceHistory.id.in_([r.id for r in rows])))
+        # Posts whose last history row is gone
+        await session.execute(delete(ChannelMessage).where(
+            ChannelMessage.id.in_({r.channel_message_id for r in rows}),
+            ~exists().where(PriceHistory.channel_message_id == ChannelMessage.id),
+        ))
+        return len(rows)
+
+
+@dataclass(slots=True)
+class DailySummary:
+    """A product's rolled-up matches on one UTC day, across channels."""
+    day: int
+    price_min: float | None
+    price_max: float | None
+    price_avg: float | None
+    match_count: int
+    channels: list[str]
+
+
+async def daily_history(session: AsyncSession, product_id: int, limit: int,
+                        before: int | None = None) -> list[DailySummary]:
+    """The product's last `limit` rolled-up days (before the epoch ms `before`, if given), latest first."""
+    days = select(PriceRollup.day).where(PriceRollup.product_id == product_id)
+    if before is not None:
+        days = days.where(PriceRollup.day < before)
+    days = days.distinct().order_by(PriceRollup.day.desc()).limit(limit)
+    rollups = (await session.scalars(
+        select(PriceRollup)
+        .where(PriceRollup.product_id == product_id, PriceRollup.day.in_(days.scalar_subquery()))
+        .order_by(PriceRollup.day.desc(), PriceRollup.match_count.desc())
+    )).all()
+
+    by_day: dict[int, list[PriceRollup]] = {}
+    for rollup in rollups:
+        by_day.setdefault(rollup.day, []).append(rollup)
+    summaries = []
+    for day, group in by_day.items():
+        mins = [r.price_min for r in group if r.price_min is not None]
+        maxs = [r.price_max for r in group if r.price_max is not None]
+        priced = sum(r.priced_count for r in group)
+        summaries.append(DailySummary(
+            day=day,
+            price_min=min(mins) if mins else None,
+            price_max=max(maxs) if maxs else None,
+            price_avg=sum(r.price_sum for r in group) / priced if priced else None,
+            match_count=sum(r.match_count for r in group),
+            channels=[r.channel for r in group],
+        ))
+    return summaries
@@ -4,17 +4,27 @@ Scheduler for periodic tasks (daily summary).
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from telethon import TelegramClient
 
-from models import User, PriceHistory, Product
+from models import ChannelMessage, User, PriceHistory, Product
+from metrics import STAGE_SECONDS
+from notifier import NotificationDispatcher, PRIORITY_SUMMARY
+from timestamps import start_of_day_ms
 from translations import t, DEFAULT_LANGUAGE
 
 log = logging.getLogger(__name__)
 
+# Matches listed per product; the rest are counted
+_SUMMARY_SHOWN = 5
+# Rows fetched per round trip while building the summaries
+_SUMMARY_BATCH = 1000
+
 
 class DailySummaryScheduler:
     """Sends a daily summary of matches found."""
@@ -22,14 +32,16 @@ class DailySummaryScheduler:
     def __init__(
         self,
         bot_client: TelegramClient,
-        db_session_factory: sessionmaker,
+        db_session_factory: async_sessionmaker,
         hour: int = 21,
         tz_name: str = "UTC",
+        notifier: NotificationDispatcher = None,
     ):
         self.bot_client = bot_client
         self._session_factory = db_session_factory
         self.hour = hour
         self.tz = ZoneInfo(tz_name)
+        self._notifier = notifier if notifier is not None else NotificationDispatcher(bot_client)
         self._task = None
 
     def start(self):
@@ -50,49 +62,76 @@ class DailySummaryScheduler:
 
             await self._send_summaries()
 
-    async def _send_summaries(self):
-        today_start = datetime.now(self.tz).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        ).isoformat()
-
-        with self._session_factory() as session:
-            users = session.query(User).filter(User.paused == False).all()  # noqa: E712
-            user_data = [(u.user_id, u.lang_code or DEFAULT_LANGUAGE) for u in users]
-
-        for uid, lang in user_data:
-            with self._session_factory() as session:
-                entries = (
-                    session.query(PriceHistory)
-                    .filter(
-                        PriceHistory.user_id == uid,
-                        PriceHistory.found_at >= today_start,
-                    )
-                    .order_by(PriceHistory.found_at.desc())
-                    .all()
-                )
-
-                if not entries:
-                    continue
-
-                # Group by product
-                by_product = {}
-                for e in entries:
-                    product = session.query(Product).filter_by(id=e.product_id).first()
-                    name = product.name if product else "???"
-                    by_product.setdefault(name, []).append(e)
-
-                lines = [t("summary_header", lang, count=len(entries))]
-                for name, matches in by_product.items():
-                    lines.append(t("summary_product", lang, name=name, count=len(matches)))
-                    for m in matches[:5]:
-                        price_str = f"{m.price:.2f}" if m.price else "N/A"
-                        link_str = f" " if m.message_link else ""
-                        lines.append(f"  {price_str} in {m.channel}{link_str}")
-                    if len(matches) > 5:
-                        lines.append(t("summary_more", lang, count=len(matches) - 5))
-
-            try:
-                await self.bot_client.send_message(uid, "\n".join(lines))
-                log.info("Summary sent to user_id=%s (%d matches)", uid, len(entries))
-            except Exception as e:
-                log.error("Error sending summary to %s: %s", uid, e)
+    async def _send_summaries(self, since: int | None = None):
+        """Queue today's summary (matches since `since`, default the last local midnight) for every active user.
+
+        A single query returns every user's summary rows, ordered by user,
+        and each summary is queued as soon as its last row is read. The
+        dispatcher fans them out with its rate limits and concurrency cap.
+        """
+        since = since if since is not None else start_of_day_ms(self.tz)
+        started = time.perf_counter()
+        users = matches = 0
+        async with self._session_factory() as session:
+            result = await session.stream(_summary_query(since).execution_options(yield_per=_SUMMARY_BATCH))
+            current, lang, products = None, DEFAULT_LANGUAGE, []
+            async for row in result:
+                if row.user_id != current:
+                    if products:
+                        matches += self._queue_summary(current, lang, products)
+                        users += 1
+                    current, lang, products = row.user_id, row.lang_code or DEFAULT_LANGUAGE, []
+                if not products or products[-1][0] != row.product_id:
+                    products.append((row.product_id, row.name, row.matches, []))
+                products[-1][3].append(row)
+            if products:
+                matches += self._queue_summary(current, lang, products)
+                users += 1
+        STAGE_SECONDS.observe(time.perf_counter() - started, path="summary", stage="db_read")
+        log.info("Daily summaries queued for %d users (%d matches)", users, matches)
+
+    def _queue_summary(self, uid: int, lang: str, products: list) -> int:
+        """Format and queue one user's summary. Returns the matches it covers."""
+        total = sum(count for _, _, count, _ in products)
+        lines = [t("summary_header", lang, count=total)]
+        for _, name, count, shown in products:
+            lines.append(t("summary_product", lang, name=name, count=count))
+            for m in shown:
+                price_str = f"{m.price:.2f}" if m.price else "N/A"
+                link_str = f" " if m.link else ""
+                lines.append(f"  {price_str} in {m.channel}{link_str}")
+            if count > len(shown):
+                lines.append(t("summary_more", lang, count=count - len(shown)))
+        self._notifier.send(uid, "\n".join(lines), PRIORITY_SUMMARY)
+        return total
+
+
+def _summary_query(since: int):
+    """Matches since `since` of every active user: up to _SUMMARY_SHOWN rows per product
+    (latest first), each with the product's match count, ordered by user and
+    by the product's latest match."""
+    # Materialized so the planner reads today's rows through the found_at
+    # index rather than walking (product_id, found_at) for the window order
+    today = (
+        select(PriceHistory.id, PriceHistory.user_id, PriceHistory.product_id, PriceHistory.price,
+               PriceHistory.channel_message_id, PriceHistory.found_at)
+        .where(PriceHistory.found_at >= since)
+        .cte("today")
+        .prefix_with("MATERIALIZED")
+    )
+    per_product = {"partition_by": today.c.product_id}
+    ranked = select(
+        today.c.user_id, today.c.product_id, today.c.price, today.c.channel_message_id,
+        func.row_number().over(**per_product, order_by=(today.c.found_at.desc(), today.c.id.desc())).label("rank"),
+        func.count().over(**per_product).label("matches"),
+        func.max(today.c.found_at).over(**per_product).label("latest"),
+    ).subquery()
+    return (
+        select(ranked.c.user_id, User.lang_code, ranked.c.product_id, Product.name, ranked.c.matches,
+               ranked.c.price, ChannelMessage.channel, ChannelMessage.link)
+        .join(User, User.user_id == ranked.c.user_id)
+        .join(Product, Product.id == ranked.c.product_id)
+        .join(ChannelMessage, ChannelMessage.id == ranked.c.channel_message_id)
+        .where(User.paused == False, ranked.c.rank <= _SUMMARY_SHOWN)  # noqa: E712
+        .order_by(ranked.c.user_id, ranked.c.latest.desc(), ranked.c.product_id, ranked.c.rank)
+    )
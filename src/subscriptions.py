@@ -0,0 +1,274 @@
+"""
+In-memory index of channel subscriptions and watched products.
+
+Loaded once at startup and kept up to date by the bot/client commands, so the
+channel listener can find the products to check without touching the DB.
+"""
+
+import logging
+from sqlalchemy.orm import sessionmaker
+
+from fuzzy import FuzzyMatcher, trigrams
+from match_workers import MatchWorkerPool, ShardedProductMatcher
+from matcher import PreparedMessage, ProductMatcher, ProductRecord
+from metrics import PREFILTER_SKIPPED
+from models import Channel, Product, User, UserChannel
+from prefilter import SKIP_NO_CURRENCY, SKIP_NO_TOKENS, MessagePrefilter
+from translations import DEFAULT_LANGUAGE
+
+log = logging.getLogger(__name__)
+
+
+class _ChannelEntry:
+    """Subscribers of a channel and the matchers over their active products."""
+
+    __slots__ = ("identifier", "users", "matcher", "fuzzy", "records", "_prefilter")
+
+    def __init__(self, identifier: str, workers: MatchWorkerPool | None = None):
+        self.identifier = identifier
+        self.users: set[int] = set()
+        self.matcher = ProductMatcher() if workers is None else ShardedProductMatcher(workers)
+        self.fuzzy = FuzzyMatcher()
+        self.records: dict[int, ProductRecord] = {}
+        self._prefilter: MessagePrefilter | None = None
+
+    @property
+    def prefilter(self) -> MessagePrefilter:
+        """Rebuilt on first use after the products changed."""
+        if self._prefilter is None:
+            self._prefilter = MessagePrefilter(self.records.values())
+        return self._prefilter
+
+    def add(self, record: ProductRecord) -> None:
+        self.matcher.add(record.id, record.name)
+        if record.typo_tolerance:
+            self.fuzzy.add(record.id, record.name_norm, record.typo_tolerance)
+        self.records[record.id] = record
+        self._prefilter = None
+
+    def remove(self, product_id: int) -> None:
+        self.matcher.remove(product_id)
+        self.fuzzy.remove(product_id)
+        if self.records.pop(product_id, None) is not None:
+            self._prefilter = None
+
+
+class SubscriptionIndex:
+    """Channel -> subscribed products index used by the realtime listener.
+
+    Channels are keyed by their DB identifier, which is the username for public
+    channels and the numeric id for channels joined through an invite link.
+
+    With fuzzy=True, products with a typo tolerance are also indexed by
+    trigram so misspelled mentions are found; otherwise tolerances are ignored.
+
+    With a MatchWorkerPool, exact matching runs in the worker processes;
+    fuzzy matching stays in-process.
+    """
+
+    def __init__(self, fuzzy: bool = False, workers: MatchWorkerPool | None = None):
+        self.fuzzy = fuzzy
+        self.workers = workers
+        self.clear()
+
+    def clear(self) -> None:
+        """Drop all indexed data."""
+        self.prefilter_stats = {"checked": 0, SKIP_NO_CURRENCY: 0, SKIP_NO_TOKENS: 0}
+        self._products: dict[int, ProductRecord] = {}
+        self._user_products: dict[int, set[int]] = {}
+        self._user_channels: dict[int, set[str]] = {}
+        self._langs: dict[int, str] = {}
+        self._paused: set[int] = set()
+        self._dedupe_off: set[int] = set()
+        self._channels: dict[str, _ChannelEntry] = {}
+        if self.workers is not None:
+            self.workers.clear()
+
+    def load(self, session_factory: sessionmaker) -> None:
+        """(Re)build the whole index from the database."""
+        self.clear()
+        with session_factory() as session:
+            for user in session.query(User).all():
+                self.add_user(
+                    user.user_id, user.lang_code or DEFAULT_LANGUAGE,
+                    paused=bool(user.paused), dedupe=user.dedupe_deals is not False,
+                )
+            for user_id, identifier in (
+                session.query(UserChannel.user_id, Channel.identifier)
+                .join(Channel, Channel.id == UserChannel.channel_id)
+                .all()
+            ):
+                self.subscribe(user_id, identifier)
+            for product in session.query(Product).all():
+                self.add_product(
+                    product.id, product.user_id, product.name, product.target_price,
+                    typo_tolerance=product.typo_tolerance,
+                )
+        log.info(
+            "Subscription index loaded: %d products, %d channels",
+            len(self._products), len(self._channels),
+        )
+
+    # --- Writes (called by bot/client commands after the DB commit) ---
+
+    def add_user(self, user_id: int, lang_code: str = DEFAULT_LANGUAGE, paused: bool = False,
+                 dedupe: bool = True) -> None:
+        """Register a user (idempotent)."""
+        self._langs[user_id] = lang_code
+        self._user_products.setdefault(user_id, set())
+        self._user_channels.setdefault(user_id, set())
+        self.set_dedupe(user_id, dedupe)
+        if paused:
+            self.set_paused(user_id, True)
+
+    def set_dedupe(self, user_id: int, enabled: bool) -> None:
+        """Choose whether a user is notified only once per deal forwarded across channels."""
+        if enabled:
+            self._dedupe_off.discard(user_id)
+        else:
+            self._dedupe_off.add(user_id)
+
+    def set_lang(self, user_id: int, lang_code: str) -> None:
+        """Update the language used for a user's notifications."""
+        self._langs[user_id] = lang_code
+        for product_id in self._user_products.get(user_id, ()):
+            self._products[product_id].lang_code = lang_code
+
+    def set_paused(self, user_id: int, paused: bool) -> None:
+        """Pause or resume a user: paused users' products leave all matchers."""
+        if paused == (user_id in self._paused):
+            return
+        if paused:
+            self._paused.add(user_id)
+        else:
+            self._paused.discard(user_id)
+        for identifier in self._user_channels.get(user_id, ()):
+            self._sync_user_channel(user_id, self._channels[identifier])
+
+    def add_product(self, product_id: int, user_id: int, name: str, target_price: float | None,
+                    typo_tolerance: int = 0) -> ProductRecord:
+        """Add (or replace) a watched product."""
+        self.remove_product(product_id)
+        record = ProductRecord.create(
+            product_id, user_id, name, target_price, self._langs.get(user_id, DEFAULT_LANGUAGE),
+            typo_tolerance=typo_tolerance if self.fuzzy else 0,
+        )
+        self._products[product_id] = record
+        self._user_products.setdefault(user_id, set()).add(product_id)
+        if user_id not in self._paused:
+            for identifier in self._user_channels.get(user_id, ()):
+                self._channels[identifier].add(record)
+        return record
+
+    def remove_product(self, product_id: int) -> None:
+        """Remove a watched product. Unknown ids are ignored."""
+        record = self._products.pop(product_id, None)
+        if record is None:
+            return
+        self._user_products.get(record.user_id, set()).discard(product_id)
+        for identifier in self._user_channels.get(record.user_id, ()):
+            self._channels[identifier].remove(product_id)
+
+    def subscribe(self, user_id: int, identifier: str) -> None:
+        """Link a user to a channel."""
+        entry = self._channels.get(identifier)
+        if entry is None:
+            entry = self._channels[identifier] = _ChannelEntry(identifier, self.workers)
+        if user_id in entry.users:
+            return
+        entry.users.add(user_id)
+        self._user_channels.setdefault(user_id, set()).add(identifier)
+        self._sync_user_channel(user_id, entry)
+
+    def unsubscribe(self, user_id: int, identifier: str) -> None:
+        """Unlink a user from a channel."""
+        entry = self._channels.get(identifier)
+        if entry is None or user_id not in entry.users:
+            return
+        entry.users.discard(user_id)
+        self._user_channels.get(user_id, set()).discard(identifier)
+        self._sync_user_channel(user_id, entry)
+
+    def _sync_user_channel(self, user_id: int, entry: _ChannelEntry) -> None:
+        active = user_id in entry.users and user_id not in self._paused
+        for product_id in self._user_products.get(user_id, ()):
+            if active:
+                entry.add(self._products[product_id])
+            else:
+                entry.remove(product_id)
+
+    # --- Reads (hot path) ---
+
+    async def match_message(self, username: str | None, channel_id: int | None,
+                            message: PreparedMessage) -> list[ProductRecord]:
+        """Return the active products whose name occurs in a channel message.
+
+        The channel is looked up both by username and by numeric id, as either
+        may have been used as its identifier when it was added. Each channel
+        entry whose prefilter rules the message out is skipped, and counted
+        under its own reason; a message skipped by every entry is neither
+        normalized nor scanned. The names of the products found are stored in
+        message.mentioned, so multi-product posts are priced per product.
+        """
+        entries = self._entries(username, channel_id)
+        if not entries:
+            return []
+        passed = []
+        for entry in entries:
+            self.prefilter_stats["checked"] += 1
+            reason = entry.prefilter.check(message)
+            if reason is None:
+                passed.append(entry)
+            else:
+                self.prefilter_stats[reason] += 1
+                PREFILTER_SKIPPED.inc(reason=reason)
+        if not passed:
+            return []
+        patterns = None
+        if self.workers is not None:
+            patterns = await self.workers.find_patterns(message.norm)
+        records = self._collect(passed, message.norm, patterns, message)
+        message.mentioned = {record.name_norm for record in records}
+        return records
+
+    def channel_products(self, username: str | None, channel_id: int | None) -> dict[int, ProductRecord]:
+        """The active products indexed for a channel, by id (not to be modified)."""
+        entries = self._entries(username, channel_id)
+        if len(entries) == 1:
+            return entries[0].records
+        products = {}
+        for entry in entries:
+            products.update(entry.records)
+        return products
+
+    def _entries(self, username: str | None, channel_id: int | None) -> list[_ChannelEntry]:
+        entries = []
+        for key in (username, str(channel_id) if channel_id else None):
+            entry = self._channels.get(key) if key else None
+            if entry is not None and len(entry.matcher):
+                entries.append(entry)
+        return entries
+
+    def _collect(self, entries: list[_ChannelEntry], text_norm: str,
+                 patterns: set[str] | None = None, message: PreparedMessage | None = None) -> list[ProductRecord]:
+        """Match the entries' products; patterns are the names already found by the workers."""
+        matched = set()
+        text_grams = None
+        for entry in entries:
+            if patterns is None:
+                matched |= entry.matcher.find(text_norm)
+            else:
+                matched |= entry.matcher.keys_for(patterns)
+            if len(entry.fuzzy):
+                if text_grams is None:
+                    text_grams = message.grams if message is not None else trigrams(text_norm)
+                matched |= entry.fuzzy.find(text_norm, text_grams)
+        return [self._products[pid] for pid in sorted(matched)]
+
+    def dedupe_enabled(self, user_id: int) -> bool:
+        """Whether duplicate deals should be skipped for this user."""
+        return user_id not in self._dedupe_off
+
+    def products_for_user(self, user_id: int) -> list[ProductRecord]:
+        """Return all products watched by a user."""
+        return [self._products[pid] for pid in sorted(self._user_products.get(user_id, ()))]
@@ -0,0 +1,49 @@
+"""
+Timestamps as integer epoch milliseconds (UTC); timezones only when rendering.
+"""
+
+from datetime import datetime, timezone, tzinfo
+
+DAY_MS = 86_400_000
+
+
+def now_ms() -> int:
+    """Current time in epoch milliseconds."""
+    return to_ms(datetime.now(timezone.utc))
+
+
+def to_ms(dt: datetime) -> int:
+    """Epoch milliseconds of a datetime (naive values are taken as UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def iso_to_ms(value) -> int:
+    """Epoch milliseconds of an ISO 8601 string, as stored before the epoch columns.
+
+    Integers (already converted rows) are returned unchanged; unparsable
+    values map to 0 so a bad row can't block the migration.
+    """
+    if isinstance(value, int):
+        return value
+    try:
+        return to_ms(datetime.fromisoformat(str(value)))
+    except ValueError:
+        return 0
+
+
+def start_of_day_ms(tz: tzinfo, now: datetime | None = None) -> int:
+    """Epoch milliseconds of the last local midnight in tz."""
+    now = now.astimezone(tz) if now is not None else datetime.now(tz)
+    return to_ms(now.replace(hour=0, minute=0, second=0, microsecond=0))
+
+
+def utc_day_ms(ms: int) -> int:
+    """Epoch milliseconds of the UTC midnight starting the day that contains ms."""
+    return ms - ms % DAY_MS
+
+
+def format_ms(ms: int, tz: tzinfo, fmt: str = "%Y-%m-%d %H:%M") -> str:
+    """Render epoch milliseconds as local time in tz."""
+    return datetime.fromtimestamp(ms / 1000, tz).strftime(fmt)
@@ -48,15 +48,28 @@ MESSAGES = {
         "unwatch_prompt": "Which product do you want to remove? Enter the number:\n{products}\n\n/cancel to abort",
         "unwatched": "Removed: '{product}'",
 
+        # /tolerance
+        "tolerance_disabled": "Typo-tolerant matching is not enabled on this bot.",
+        "tolerance_prompt": "Which product should tolerate typos? Enter the number:\n{products}\n\n/cancel to abort",
+        "tolerance_ask_value": "How many typos should '{product}' tolerate? Enter 0, 1 or 2 (0 = exact match).",
+        "tolerance_invalid": "Invalid value. Try again with /tolerance.",
+        "tolerance_set": "'{product}' now matches with up to {count} typos.",
+        "tolerance_clamped": "Note: the name is short, so at most {count} typos are used.",
+
         # /history
         "history_prompt": "Which product do you want to see history for?\n{products}\n\n/cancel to abort",
         "history_empty": "No matches found for '{product}'.",
         "history_header": "History for '{product}' (last {count} matches):",
+        "history_day": "  {date} | {price} | {channels} | {count} matches",
 
         # /pause & /resume
         "paused": "Notifications paused. Use /resume to reactivate.",
         "resumed": "Notifications reactivated!",
 
+        # /duplicates
+        "duplicates_on": "Duplicate deals are now skipped: you get one notification per deal, even if it is forwarded to several channels. Send /duplicates again to change.",
+        "duplicates_off": "You will now be notified of every copy of a deal. Send /duplicates again to change.",
+
         # /stats
         "stats_header": "Your stats:",
         "stats_products": "  Monitored products: {count}",
@@ -66,6 +79,11 @@ MESSAGES = {
         "stats_top_channel": "  Top channel: {name} ({count} matches)",
         "stats_last_match": "  Last match: {date}",
 
+        # /export
+        "export_usage": "Usage: /export [csv|jsonl] (CSV by default).",
+        "export_empty": "No price history to export yet.",
+        "export_caption": "Your price history: {count} matches.",
+
         # /list_categories
         "categories_header": "Products by category:",
         "uncategorized": "Uncategorized",
@@ -135,15 +153,28 @@ MESSAGES = {
         "unwatch_prompt": "Quale prodotto vuoi rimuovere? Inserisci il numero:\n{products}\n\n/annulla per annullare",
         "unwatched": "Rimosso: '{product}'",
 
+        # /tolerance
+        "tolerance_disabled": "La ricerca tollerante agli errori di battitura non \u00e8 attiva su questo bot.",
+        "tolerance_prompt": "Quale prodotto deve tollerare errori di battitura? Inserisci il numero:\n{products}\n\n/annulla per annullare",
+        "tolerance_ask_value": "Quanti errori di battitura tollerare per '{product}'? Inserisci 0, 1 o 2 (0 = corrispondenza esatta).",
+        "tolerance_invalid": "Valore non valido. Riprova con /tolerance.",
+        "tolerance_set": "'{product}' ora trova corrispondenze con al massimo {count} errori di battitura.",
+        "tolerance_clamped": "Nota: il nome \u00e8 corto, verranno usati al massimo {count} errori.",
+
         # /history
         "history_prompt": "Di quale prodotto vuoi vedere lo storico?\n{products}\n\n/annulla per annullare",
         "history_empty": "Nessuna corrispondenza trovata per '{product}'.",
         "history_header": "Storico per '{product}' (ultime {count} corrispondenze):",
+        "history_day": "  {date} | {price} | {channels} | {count} corrispondenze",
 
         # /pause & /resume
         "paused": "Notifiche in pausa. Usa /resume per riattivare.",
         "resumed": "Notifiche riattivate!",
 
+        # /duplicates
+        "duplicates_on": "Le offerte duplicate ora vengono ignorate: ricevi una sola notifica per offerta, anche se inoltrata in pi\u00f9 canali. Invia di nuovo /duplicates per cambiare.",
+        "duplicates_off": "Ora riceverai una notifica per ogni copia di un'offerta. Invia di nuovo /duplicates per cambiare.",
+
         # /stats
         "stats_header": "Le tue statistiche:",
         "stats_products": "  Prodotti monitorati: {count}",
@@ -153,6 +184,11 @@ MESSAGES = {
         "stats_top_channel": "  Canale top: {name} ({count} corrispondenze)",
         "stats_last_match": "  Ultima corrispondenza: {date}",
 
+        # /export
+        "export_usage": "Uso: /export [csv|jsonl] (CSV predefinito).",
+        "export_empty": "Non c'\u00e8 ancora uno storico prezzi da esportare.",
+        "export_caption": "Il tuo storico prezzi: {count} corrispondenze.",
+
         # /list_categories
         "categories_header": "Prodotti per categoria:",
         "uncategorized": "Senza categoria",
@@ -0,0 +1,223 @@
+"""
+Per-user /stats counters (UserStats), kept current in the transactions that change what they count.
+
+Every function takes a sync Session or Connection: async callers go through
+AsyncSession.run_sync, migrations and scripts pass their connection.
+"""
+
+from collections import Counter
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+
+from models import ChannelMatchCount, ChannelMessage, PriceHistory, PriceRollup, Product, User, UserChannel, UserStats
+
+_products = Product.__table__
+_channels = ChannelMatchCount.__table__
+_stats = UserStats.__table__
+
+
+def _top(counts: dict):
+    """(key, count) with the highest count; ties go to the lowest key."""
+    if not counts:
+        return None, 0
+    best = min(counts, key=lambda k: (-counts[k], k))
+    return best, counts[best]
+
+
+def _leader(key, count: int, candidates: dict):
+    """The leader after the candidates' counts grew: the current one keeps ties."""
+    if key in candidates:
+        count = candidates.pop(key)
+    for candidate, n in candidates.items():
+        if n > count:
+            key, count = candidate, n
+    return key, count
+
+
+def rebuild_stats(conn, user_ids=None) -> int:
+    """Recompute the counters of user_ids (every user if None) from PriceHistory and PriceRollup.
+
+    Rows of products that no longer exist are not counted. Returns the
+    number of users rebuilt.
+    """
+    def scoped(query, column):
+        return query if user_ids is None else query.where(column.in_(list(user_ids)))
+
+    users = conn.execute(scoped(select(User.user_id), User.user_id)).scalars().all()
+    if not users:
+        return 0
+    owners = dict(conn.execute(scoped(select(Product.id, Product.user_id), Product.user_id)).all())
+    channel_counts = dict(conn.execute(scoped(
+        select(UserChannel.user_id, func.count()).group_by(UserChannel.user_id), UserChannel.user_id,
+    )).all())
+
+    by_product: Counter = Counter()
+    by_channel: dict[int, Counter] = {}
+    last: dict[int, int] = {}
+    raw = scoped(
+        select(PriceHistory.product_id, ChannelMessage.channel, func.count(), func.max(PriceHistory.found_at))
+        .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+        .group_by(PriceHistory.product_id, ChannelMessage.channel),
+        PriceHistory.user_id,
+    )
+    rolled = scoped(
+        select(PriceRollup.product_id, PriceRollup.channel, func.sum(PriceRollup.match_count), func.max(PriceRollup.day))
+        .group_by(PriceRollup.product_id, PriceRollup.channel),
+        PriceRollup.user_id,
+    )
+    for query in (raw, rolled):
+        for product_id, channel, n, latest in conn.execute(query).all():
+            user_id = owners.get(product_id)
+            if user_id is None:
+                continue
+            by_product[product_id] += n
+            by_channel.setdefault(user_id, Counter())[channel] += n
+            last[user_id] = max(last.get(user_id, latest), latest)
+
+    conn.execute(scoped(update(_products).values(match_count=0), _products.c.user_id))
+    if by_product:
+        conn.execute(
+            update(_products).where(_products.c.id == bindparam("b_id")).values(match_count=bindparam("b_n")),
+            [{"b_id": product_id, "b_n": n} for product_id, n in by_product.items()],
+        )
+    conn.execute(scoped(delete(_channels), _channels.c.user_id))
+    channel_rows = [
+        {"user_id": user_id, "channel": channel, "match_count": n}
+        for user_id, counts in by_channel.items() for channel, n in counts.items()
+    ]
+    if channel_rows:
+        conn.execute(insert(_channels), channel_rows)
+
+    product_counts = Counter(owners.values())
+    user_products: dict[int, dict] = {}
+    for product_id, n in by_product.items():
+        user_products.setdefault(owners[product_id], {})[product_id] = n
+    stats_rows = []
+    for user_id in users:
+        top_product, top_product_count = _top(user_products.get(user_id, {}))
+        top_channel, top_channel_count = _top(by_channel.get(user_id, {}))
+        stats_rows.append({
+            "user_id": user_id,
+            "product_count": product_counts[user_id],
+            "channel_count": channel_counts.get(user_id, 0),
+            "match_count": sum(by_channel.get(user_id, {}).values()),
+            "top_product_id": top_product,
+            "top_product_count": top_product_count,
+            "top_channel": top_channel,
+            "top_channel_count": top_channel_count,
+            "last_match_at": last.get(user_id),
+        })
+    conn.execute(scoped(delete(_stats), _stats.c.user_id))
+    conn.execute(insert(_stats), stats_rows)
+    return len(users)
+
+
+def add_counts(conn, user_id: int, products: int = 0, channels: int = 0) -> None:
+    """Adjust a user's product/channel counts after adding or removing one."""
+    conn.execute(
+        update(_stats).where(_stats.c.user_id == user_id).values(
+            product_count=_stats.c.product_count + products,
+            channel_count=_stats.c.channel_count + channels,
+        )
+    )
+
+
+def record_matches(conn, rows: list[dict]) -> None:
+    """Count a batch of new PriceHistory rows (with their channel) into the users' counters.
+
+    Users without a UserStats row yet are rebuilt instead, from a history
+    that already includes the batch.
+    """
+    users = {row["user_id"] for row in rows}
+    stats = {
+        row.user_id: row
+        for row in conn.execute(select(_stats).where(_stats.c.user_id.in_(users)).with_for_update()).all()
+    }
+    missing = users - stats.keys()
+    if missing:
+        rebuild_stats(conn, missing)
+    rows = [row for row in rows if row["user_id"] in stats]
+    if not rows:
+        return
+
+    by_product = Counter(row["product_id"] for row in rows)
+    product_counts = {
+        product_id: n + by_product[product_id]
+        for product_id, n in conn.execute(
+            select(_products.c.id, _products.c.match_count).where(_products.c.id.in_(by_product))
+        ).all()
+    }
+    # Like rebuild_stats, skip the rows of deleted products (written with foreign keys off)
+    rows = [row for row in rows if row["product_id"] in product_counts]
+    if not rows:
+        return
+    by_channel = Counter((row["user_id"], row["channel"]) for row in rows)
+    existing = {
+        (user_id, channel): n
+        for user_id, channel, n in conn.execute(
+            select(_channels.c.user_id, _channels.c.channel, _channels.c.match_count).where(
+                _channels.c.user_id.in_({user_id for user_id, _ in by_channel}),
+                _channels.c.channel.in_({channel for _, channel in by_channel}),
+            )
+        ).all()
+        if (user_id, channel) in by_channel
+    }
+    channel_counts = {key: existing.get(key, 0) + n for key, n in by_channel.items()}
+
+    conn.execute(
+        update(_products).where(_products.c.id == bindparam("b_id"))
+        .values(match_count=_products.c.match_count + bindparam("b_n")),
+        [{"b_id": product_id, "b_n": by_product[product_id]} for product_id in product_counts],
+    )
+    if existing:
+        conn.execute(
+            update(_channels)
+            .where(_channels.c.user_id == bindparam("b_user"), _channels.c.channel == bindparam("b_channel"))
+            .values(match_count=_channels.c.match_count + bindparam("b_n")),
+            [{"b_user": user_id, "b_channel": channel, "b_n": by_channel[user_id, channel]}
+             for user_id, channel in existing],
+        )
+    new = [
+        {"user_id": user_id, "channel": channel, "match_count": n}
+        for (user_id, channel), n in by_channel.items() if (user_id, channel) not in existing
+    ]
+    if new:
+        conn.execute(insert(_channels), new)
+
+    # Only the counters just incremented can overtake the current leaders
+    by_user: dict[int, list[dict]] = {}
+    for row in rows:
+        by_user.setdefault(row["user_id"], []).append(row)
+    updates = []
+    for user_id, user_rows in by_user.items():
+        current = stats[user_id]
+        products = {row["product_id"] for row in user_rows}
+        channels = {row["channel"] for row in user_rows}
+        top_product, top_product_count = _leader(
+            current.top_product_id, current.top_product_count, {p: product_counts[p] for p in products},
+        )
+        top_channel, top_channel_count = _leader(
+            current.top_channel, current.top_channel_count, {c: channel_counts[user_id, c] for c in channels},
+        )
+        latest = max(row["found_at"] for row in user_rows)
+        updates.append({
+            "b_user": user_id,
+            "b_n": len(user_rows),
+            "b_last": max(current.last_match_at or latest, latest),
+            "b_top_product": top_product,
+            "b_top_product_count": top_product_count,
+            "b_top_channel": top_channel,
+            "b_top_channel_count": top_channel_count,
+        })
+    conn.execute(
+        update(_stats).where(_stats.c.user_id == bindparam("b_user")).values(
+            match_count=_stats.c.match_count + bindparam("b_n"),
+            last_match_at=bindparam("b_last"),
+            top_product_id=bindparam("b_top_product"),
+            top_product_count=bindparam("b_top_product_count"),
+            top_channel=bindparam("b_top_channel"),
+            top_channel_count=bindparam("b_top_channel_count"),
+        ),
+        updates,
+    )
+
@@ -0,0 +1,107 @@
+"""
+Tests for the channel metadata cache.
+"""
+
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from channel_cache import ChannelCache, message_link_prefix
+from models import Channel
+
+
+class FakeEvent:
+    """Channel message event; counts get_chat() calls."""
+
+    calls = 0
+
+    def __init__(self, chat_id, title="Offerte Tech", username="offerte"):
+        self.chat_id = -1000000000000 - chat_id
+        self._chat = SimpleNamespace(id=chat_id, title=title, username=username)
+
+    async def get_chat(self):
+        FakeEvent.calls += 1
+        return self._chat
+
+
+def _clock():
+    now = [0.0]
+    return now, lambda: now[0]
+
+
+def test_message_link_prefix():
+    assert message_link_prefix("offerte", 123) == "https://t.me/offerte/"
+    assert message_link_prefix(None, 123) == "https://t.me/c/123/"
+    assert message_link_prefix(None, -100123) == "https://t.me/c/123/"
+    assert message_link_prefix(None, None) is None
+
+
+async def test_get_chat_only_on_miss():
+    FakeEvent.calls = 0
+    cache = ChannelCache()
+    info = await cache.get(FakeEvent(123))
+    again = await cache.get(FakeEvent(123))
+    assert again is info
+    assert FakeEvent.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert info.name == "Offerte Tech"
+    assert info.link(42) == "https://t.me/offerte/42"
+
+
+async def test_private_channel_link():
+    info = await ChannelCache().get(FakeEvent(123, username=None))
+    assert info.link(7) == "https://t.me/c/123/7"
+
+
+async def test_entries_expire():
+    now, clock = _clock()
+    FakeEvent.calls = 0
+    cache = ChannelCache(ttl=60, clock=clock)
+    await cache.get(FakeEvent(123))
+    now[0] = 59
+    await cache.get(FakeEvent(123))
+    assert FakeEvent.calls == 1
+    now[0] = 61
+    info = await cache.get(FakeEvent(123, title="Offerte Tech 2"))
+    assert FakeEvent.calls == 2
+    assert info.title == "Offerte Tech 2"
+
+
+async def test_lru_eviction():
+    cache = ChannelCache(max_size=2)
+    await cache.get(FakeEvent(1))
+    await cache.get(FakeEvent(2))
+    await cache.get(FakeEvent(1))  # 2 is now the least recently used
+    await cache.get(FakeEvent(3))
+    assert len(cache) == 2
+    FakeEvent.calls = 0
+    await cache.get(FakeEvent(1))
+    assert FakeEvent.calls == 0
+    await cache.get(FakeEvent(2))
+    assert FakeEvent.calls == 1
+
+
+async def test_persisted_and_reloaded(async_session_factory):
+    async with async_session_factory() as session:
+        session.add_all([Channel(identifier="offerte"), Channel(identifier="123456")])
+        await session.commit()
+
+    cache = ChannelCache(async_session_factory)
+    await cache.get(FakeEvent(111, title="Offerte Tech", username="offerte"))
+    await cache.get(FakeEvent(123456, title="Private Deals", username=None))
+
+    async with async_session_factory() as session:
+        rows = (await session.execute(
+            select(Channel.identifier, Channel.title, Channel.chat_id).order_by(Channel.identifier)
+        )).all()
+    assert rows == [("123456", "Private Deals", 123456), ("offerte", "Offerte Tech", 111)]
+
+    FakeEvent.calls = 0
+    warm = ChannelCache(async_session_factory)
+    await warm.load()
+    assert len(warm) == 2
+    info = await warm.get(FakeEvent(123456))
+    assert FakeEvent.calls == 0
+    assert info.title == "Private Deals"
+    assert info.link(5) == "https://t.me/c/123456/5"
+    assert (await warm.get(FakeEvent(111))).username == "offerte"
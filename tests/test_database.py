@@ -0,0 +1,353 @@
+"""
+Tests for the database layer.
+"""
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, text
+
+import database
+from bot_commands import _history_query
+from client_commands import ClientCommands
+from database import (
+    SCHEMA_VERSION, Base, apply_sqlite_pragmas, async_url, engine_options, run_migrations, sqlite_pragmas, sync_url,
+)
+from models import User, Channel, PriceHistory, Product, UserChannel
+from scheduler import _summary_query
+
+
+def test_async_url_sqlite():
+    assert async_url("sqlite:////app/data/db.sqlite3") == "sqlite+aiosqlite:////app/data/db.sqlite3"
+    assert async_url("sqlite:///:memory:") == "sqlite+aiosqlite:///:memory:"
+
+
+def test_async_url_keeps_explicit_driver():
+    assert async_url("sqlite+aiosqlite:///db.sqlite3") == "sqlite+aiosqlite:///db.sqlite3"
+
+
+def test_postgres_urls_pick_drivers():
+    for url in ("postgresql://u:p@db/tfp", "postgres://u:p@db/tfp", "postgresql+psycopg://u:p@db/tfp"):
+        assert async_url(url) == "postgresql+asyncpg://u:p@db/tfp"
+    assert sync_url("postgres://u:p@db/tfp") == "postgresql+psycopg://u:p@db/tfp"
+    assert sync_url("postgresql+psycopg2://u:p@db/tfp") == "postgresql+psycopg2://u:p@db/tfp"
+    assert sync_url("sqlite:///db.sqlite3") == "sqlite:///db.sqlite3"
+
+
+def test_engine_options():
+    pg = engine_options("postgresql://u:p@db/tfp", pool_size=2)
+    assert pg["pool_size"] == 2 and pg["pool_pre_ping"]
+    assert {"max_overflow", "pool_timeout", "pool_recycle"} <= pg.keys()
+    sqlite = engine_options("sqlite:///db.sqlite3")
+    assert sqlite["connect_args"] == {"check_same_thread": False}
+    assert "pool_size" not in sqlite
+
+
+async def test_list_channels_async_session(async_session_factory):
+    async with async_session_factory() as session:
+        session.add_all([
+            User(id=1, user_id=100, username="pippo"),
+            Channel(id=1, identifier="offerte", title="Offerte Tech"),
+            Channel(id=2, identifier="sconti"),
+        ])
+        await session.flush()
+        session.add_all([
+            UserChannel(user_id=100, channel_id=1),
+            UserChannel(user_id=100, channel_id=2),
+        ])
+        await session.commit()
+
+    commands = ClientCommands(None, async_session_factory)
+    assert await commands.list_channels(100) == ["Offerte Tech (offerte)", "sconti"]
+    assert await commands.list_channels(200) == []
+
+
+# --- SQLite tuning profile ---
+
+def test_pragmas_applied_on_connect(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    apply_sqlite_pragmas(engine, [
+        ("journal_mode", "WAL"), ("synchronous", "NORMAL"), ("busy_timeout", "1234"), ("foreign_keys", "ON"),
+    ])
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 1234
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+    engine.dispose()
+
+
+def test_empty_pragma_values_are_skipped(monkeypatch):
+    monkeypatch.setattr(database.config, "SQLITE_MMAP_SIZE", "")
+    monkeypatch.setattr(database.config, "SQLITE_FOREIGN_KEYS", False)
+    pragmas = dict(sqlite_pragmas())
+    assert "mmap_size" not in pragmas
+    assert pragmas["foreign_keys"] == "OFF"
+    assert pragmas["journal_mode"]
+
+
+# --- Migrations ---
+
+_LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, user_id INTEGER UNIQUE NOT NULL, username VARCHAR, "
+    "added_at VARCHAR NOT NULL)",
+    "CREATE TABLE channels (id INTEGER PRIMARY KEY, identifier VARCHAR UNIQUE NOT NULL, added_at VARCHAR NOT NULL)",
+    "CREATE TABLE user_channels (user_id INTEGER, channel_id INTEGER, PRIMARY KEY (user_id, channel_id))",
+    "CREATE TABLE products (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, name VARCHAR NOT NULL, "
+    "target_price FLOAT, added_at VARCHAR NOT NULL)",
+    "CREATE TABLE price_history (id INTEGER PRIMARY KEY, product_id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+    "price FLOAT, channel VARCHAR NOT NULL, message_text VARCHAR NOT NULL, message_link VARCHAR, "
+    "source VARCHAR NOT NULL, found_at VARCHAR NOT NULL)",
+    "CREATE INDEX ix_price_history_user_id ON price_history (user_id)",
+    "CREATE INDEX ix_price_history_product_id ON price_history (product_id)",
+]
+
+
+def _indexes(engine, table):
+    return {ix["name"] for ix in inspect(engine).get_indexes(table)}
+
+
+def test_migrations_upgrade_legacy_database():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+    Base.metadata.create_all(bind=engine)
+
+    assert run_migrations(engine) == SCHEMA_VERSION
+    columns = {c["name"] for c in inspect(engine).get_columns("users")}
+    assert {"paused", "lang_code", "dedupe_deals"} <= columns
+    assert "chat_id" in {c["name"] for c in inspect(engine).get_columns("channels")}
+    assert _indexes(engine, "price_history") == {
+        "ix_price_history_user_found", "ix_price_history_product_found", "ix_price_history_found_at",
+        "ix_price_history_channel_message",
+    }
+    assert "ix_user_channels_channel_user" in _indexes(engine, "user_channels")
+
+
+def test_migration_converts_iso_timestamps():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, user_id, username, added_at) "
+                          "VALUES (1, 100, 'pippo', '2024-01-01T00:00:00+00:00')"))
+        conn.execute(text("INSERT INTO products (id, user_id, name, target_price, added_at) "
+                          "VALUES (1, 100, 'iphone', 800, '2024-01-01T00:00:00')"))
+        for i, found_at in enumerate(["2024-03-01T12:00:00+00:00", "2024-03-01T14:00:00+02:00", "garbage"]):
+            conn.execute(text(
+                "INSERT INTO price_history (id, product_id, user_id, price, channel, message_text, source, found_at) "
+                "VALUES (:id, 1, 100, 700, 'offerte', 'deal', 'realtime', :found_at)"
+            ), {"id": i + 1, "found_at": found_at})
+    Base.metadata.create_all(bind=engine)
+    database._COPY_CHUNK, chunk = 2, database._COPY_CHUNK
+    try:
+        run_migrations(engine)
+    finally:
+        database._COPY_CHUNK = chunk
+
+    with engine.connect() as conn:
+        found = conn.execute(text("SELECT id, found_at, typeof(found_at) FROM price_history ORDER BY id")).all()
+        assert found == [(1, 1709294400000, "integer"), (2, 1709294400000, "integer"), (3, 0, "integer")]
+        assert conn.execute(text("SELECT added_at FROM users")).scalar() == 1704067200000
+        assert conn.execute(text("SELECT added_at FROM products")).scalar() == 1704067200000
+    assert "ix_price_history_found_at" in _indexes(engine, "price_history")
+    assert "ix_price_history_user_found" in _indexes(engine, "price_history")
+
+
+def test_table_rebuild_keeps_children_with_foreign_keys_on():
+    """Dropping the old table during a rebuild must not cascade to child rows."""
+    engine = create_engine("sqlite:///:memory:")
+    apply_sqlite_pragmas(engine, [("foreign_keys", "ON")])
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA[:4]:
+            conn.execute(text(ddl))
+        conn.execute(text(
+            "CREATE TABLE price_history (id INTEGER PRIMARY KEY, "
+            "product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE CASCADE, user_id INTEGER NOT NULL, "
+            "price FLOAT, channel VARCHAR NOT NULL, message_text VARCHAR NOT NULL, message_link VARCHAR, "
+            "source VARCHAR NOT NULL, found_at VARCHAR NOT NULL)"
+        ))
+        conn.execute(text("INSERT INTO users (id, user_id, added_at) VALUES (1, 100, '2024-01-01T00:00:00')"))
+        conn.execute(text("INSERT INTO products (id, user_id, name, added_at) VALUES (1, 100, 'iphone', '2024-01-01')"))
+        conn.execute(text("INSERT INTO price_history (product_id, user_id, channel, message_text, source, found_at) "
+                          "VALUES (1, 100, 'offerte', 'deal', 'realtime', '2024-01-01T00:00:00')"))
+    Base.metadata.create_all(bind=engine)
+
+    run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM price_history").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+
+
+def test_migration_deletes_orphaned_rows():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, user_id, added_at) VALUES (1, 100, '2024-01-01')"))
+        conn.execute(text("INSERT INTO channels (id, identifier, added_at) VALUES (1, 'offerte', '2024-01-01')"))
+        conn.execute(text("INSERT INTO user_channels VALUES (100, 1), (100, 2), (200, 1)"))
+        conn.execute(text("INSERT INTO products (id, user_id, name, added_at) "
+                          "VALUES (1, 100, 'iphone', '2024-01-01'), (2, 200, 'ipad', '2024-01-01')"))
+        conn.execute(text("INSERT INTO price_history (product_id, user_id, channel, message_text, source, found_at) "
+                          "VALUES (1, 100, 'c', 'm', 'realtime', '2024-01-01'), (2, 200, 'c', 'm', 'realtime', '2024-01-01'),"
+                          " (3, 100, 'c', 'm', 'realtime', '2024-01-01')"))
+    Base.metadata.create_all(bind=engine)
+
+    run_migrations(engine)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT user_id, channel_id FROM user_channels").all() == [(100, 1)]
+        assert conn.exec_driver_sql("SELECT id FROM products").all() == [(1,)]
+        assert conn.exec_driver_sql("SELECT product_id FROM price_history").all() == [(1,)]
+
+
+def test_migration_moves_posts_to_channel_messages():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, user_id, added_at) VALUES (1, 100, '2024-01-01'), (2, 200, '2024-01-01')"))
+        conn.execute(text("INSERT INTO products (id, user_id, name, added_at) "
+                          "VALUES (1, 100, 'iphone', '2024-01-01'), (2, 200, 'iphone', '2024-01-01')"))
+        rows = [
+            (1, 100, "Offerte", "iPhone 15 a 749", "https://t.me/offerte/1"),
+            (2, 200, "Offerte", "iPhone 15 a 749", "https://t.me/offerte/1"),
+            (1, 100, "Sconti", "iPhone 15 a 749", None),
+            (2, 200, "Sconti", "iPhone 15 a 749", None),
+            (1, 100, "Offerte", "iPhone 14 a 599", "https://t.me/offerte/2"),
+        ]
+        for product_id, user_id, channel, message_text, link in rows:
+            conn.execute(text(
+                "INSERT INTO price_history (product_id, user_id, channel, message_text, message_link, source, found_at) "
+                "VALUES (:p, :u, :c, :t, :l, 'realtime', '2024-01-01T00:00:00')"
+            ), {"p": product_id, "u": user_id, "c": channel, "t": message_text, "l": link})
+    Base.metadata.create_all(bind=engine)
+    database._COPY_CHUNK, chunk = 2, database._COPY_CHUNK
+    try:
+        run_migrations(engine)
+    finally:
+        database._COPY_CHUNK = chunk
+
+    columns = {c["name"] for c in inspect(engine).get_columns("price_history")}
+    assert "channel_message_id" in columns
+    assert not {"channel", "message_text", "message_link"} & columns
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT COUNT(*) FROM channel_messages").scalar() == 3
+        joined = conn.exec_driver_sql(
+            "SELECT h.id, m.channel, m.text, m.link FROM price_history h "
+            "JOIN channel_messages m ON m.id = h.channel_message_id ORDER BY h.id"
+        ).all()
+    assert [row[1:] for row in joined] == [row[2:] for row in rows]
+
+
+def test_migration_builds_user_stats():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        for ddl in _LEGACY_SCHEMA:
+            conn.execute(text(ddl))
+        conn.execute(text("INSERT INTO users (id, user_id, added_at) VALUES (1, 100, '2024-01-01'), (2, 200, '2024-01-01')"))
+        conn.execute(text("INSERT INTO products (id, user_id, name, added_at) "
+                          "VALUES (1, 100, 'iphone', '2024-01-01'), (2, 100, 'kindle', '2024-01-01')"))
+        for product_id, channel, found_at in [(1, "Offerte", "2024-01-01T10:00:00"), (1, "Sconti", "2024-01-02T10:00:00"),
+                                              (2, "Sconti", "2024-01-03T10:00:00"), (2, "Sconti", "2024-01-04T10:00:00"),
+                                              (2, "Offerte", "2024-01-05T10:00:00")]:
+            conn.execute(text(
+                "INSERT INTO price_history (product_id, user_id, channel, message_text, source, found_at) "
+                "VALUES (:p, 100, :c, 'deal', 'realtime', :f)"
+            ), {"p": product_id, "c": channel, "f": found_at})
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+    with engine.connect() as conn:
+        stats = {row.user_id: row for row in conn.exec_driver_sql("SELECT * FROM user_stats")}
+        counts = dict(conn.exec_driver_sql("SELECT id, match_count FROM products").all())
+    assert counts == {1: 2, 2: 3}
+    assert (stats[100].product_count, stats[100].match_count) == (2, 5)
+    assert (stats[100].top_product_id, stats[100].top_product_count) == (2, 3)
+    assert (stats[100].top_channel, stats[100].top_channel_count) == ("Sconti", 3)
+    assert stats[100].last_match_at == 1704448800000
+    assert (stats[200].match_count, stats[200].top_product_id, stats[200].last_match_at) == (0, None, None)
+
+
+def test_migration_widens_user_ids(db_engine, db_session_factory):
+    """Version 6 schemas have 32-bit user ids (SQLite INTEGER is 64-bit already)."""
+    if db_engine.dialect.name == "sqlite":
+        pytest.skip("SQLite INTEGER columns already store 64-bit values")
+    with db_engine.begin() as conn:
+        for name, column in reversed(database._USER_ID_COLUMNS):
+            conn.execute(text(f"ALTER TABLE {name} ALTER COLUMN {column} TYPE INTEGER"))
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (6)"))
+    assert run_migrations(db_engine) == 1
+
+    inspector = inspect(db_engine)
+    for name, column in database._USER_ID_COLUMNS:
+        assert str(next(c["type"] for c in inspector.get_columns(name) if c["name"] == column)) == "BIGINT"
+    with db_session_factory() as session:
+        session.add(User(id=1, user_id=7_000_000_000, username="pippo"))
+        session.flush()
+        session.add(Product(id=1, user_id=7_000_000_000, name="airpods"))
+        session.commit()
+        assert session.get(Product, 1).user_id == 7_000_000_000
+
+
+def test_up_to_date_database_skips_introspection(db_engine, monkeypatch):
+    assert run_migrations(db_engine) == SCHEMA_VERSION
+
+    def no_inspect(*args):
+        raise AssertionError("inspect() called on an up to date database")
+
+    monkeypatch.setattr(database, "inspect", no_inspect)
+    assert run_migrations(db_engine) == 0
+    with db_engine.connect() as conn:
+        assert database.schema_version(conn) == SCHEMA_VERSION
+
+
+# --- Query plans of the hot queries ---
+
+def _plan(engine, statement) -> str:
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return " | ".join(row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql))
+
+
+@pytest.fixture
+def migrated_engine(db_engine):
+    if db_engine.dialect.name != "sqlite":
+        pytest.skip("EXPLAIN QUERY PLAN is SQLite's")
+    run_migrations(db_engine)
+    return db_engine
+
+
+def test_plan_daily_summary(migrated_engine):
+    """Scheduler: every user's matches since the start of the day, in one query."""
+    plan = _plan(migrated_engine, _summary_query(1704067200000))
+    assert "SEARCH price_history USING INDEX ix_price_history_found_at (found_at>?)" in plan
+    assert "SCAN price_history" not in plan
+
+
+def test_plan_history(migrated_engine):
+    """/history: latest matches of a product."""
+    plan = _plan(migrated_engine, _history_query(1))
+    assert "USING INDEX ix_price_history_product_found (product_id=?)" in plan
+    assert "SEARCH channel_messages USING INTEGER PRIMARY KEY (rowid=?)" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_plan_last_match(migrated_engine):
+    """/stats: a user's last match."""
+    plan = _plan(migrated_engine, select(PriceHistory).filter_by(user_id=100)
+                 .order_by(PriceHistory.found_at.desc()).limit(1))
+    assert "USING INDEX ix_price_history_user_found (user_id=?)" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_plan_channel_subscribers(migrated_engine):
+    """Subscribers of a channel."""
+    plan = _plan(migrated_engine, select(UserChannel.user_id).where(UserChannel.channel_id == 1))
+    assert "USING COVERING INDEX ix_user_channels_channel_user (channel_id=?)" in plan
+
+
+def test_plan_found_at_range(migrated_engine):
+    """Time-window scans across all users (retention)."""
+    plan = _plan(migrated_engine, select(PriceHistory.id).where(PriceHistory.found_at < 1704067200000))
+    assert "USING COVERING INDEX ix_price_history_found_at (found_at<?)" in plan
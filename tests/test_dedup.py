@@ -0,0 +1,125 @@
+"""
+Tests for cross-channel duplicate deal detection.
+"""
+
+import dedup as dedup_module
+from dedup import DealDeduplicator, fingerprint, simhash
+from matcher import PreparedMessage, ProductRecord
+
+DEAL = (
+    "Apple iPhone 15 128GB nero a 749€ invece di 899€, spedizione gratuita con Prime. "
+    "Offerta a tempo, ultimi pezzi disponibili su Amazon https://amzn.to/abc123"
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_simhash_identical_tokens():
+    assert simhash(["a", "b", "c"]) == simhash(["a", "b", "c"])
+
+
+def test_fingerprint_ignores_case_and_spacing():
+    a = fingerprint(PreparedMessage(DEAL))
+    b = fingerprint(PreparedMessage(DEAL.upper().replace(" ", "  ")))
+    assert a == b
+
+
+def test_forwarded_copy_is_duplicate():
+    dedup = DealDeduplicator()
+    first = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    second = dedup.sighting(PreparedMessage(DEAL + " #ad"), "Sconti Pazzi")
+    assert second is first
+    assert first.count == 2
+    assert first.channels == {"Offerte Tech", "Sconti Pazzi"}
+    assert dedup.duplicates == 1
+
+
+def test_different_price_is_new_deal():
+    dedup = DealDeduplicator()
+    first = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    second = dedup.sighting(PreparedMessage(DEAL.replace("749€", "699€")), "Sconti Pazzi")
+    assert second is not first
+
+
+def test_unrelated_message_is_new_deal():
+    dedup = DealDeduplicator()
+    first = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    other = dedup.sighting(PreparedMessage(
+        "Samsung Galaxy S24 256GB a 749€ invece di 899€, solo oggi su MediaWorld con consegna rapida"
+    ), "Offerte Tech")
+    assert other is not first
+    assert len(dedup) == 2
+
+
+def test_window_expiry():
+    clock = FakeClock()
+    dedup = DealDeduplicator(window_seconds=60, clock=clock)
+    first = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    clock.now = 61
+    second = dedup.sighting(PreparedMessage(DEAL), "Sconti Pazzi")
+    assert second is not first
+    assert len(dedup) == 1
+
+
+def test_disabled():
+    dedup = DealDeduplicator(window_seconds=0)
+    assert dedup.sighting(PreparedMessage(DEAL), "Offerte Tech") is None
+
+
+def test_notified_products_tracked_per_deal():
+    dedup = DealDeduplicator()
+    deal = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    deal.notified.add(1)
+    again = dedup.sighting(PreparedMessage(DEAL), "Sconti Pazzi")
+    assert 1 in again.notified
+    assert 2 not in again.notified
+
+
+def test_repeat_settled_once_products_checked():
+    dedup = DealDeduplicator()
+    products = {1: ProductRecord.create(1, 100, "iphone 15", None), 2: ProductRecord.create(2, 200, "airpods", None)}
+    deal = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    assert not deal.settled(products, lambda user_id: True)  # first sighting: must be matched
+    deal.checked.update(products)
+
+    again = dedup.sighting(PreparedMessage(DEAL), "Sconti Pazzi")
+    assert again.settled(products, lambda user_id: True)
+    # A product not checked yet, or a user who wants every copy, still needs matching
+    assert not again.settled({**products, 3: ProductRecord.create(3, 300, "kindle", None)}, lambda user_id: True)
+    assert not again.settled(products, lambda user_id: user_id != 200)
+
+
+def test_simhash_bit_majority():
+    tokens = [f"tok{i}" for i in range(7)]
+    hashes = [dedup_module._token_hash(tok) for tok in tokens]
+    expected = sum(1 << bit for bit in range(64) if sum((h >> bit) & 1 for h in hashes) > len(hashes) / 2)
+    assert simhash(tokens) == expected
+
+
+def test_repeat_finds_exact_copies_without_fingerprint(monkeypatch):
+    dedup = DealDeduplicator()
+    assert dedup.repeat(PreparedMessage(DEAL), "Offerte Tech") is None
+    assert len(dedup) == 0  # unmatched messages are not registered
+
+    deal = dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    monkeypatch.setattr(dedup_module, "fingerprint", None)  # an exact copy must not be fingerprinted
+    message = PreparedMessage(DEAL)
+    assert dedup.repeat(message, "Sconti Pazzi") is deal
+    assert dedup.sighting(message, "Altro") is deal
+    assert message._norm is None and message._prices is None
+    assert (deal.count, dedup.duplicates) == (3, 2)
+
+
+def test_exact_copies_expire_with_their_deal():
+    clock = FakeClock()
+    dedup = DealDeduplicator(window_seconds=60, clock=clock)
+    dedup.sighting(PreparedMessage(DEAL), "Offerte Tech")
+    clock.now = 61
+    assert dedup.repeat(PreparedMessage(DEAL), "Sconti Pazzi") is None
+    assert dedup._texts == {}
@@ -0,0 +1,95 @@
+"""
+Tests for the streaming price history export.
+"""
+
+import csv
+import gzip
+import io
+import json
+from datetime import timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import export
+from export import export_history
+from models import ChannelMessage, PriceHistory, Product, User
+
+DAY = 1704067200000  # 2024-01-01 00:00 UTC
+
+
+@pytest.fixture
+async def factory(async_session_factory):
+    async with async_session_factory() as session:
+        session.add_all([User(id=1, user_id=100, username="pippo"), User(id=2, user_id=200, username="pluto")])
+        await session.flush()
+        session.add_all([Product(id=1, user_id=100, name="airpods"), Product(id=2, user_id=200, name="kindle")])
+        await session.flush()
+        for i in range(5):
+            message = ChannelMessage(channel="Offerte", text=f"AirPods, a {100 + i} €", link=f"https://t.me/o/{i}")
+            session.add(message)
+            await session.flush()
+            session.add(PriceHistory(product_id=1, user_id=100, channel_message_id=message.id,
+                                     price=100.0 + i if i else None, found_at=DAY + (4 - i) * 60_000))
+        other = ChannelMessage(channel="Sconti", text="Kindle 89€")
+        session.add(other)
+        await session.flush()
+        session.add(PriceHistory(product_id=2, user_id=200, channel_message_id=other.id, price=89.0, found_at=DAY))
+        await session.commit()
+    return async_session_factory
+
+
+def _read(file) -> str:
+    with gzip.open(file, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+async def test_export_csv(factory):
+    async with factory() as session:
+        file, rows = await export_history(session, 100, "csv", timezone.utc)
+    with file:
+        records = list(csv.reader(io.StringIO(_read(file))))
+    assert rows == 5
+    assert records[0] == list(export.COLUMNS)
+    # Oldest first
+    assert [r[0] for r in records[1:]] == [f"2024-01-01T00:0{m}:00+00:00" for m in range(5)]
+    assert records[1] == ["2024-01-01T00:00:00+00:00", "airpods", "104.0", "Offerte", "https://t.me/o/4",
+                          "realtime", "AirPods, a 104 €"]
+    assert records[-1][2] == ""  # no price
+
+
+async def test_export_jsonl_in_timezone(factory):
+    async with factory() as session:
+        file, rows = await export_history(session, 200, "jsonl", ZoneInfo("Europe/Rome"))
+    with file:
+        lines = _read(file).splitlines()
+    assert rows == 1
+    assert json.loads(lines[0]) == {
+        "found_at": "2024-01-01T01:00:00+01:00", "product": "kindle", "price": 89.0, "channel": "Sconti",
+        "link": None, "source": "realtime", "message": "Kindle 89€",
+    }
+
+
+async def test_export_streams_in_batches(factory, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_BATCH", 2)
+    monkeypatch.setattr(export, "SPOOL_MAX_BYTES", 64)
+    async with factory() as session:
+        file, rows = await export_history(session, 100, "jsonl", timezone.utc)
+    with file:
+        assert rows == 5
+        assert file._rolled  # moved to disk past SPOOL_MAX_BYTES
+        assert len(_read(file).splitlines()) == 5
+
+
+async def test_export_empty_history(factory):
+    async with factory() as session:
+        file, rows = await export_history(session, 300, "csv", timezone.utc)
+    with file:
+        assert rows == 0
+        assert _read(file).splitlines() == [",".join(export.COLUMNS)]
+
+
+async def test_unknown_format(factory):
+    async with factory() as session:
+        with pytest.raises(ValueError):
+            await export_history(session, 100, "xlsx", timezone.utc)
@@ -0,0 +1,111 @@
+"""
+Tests for typo-tolerant matching.
+"""
+
+import random
+
+from fuzzy import FuzzyMatcher, effective_tolerance, substring_distance
+from matcher import PreparedMessage, ProductRecord, check_product_match, normalize
+from subscriptions import SubscriptionIndex
+
+
+def _reference_distance(pattern, text):
+    """Plain O(m*n) approximate substring distance."""
+    prev = list(range(len(pattern) + 1))
+    best = prev[-1]
+    for ch in text:
+        cur = [0]
+        for i in range(1, len(pattern) + 1):
+            cur.append(min(prev[i - 1] + (pattern[i - 1] != ch), prev[i] + 1, cur[i - 1] + 1))
+        best = min(best, cur[-1])
+        prev = cur
+    return best
+
+
+# --- Edit distance ---
+
+def test_substring_distance_exact():
+    assert substring_distance("airpods", "nuove airpods pro", 1) == 0
+
+
+def test_substring_distance_substitution():
+    assert substring_distance("samsung s24", "offerta samsumg s24 ultra", 1) == 1
+
+
+def test_substring_distance_missing_space():
+    assert substring_distance("iphone 15 pro", "iphone15 pro a 999€", 1) == 1
+
+
+def test_substring_distance_over_limit():
+    assert substring_distance("samsung s24", "sansumg s24", 1) is None
+
+
+def test_substring_distance_matches_reference():
+    rng = random.Random(7)
+    for _ in range(3000):
+        pattern = "".join(rng.choice("abc ") for _ in range(rng.randint(0, 8)))
+        text = "".join(rng.choice("abc ") for _ in range(rng.randint(0, 20)))
+        k = rng.randint(0, 3)
+        expected = _reference_distance(pattern, text)
+        assert substring_distance(pattern, text, k) == (expected if expected <= k else None)
+
+
+def test_effective_tolerance_short_names():
+    assert effective_tolerance("ipad", 2) == 0
+    assert effective_tolerance("airpods", 2) == 1
+    assert effective_tolerance("samsung s24", 2) == 2
+    assert effective_tolerance("samsung galaxy s24", 5) == 2
+
+
+# --- Trigram index ---
+
+def test_fuzzy_matcher_finds_typo():
+    matcher = FuzzyMatcher()
+    matcher.add(1, "samsung s24", 1)
+    matcher.add(2, "iphone 15 pro", 1)
+    assert matcher.find(normalize("Samsumg S24 a 699€")) == {1}
+    assert matcher.find(normalize("iPhone15 Pro")) == {2}
+
+
+def test_fuzzy_matcher_shortlist_skips_unrelated():
+    matcher = FuzzyMatcher()
+    matcher.add(1, "samsung s24", 1)
+    assert matcher.candidates({"iph", "pho", "hon"}) == []
+
+
+def test_fuzzy_matcher_remove():
+    matcher = FuzzyMatcher()
+    matcher.add(1, "samsung s24", 1)
+    matcher.add(2, "samsung s24", 1)
+    matcher.remove(1)
+    assert matcher.find("samsumg s24") == {2}
+    matcher.remove(2)
+    assert matcher.find("samsumg s24") == set()
+    assert matcher._postings == {}
+
+
+# --- Integration with records and the subscription index ---
+
+def test_check_product_match_with_tolerance():
+    exact = ProductRecord.create(1, 100, "samsung s24", None)
+    tolerant = ProductRecord.create(2, 100, "samsung s24", None, typo_tolerance=1)
+    assert check_product_match(exact, "Samsumg S24 in offerta") is None
+    assert check_product_match(tolerant, "Samsumg S24 in offerta") is not None
+
+
+async def test_subscription_index_fuzzy_mode():
+    index = SubscriptionIndex(fuzzy=True)
+    index.add_user(100)
+    index.subscribe(100, "offerte")
+    index.add_product(1, 100, "samsung s24", None, typo_tolerance=1)
+    index.add_product(2, 100, "iphone 15", None)
+    records = await index.match_message("offerte", None, PreparedMessage("samsumg s24 e iphone 15"))
+    assert [r.id for r in records] == [1, 2]
+
+
+async def test_subscription_index_ignores_tolerance_when_disabled():
+    index = SubscriptionIndex(fuzzy=False)
+    index.add_user(100)
+    index.subscribe(100, "offerte")
+    index.add_product(1, 100, "samsung s24", None, typo_tolerance=1)
+    assert await index.match_message("offerte", None, PreparedMessage("samsumg s24")) == []
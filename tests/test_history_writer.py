@@ -0,0 +1,177 @@
+"""
+Tests for the write-behind PriceHistory writer.
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from database import Base, apply_sqlite_pragmas
+from history_writer import PriceHistoryWriter
+from models import ChannelMessage, User, Product, PriceHistory
+
+
+@pytest.fixture
+async def shared_session_factory(async_session_factory):
+    async with async_session_factory() as session:
+        session.add(User(id=1, user_id=100, username="pippo"))
+        await session.flush()
+        session.add(Product(id=1, user_id=100, name="airpods"))
+        await session.commit()
+    return async_session_factory
+
+
+def _row(i=0):
+    return dict(product_id=1, user_id=100, price=100.0 + i, source="realtime",
+                chat_id=-1001, message_id=i, channel="Ch", message_text=f"m{i}", message_link=None)
+
+
+async def _count(factory):
+    async with factory() as session:
+        return await session.scalar(select(func.count()).select_from(PriceHistory))
+
+
+async def _rows(factory):
+    async with factory() as session:
+        return (await session.execute(
+            select(PriceHistory, ChannelMessage.text.label("message_text"))
+            .join(ChannelMessage, PriceHistory.channel_message_id == ChannelMessage.id)
+            .order_by(PriceHistory.id)
+        )).all()
+
+
+async def test_flush_on_batch_size(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, batch_size=5, flush_interval=60)
+    for i in range(5):
+        writer.add(**_row(i))
+    for _ in range(50):
+        await asyncio.sleep(0.01)
+        if writer.written == 5:
+            break
+    assert await _count(shared_session_factory) == 5
+    assert writer.batches == 1
+    await writer.stop()
+
+
+async def test_flush_on_interval(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, batch_size=100, flush_interval=0.05)
+    writer.add(**_row())
+    assert writer.queue_depth == 1
+    await asyncio.sleep(0.3)
+    assert await _count(shared_session_factory) == 1
+    assert writer.queue_depth == 0
+    await writer.stop()
+
+
+async def test_stop_drains_queue(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, batch_size=10, flush_interval=60)
+    for i in range(25):
+        writer.add(**_row(i))
+    await writer.stop()
+    assert await _count(shared_session_factory) == 25
+    assert writer.metrics()["queue_depth"] == 0
+    assert writer.metrics()["batches"] == 3
+
+
+async def test_found_at_set_when_queued(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, flush_interval=60)
+    writer.add(**_row())
+    await writer.stop()
+    (row,) = await _rows(shared_session_factory)
+    assert row.PriceHistory.found_at is not None
+
+
+async def test_post_stored_once_for_all_users(shared_session_factory):
+    async with shared_session_factory() as session:
+        session.add(User(id=2, user_id=200, username="pluto"))
+        await session.flush()
+        session.add(Product(id=2, user_id=200, name="airpods pro"))
+        await session.commit()
+    writer = PriceHistoryWriter(shared_session_factory, flush_interval=60)
+    writer.add(**_row(0))
+    writer.add(**dict(_row(0), product_id=2, user_id=200))
+    await writer.flush()
+    writer.add(**dict(_row(0), product_id=2, user_id=200, source="backfill"))  # same post, later batch
+    writer.add(**_row(1))
+    await writer.stop()
+
+    rows = await _rows(shared_session_factory)
+    assert [r.message_text for r in rows] == ["m0", "m0", "m0", "m1"]
+    assert len({r.PriceHistory.channel_message_id for r in rows[:3]}) == 1
+    async with shared_session_factory() as session:
+        assert await session.scalar(select(func.count()).select_from(ChannelMessage)) == 2
+
+
+async def test_failed_batch_is_retried(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, flush_interval=60)
+    original = writer._write
+    calls = []
+
+    async def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("database is locked")
+        await original(batch)
+
+    writer._write = flaky
+    writer.add(**_row())
+    await writer.flush()
+    assert writer.failures == 1
+    assert writer.queue_depth == 1
+    await writer.flush()
+    assert writer.queue_depth == 0
+    assert await _count(shared_session_factory) == 1
+    await writer.stop()
+
+
+async def test_queue_cap_drops_oldest(shared_session_factory):
+    writer = PriceHistoryWriter(shared_session_factory, batch_size=100, flush_interval=60, max_queue=3)
+    for i in range(5):
+        writer.add(**_row(i))
+    assert writer.queue_depth == 3
+    assert writer.dropped == 2
+    await writer.stop()
+    assert [e.message_text for e in await _rows(shared_session_factory)] == ["m2", "m3", "m4"]
+
+
+@pytest.fixture
+async def fk_session_factory():
+    """Async sessions with the production SQLite pragmas (foreign keys enforced)."""
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", poolclass=StaticPool)
+    apply_sqlite_pragmas(engine.sync_engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with factory() as session:
+        session.add(User(id=1, user_id=100, username="pippo"))
+        await session.flush()
+        session.add(Product(id=1, user_id=100, name="airpods"))
+        await session.commit()
+    yield factory
+    await engine.dispose()
+
+
+async def test_rows_violating_foreign_keys_are_skipped(fk_session_factory):
+    writer = PriceHistoryWriter(fk_session_factory, flush_interval=60)
+    writer.add(**_row(0))
+    writer.add(**dict(_row(1), product_id=99))  # product deleted while the match was queued
+    writer.add(**_row(2))
+    await writer.stop()
+
+    assert [e.message_text for e in await _rows(fk_session_factory)] == ["m0", "m2"]
+    assert writer.rejected == 1
+    assert writer.written == 2
+    assert writer.queue_depth == 0
+
+
+async def test_deleting_product_cascades_to_history(fk_session_factory):
+    writer = PriceHistoryWriter(fk_session_factory, flush_interval=60)
+    writer.add(**_row())
+    await writer.stop()
+    async with fk_session_factory() as session:
+        await session.delete(await session.get(Product, 1))
+        await session.commit()
+    assert await _count(fk_session_factory) == 0
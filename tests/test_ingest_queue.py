@@ -0,0 +1,130 @@
+"""
+Tests for the bounded ingest queue and its overflow policies.
+"""
+
+import asyncio
+
+import pytest
+
+from ingest_queue import IngestQueue, IngestRecord, normalize_channel
+
+
+def _record(message_id, low_priority=False, chat_id=-1001):
+    return IngestRecord(chat_id, message_id, f"message {message_id}", None, low_priority)
+
+
+def test_unknown_policy_rejected():
+    with pytest.raises(ValueError):
+        IngestQueue(policy="drop_newest")
+
+
+def test_normalize_channel():
+    assert normalize_channel("@Offerte") == "offerte"
+    assert normalize_channel(-1001234) == "1234"
+    assert normalize_channel("1234") == "1234"
+
+
+def test_is_low_priority():
+    queue = IngestQueue(low_priority_channels=["@Spam_Deals", "1234"])
+    assert queue.is_low_priority(-1001234)
+    assert queue.is_low_priority(-1009999, "spam_deals")
+    assert not queue.is_low_priority(-1009999, "offerte")
+    assert not IngestQueue().is_low_priority(-1001234, "spam_deals")
+
+
+async def test_consumers_process_in_order():
+    seen = []
+
+    async def handler(record):
+        seen.append(record.message_id)
+
+    queue = IngestQueue(maxsize=10, consumers=1)
+    queue.start(handler)
+    for i in range(5):
+        await queue.put(_record(i))
+    await queue.join()
+    await queue.stop()
+
+    assert seen == [0, 1, 2, 3, 4]
+    assert queue.metrics()["processed"] == 5
+
+
+async def test_handler_error_does_not_stop_consumer():
+    seen = []
+
+    async def handler(record):
+        if record.message_id == 0:
+            raise RuntimeError("boom")
+        seen.append(record.message_id)
+
+    queue = IngestQueue(consumers=1)
+    queue.start(handler)
+    await queue.put(_record(0))
+    await queue.put(_record(1))
+    await queue.join()
+    await queue.stop()
+
+    assert seen == [1]
+    assert queue.failures == 1
+
+
+async def test_block_waits_for_free_slot():
+    release = asyncio.Event()
+    seen = []
+
+    async def handler(record):
+        await release.wait()
+        seen.append(record.message_id)
+
+    queue = IngestQueue(maxsize=1, consumers=1)
+    queue.start(handler)
+    await queue.put(_record(0))
+    await asyncio.sleep(0)           # consumer takes record 0 and waits
+    await queue.put(_record(1))      # fills the queue
+    blocked = asyncio.ensure_future(queue.put(_record(2)))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+    assert queue.blocked == 1
+
+    release.set()
+    await blocked
+    await queue.join()
+    await queue.stop()
+    assert seen == [0, 1, 2]
+
+
+async def test_drop_oldest():
+    queue = IngestQueue(maxsize=2, policy="drop_oldest")
+    for i in range(4):
+        assert await queue.put(_record(i))
+
+    assert [r.message_id for r in queue._queue] == [2, 3]
+    assert queue.metrics()["dropped_oldest"] == 2
+
+
+async def test_drop_low_priority_sheds_low_priority_first():
+    queue = IngestQueue(maxsize=2, policy="drop_low_priority")
+    await queue.put(_record(0, low_priority=True))
+    await queue.put(_record(1))
+
+    assert await queue.put(_record(2))                          # evicts queued record 0
+    assert not await queue.put(_record(3, low_priority=True))   # no low-priority left: dropped itself
+    assert [r.message_id for r in queue._queue] == [1, 2]
+    assert queue.metrics()["dropped_low_priority"] == 2
+
+
+async def test_drop_low_priority_blocks_for_other_channels():
+    queue = IngestQueue(maxsize=1, policy="drop_low_priority")
+    await queue.put(_record(0))
+    blocked = asyncio.ensure_future(queue.put(_record(1)))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    async def handler(record):
+        pass
+
+    queue.start(handler)
+    await blocked
+    await queue.join()
+    await queue.stop()
+    assert queue.processed == 2
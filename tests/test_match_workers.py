@@ -0,0 +1,82 @@
+"""
+Tests for process-pool matching.
+"""
+
+import pytest
+
+from match_workers import MatchWorkerPool
+from matcher import PreparedMessage
+from subscriptions import SubscriptionIndex
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = MatchWorkerPool(2)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def index(pool):
+    index = SubscriptionIndex(workers=pool)
+    for uid in (100, 200):
+        index.add_user(uid)
+        index.subscribe(uid, "offerte")
+    index.add_product(1, 100, "iphone 15", None)
+    index.add_product(2, 200, "iphone 15", None)
+    index.add_product(3, 200, "airpods", None)
+    return index
+
+
+def _ids(records):
+    return [r.id for r in records]
+
+
+async def test_match_message_uses_workers(pool, index):
+    before = pool.requests
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("nuovo iphone 15 e airpods"))) == [1, 2, 3]
+    assert pool.requests == before + 1
+    assert pool.pattern_count == 2
+
+
+async def test_shards_follow_product_changes(pool, index):
+    index.remove_product(3)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("airpods"))) == []
+    assert pool.pattern_count == 1
+
+    index.add_product(4, 100, "galaxy s24", None)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("galaxy s24 a 699"))) == [4]
+
+    # The name stays in the workers while another product still watches it
+    index.remove_product(1)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("iphone 15"))) == [2]
+
+
+async def test_channel_filter_applies(pool, index):
+    index.add_user(300)
+    index.subscribe(300, "sconti")
+    index.add_product(5, 300, "kindle", None)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("kindle"))) == []
+    assert _ids(await index.match_message("sconti", None, PreparedMessage("kindle e iphone 15"))) == [5]
+
+
+async def test_paused_user_leaves_workers(pool, index):
+    index.set_paused(200, True)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("iphone 15 airpods"))) == [1]
+    assert pool.pattern_count == 1
+
+
+async def test_dead_worker_is_respawned(pool, index):
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("airpods"))) == [3]
+    for worker in pool._workers:
+        worker.process.kill()
+        worker.process.join()
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("iphone 15 airpods"))) == [1, 2, 3]
+
+
+async def test_match_message_without_workers():
+    index = SubscriptionIndex()
+    index.add_user(100)
+    index.subscribe(100, "offerte")
+    index.add_product(1, 100, "airpods", None)
+    assert _ids(await index.match_message("offerte", None, PreparedMessage("airpods pro"))) == [1]
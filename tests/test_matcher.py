@@ -0,0 +1,95 @@
+"""
+Tests for the multi-pattern product matcher.
+"""
+
+import random
+
+from matcher import ProductMatcher, normalize
+
+
+def _matcher(**names):
+    matcher = ProductMatcher()
+    for key, name in names.items():
+        matcher.add(key, name)
+    return matcher
+
+
+def test_finds_all_products_in_one_pass():
+    matcher = _matcher(a="iphone 15", b="airpods", c="galaxy s24")
+    text = normalize("Offerte: iPhone 15 a 799€, AirPods a 129€")
+    assert matcher.find(text) == {"a", "b"}
+
+
+def test_no_match():
+    matcher = _matcher(a="iphone 15", b="airpods")
+    assert matcher.find(normalize("Samsung Galaxy S24 a 699")) == set()
+
+
+def test_identical_names_share_one_pattern():
+    matcher = ProductMatcher()
+    matcher.add(1, "iPhone 15")
+    matcher.add(2, "iphone 15")
+    matcher.add(3, "i-phone 15")
+    assert matcher.pattern_count == 1
+    assert matcher.find(normalize("nuovo iphone 15")) == {1, 2, 3}
+
+
+def test_overlapping_patterns():
+    """Patterns that are suffixes/prefixes of each other are all reported."""
+    matcher = _matcher(a="iphone", b="iphone 15 pro", c="15 pro", d="phone")
+    assert matcher.find(normalize("iPhone 15 Pro Max")) == {"a", "b", "c", "d"}
+
+
+def test_failure_links():
+    """A partial match that fails must fall back to the longest proper suffix."""
+    matcher = _matcher(a="abcd", b="bce")
+    assert matcher.find("abce") == {"b"}
+
+
+def test_incremental_add_after_lookup():
+    matcher = _matcher(a="airpods")
+    assert matcher.find("airpods e ipad") == {"a"}
+    matcher.add("b", "ipad")
+    assert matcher.find("airpods e ipad") == {"a", "b"}
+
+
+def test_remove_keeps_shared_pattern():
+    matcher = _matcher(a="airpods", b="airpods")
+    matcher.remove("a")
+    assert matcher.pattern_count == 1
+    assert matcher.find("airpods") == {"b"}
+
+
+def test_remove_last_key_drops_pattern():
+    matcher = _matcher(a="airpods", b="ipad")
+    matcher.remove("a")
+    assert matcher.pattern_count == 1
+    assert matcher.find("airpods e ipad") == {"b"}
+
+
+def test_rename_key():
+    matcher = _matcher(a="airpods")
+    matcher.add("a", "ipad")
+    assert matcher.find("airpods") == set()
+    assert matcher.find("ipad") == {"a"}
+
+
+def test_sync_applies_differences():
+    matcher = _matcher(a="airpods", b="ipad")
+    matcher.sync({"b": "ipad", "c": "kindle"})
+    assert len(matcher) == 2
+    assert matcher.find("airpods ipad kindle") == {"b", "c"}
+
+
+def test_same_result_as_substring_check():
+    """The automaton agrees with a plain `in` check on random inputs."""
+    rng = random.Random(42)
+    alphabet = "ab c"
+    names = {i: "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for i in range(40)}
+    matcher = ProductMatcher()
+    for key, name in names.items():
+        matcher.add(key, name)
+    for _ in range(200):
+        text = normalize("".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30))))
+        expected = {k for k, name in names.items() if normalize(name) in text}
+        assert matcher.find(text) == expected
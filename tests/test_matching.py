@@ -4,6 +4,7 @@ Tests for product + price matching logic.
 
 from models import User, Product
 from channel_listener import check_product_match
+from matcher import PreparedMessage, ProductRecord, normalize
 
 
 def _create_user_with_product(db_session, name, target_price=None):
@@ -93,6 +94,58 @@ def test_multiple_prices_uses_lowest(db_session):
     assert result["price_found"] == 499.0
 
 
+def test_multi_deal_post_uses_price_of_each_product(db_session):
+    """Each product is compared with its own price, not the lowest in the post."""
+    product = _create_user_with_product(db_session, "iphone", target_price=500.0)
+    message = PreparedMessage("AirPods 129€ / iPhone 899€", mentioned={"airpods", "iphone"})
+    assert check_product_match(product, message) is None
+
+
+def test_multi_deal_post_lines(db_session):
+    product = _create_user_with_product(db_session, "airpods", target_price=150.0)
+    text = "🔥 iPhone 15\nPrezzo: 749€\n\n🔥 AirPods Pro\nPrezzo: 129€"
+    result = check_product_match(product, PreparedMessage(text, mentioned={"airpods", "iphone 15"}))
+    assert result["price_found"] == 129.0
+
+
+def test_other_product_inside_the_name_is_not_another_deal():
+    message = PreparedMessage("iPhone 15 Pro, listino 1.339€, ora 1.099€", mentioned={"iphone", "iphone 15 pro"})
+    assert message.prices_for("iphone") == [1339.0, 1099.0]
+    assert message.prices_for("iphone 15 pro") == [1339.0, 1099.0]
+
+
+def test_list_and_offer_price_lines(db_session):
+    """Price label lines belong to the product above them: the lowest one counts."""
+    product = _create_user_with_product(db_session, "iphone 15", target_price=900.0)
+    result = check_product_match(product, "iPhone 15\nPrezzo consigliato: 1.099€\nPrezzo offerta: 899€")
+    assert result["price_found"] == 899.0
+
+
+def test_list_and_offer_price_clauses(db_session):
+    product = _create_user_with_product(db_session, "iphone 15", target_price=900.0)
+    result = check_product_match(product, "Offerta iPhone 15: prezzo 1.099€, scontato a 899€")
+    assert result["price_found"] == 899.0
+
+
+def test_single_product_keeps_all_prices():
+    message = PreparedMessage("Cuffie Sony WH-1000XM5, listino 279€, in offerta a 199€")
+    assert message.prices_for("sony wh1000xm5") == [279.0, 199.0]
+
+
+def test_single_product_posts_keep_the_offer_price():
+    """Without another watched product in the post, the lowest price counts whatever the labels."""
+    posts = [
+        ("samsung s24", 700.0, "Samsung S24 Ultra 256GB\nPrezzo: 1.499€\nCon coupon: 649€", 649.0),
+        ("iphone 15", 800.0, "Apple iPhone 15 (128 GB) - Nero\nPrezzo di listino 899€\nPrezzo Amazon 749€", 749.0),
+        ("kindle", 100.0, "Kindle Paperwhite\n❌ Prezzo pieno 169,99€\n✅ Prezzo scontato 99,99€", 99.99),
+        ("iphone 15", 800.0, "iPhone 15, 128GB, nero: 899€ ora 749€", 749.0),
+    ]
+    for name, target, text, price in posts:
+        product = ProductRecord.create(1, 100, name, target)
+        result = check_product_match(product, PreparedMessage(text, mentioned={product.name_norm}))
+        assert result["price_found"] == price, text
+
+
 # --- Edge cases ---
 
 def test_empty_message(db_session):
@@ -138,3 +191,55 @@ def test_fuzzy_match_underscore(db_session):
     product = _create_user_with_product(db_session, "airpods")
     result = check_product_match(product, "Air_Pods Pro 2 disponibili!")
     assert result is not None
+
+
+# --- Prepared messages and product records ---
+
+def test_normalize_matches_regex_version():
+    """The translate-based normalizer behaves like the original re.sub passes."""
+    import re
+
+    def regex_normalize(text):
+        text = text.lower()
+        text = re.sub(r"[-_]", "", text)
+        return re.sub(r"\s+", " ", text).strip()
+
+    samples = ["  i-Phone\t15\n\nPro  ", "Air_Pods  -  Pro", "", "   ", "ÀÉÎ  ñ x", "a - b _ c"]
+    for text in samples:
+        assert normalize(text) == regex_normalize(text)
+
+
+def test_mention_spans_map_back_to_original_text():
+    from matcher import _normalize_with_offsets
+
+    samples = ["  i-Phone\t15\n\nPro  ", "Air_Pods  -  Pro", "", "   ", "ÀÉÎ  ñ x", "a - b _ c"]
+    for text in samples:
+        assert _normalize_with_offsets(text)[0] == normalize(text)
+
+    message = PreparedMessage("Nuovo i-Phone  15 a 749€ e iPhone 15 Pro")
+    spans = message.mention_spans("iphone 15")
+    assert [message.text[a:b] for a, b in spans] == ["i-Phone  15", "iPhone 15"]
+
+
+def test_prepared_message_parses_prices_lazily():
+    message = PreparedMessage("iPhone 15 a 749€")
+    assert message.norm == "iphone 15 a 749€"
+    assert message._prices is None
+    assert message.prices == [749.0]
+    assert message.prices is message.prices
+
+
+def test_prepared_message_shared_across_products():
+    message = PreparedMessage("iPhone 15 a 749€, AirPods a 129€", mentioned={"airpods", "iphone 15"})
+    cheap = ProductRecord.create(1, 100, "airpods", 150.0)
+    pricey = ProductRecord.create(2, 100, "iphone 15", 100.0)
+    any_price = ProductRecord.create(3, 100, "iphone 15", None)
+    assert check_product_match(cheap, message)["price_found"] == 129.0
+    assert check_product_match(pricey, message) is None
+    assert check_product_match(any_price, message)["price_found"] is None
+
+
+def test_product_record_is_slotted():
+    record = ProductRecord.create(1, 100, "i-Phone 15", None)
+    assert record.name_norm == "iphone 15"
+    assert not hasattr(record, "__dict__")
@@ -0,0 +1,80 @@
+"""
+Tests for the metrics registry and the /metrics endpoint.
+"""
+
+import asyncio
+
+from metrics import MetricsServer, Registry
+
+
+def test_counter_render():
+    registry = Registry()
+    counter = registry.counter("tfp_test_total", "Test counter", ("path",))
+    counter.inc(path="realtime")
+    counter.inc(2, path="realtime")
+    counter.inc(path="backfill")
+
+    assert counter.value(path="realtime") == 3
+    text = registry.render()
+    assert "# TYPE tfp_test_total counter" in text
+    assert 'tfp_test_total{path="realtime"} 3' in text
+    assert 'tfp_test_total{path="backfill"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("tfp_test_seconds", "Test histogram", ("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, stage="match")
+    histogram.observe(0.5, stage="match")
+    histogram.observe(5, stage="match")
+
+    text = registry.render()
+    assert 'tfp_test_seconds_bucket{stage="match",le="0.1"} 1' in text
+    assert 'tfp_test_seconds_bucket{stage="match",le="1.0"} 2' in text
+    assert 'tfp_test_seconds_bucket{stage="match",le="+Inf"} 3' in text
+    assert 'tfp_test_seconds_sum{stage="match"} 5.55' in text
+    assert 'tfp_test_seconds_count{stage="match"} 3' in text
+
+
+def test_histogram_timer():
+    registry = Registry()
+    histogram = registry.histogram("tfp_test_seconds", "Test histogram", ("stage",))
+    with histogram.time(stage="db_write"):
+        pass
+    assert histogram.count(stage="db_write") == 1
+    assert histogram.count(stage="send") == 0
+
+
+def test_gauge_callback():
+    registry = Registry()
+    depth = [4]
+    registry.gauge("tfp_test_depth", "Test gauge", fn=lambda: depth[0])
+    assert "tfp_test_depth 4" in registry.render()
+    depth[0] = 7
+    assert "tfp_test_depth 7" in registry.render()
+
+
+async def _get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def test_server_serves_metrics():
+    registry = Registry()
+    registry.counter("tfp_test_total", "Test counter").inc()
+    server = MetricsServer(registry, port=0)
+    await server.start()
+    try:
+        response = await _get(server.port, "/metrics")
+        assert response.startswith(b"HTTP/1.1 200 OK")
+        assert b"text/plain; version=0.0.4" in response
+        assert b"tfp_test_total 1" in response
+
+        response = await _get(server.port, "/other")
+        assert response.startswith(b"HTTP/1.1 404")
+    finally:
+        await server.stop()
@@ -2,7 +2,10 @@
 Tests for database models.
 """
 
-from models import User, Channel, UserChannel, Product, PriceHistory
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from models import User, Channel, ChannelMessage, UserChannel, Product, PriceHistory
 
 
 def test_create_user(db_session):
@@ -202,13 +205,16 @@ def test_create_price_history(db_session):
     db_session.add(product)
     db_session.flush()
 
+    message = ChannelMessage(chat_id=-1001234, message_id=123, channel="OfferteTest",
+                             text="iPhone 15 a 749", link="https://t.me/test/123")
+    db_session.add(message)
+    db_session.flush()
+
     entry = PriceHistory(
         product_id=product.id,
         user_id=100,
+        channel_message_id=message.id,
         price=749.0,
-        channel="OfferteTest",
-        message_text="iPhone 15 a 749",
-        message_link="https://t.me/test/123",
         source="realtime",
     )
     db_session.add(entry)
@@ -216,10 +222,11 @@ def test_create_price_history(db_session):
 
     result = db_session.query(PriceHistory).filter_by(user_id=100).one()
     assert result.price == 749.0
-    assert result.channel == "OfferteTest"
     assert result.source == "realtime"
-    assert result.message_link == "https://t.me/test/123"
     assert result.found_at is not None
+    post = db_session.get(ChannelMessage, result.channel_message_id)
+    assert post.channel == "OfferteTest"
+    assert post.link == "https://t.me/test/123"
 
 
 def test_price_history_multiple_entries(db_session):
@@ -228,12 +235,14 @@ def test_price_history_multiple_entries(db_session):
     db_session.flush()
 
     product = Product(user_id=100, name="airpods")
-    db_session.add(product)
+    message = ChannelMessage(chat_id=-1001234, message_id=1, channel="Ch1", text="a")
+    db_session.add_all([product, message])
     db_session.flush()
 
-    db_session.add(PriceHistory(product_id=product.id, user_id=100, price=199.0, channel="Ch1", message_text="a"))
-    db_session.add(PriceHistory(product_id=product.id, user_id=100, price=179.0, channel="Ch2", message_text="b"))
-    db_session.add(PriceHistory(product_id=product.id, user_id=100, price=None, channel="Ch3", message_text="c", source="backfill"))
+    db_session.add(PriceHistory(product_id=product.id, user_id=100, channel_message_id=message.id, price=199.0))
+    db_session.add(PriceHistory(product_id=product.id, user_id=100, channel_message_id=message.id, price=179.0))
+    db_session.add(PriceHistory(product_id=product.id, user_id=100, channel_message_id=message.id, price=None,
+                                source="backfill"))
     db_session.commit()
 
     entries = db_session.query(PriceHistory).filter_by(product_id=product.id).all()
@@ -242,6 +251,13 @@ def test_price_history_multiple_entries(db_session):
     assert len(backfill) == 1
 
 
+def test_channel_message_unique_per_post(db_session):
+    db_session.add(ChannelMessage(chat_id=-1001234, message_id=1, channel="Ch1", text="a"))
+    db_session.add(ChannelMessage(chat_id=-1001234, message_id=1, channel="Ch1", text="a"))
+    with pytest.raises(IntegrityError):
+        db_session.commit()
+
+
 def test_remove_user_channel_keeps_channel(db_session):
     """Removing a user-channel link does not delete the channel itself."""
     user = User(id=1, user_id=100, username="pippo")
@@ -0,0 +1,185 @@
+"""
+Tests for the outbound notification dispatcher.
+"""
+
+import asyncio
+
+from telethon.errors import FloodWaitError, UserIsBlockedError
+
+from notifier import (
+    NotificationDispatcher,
+    TokenBucket,
+    PRIORITY_BACKFILL,
+    PRIORITY_MATCH,
+    PRIORITY_SUMMARY,
+    PRIORITY_TARGET,
+)
+
+
+class FakeBot:
+    """Records sent messages; errors[chat_id] is a list of exceptions raised on the next sends."""
+
+    def __init__(self):
+        self.sent = []
+        self.errors = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        pending = self.errors.get(chat_id)
+        if pending:
+            raise pending.pop(0)
+        self.sent.append((chat_id, text))
+
+
+def _flood(seconds):
+    error = FloodWaitError(request=None, capture=1)
+    error.seconds = seconds
+    return error
+
+
+def _dispatcher(bot, **kwargs):
+    kwargs.setdefault("global_rate", 1000)
+    kwargs.setdefault("chat_rate", 1000)
+    kwargs.setdefault("retry_delay", 0.01)
+    return NotificationDispatcher(bot, **kwargs)
+
+
+async def _run(dispatcher, timeout=2):
+    await asyncio.wait_for(dispatcher.join(), timeout)
+    await dispatcher.stop()
+
+
+# --- Token bucket ---
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=2, clock=lambda: now[0])
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == 0.5
+    now[0] = 0.5
+    assert bucket.take() == 0
+    assert bucket.wait_time() == 0.5
+
+
+# --- Dispatcher ---
+
+async def test_priority_order():
+    bot = FakeBot()
+    dispatcher = _dispatcher(bot, concurrency=1)
+    dispatcher.send(1, "summary", PRIORITY_SUMMARY)
+    dispatcher.send(1, "backfill", PRIORITY_BACKFILL)
+    dispatcher.send(1, "any price", PRIORITY_MATCH)
+    dispatcher.send(1, "target price", PRIORITY_TARGET)
+    await _run(dispatcher)
+    assert [text for _, text in bot.sent] == ["target price", "any price", "backfill", "summary"]
+
+
+async def test_per_chat_rate_limit():
+    bot = FakeBot()
+    dispatcher = _dispatcher(bot, chat_rate=20, chat_burst=1)
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    for i in range(4):
+        dispatcher.send(1, f"m{i}")
+    dispatcher.send(2, "other chat")
+    await asyncio.sleep(0.02)
+    # The other chat is not held back by chat 1's bucket
+    assert (2, "other chat") in bot.sent
+    await _run(dispatcher)
+    assert loop.time() - start >= 0.14
+    assert [text for chat, text in bot.sent if chat == 1] == ["m0", "m1", "m2", "m3"]
+
+
+async def test_flood_wait_pauses_only_that_chat():
+    bot = FakeBot()
+    bot.errors[1] = [_flood(0.3)]
+    dispatcher = _dispatcher(bot)
+    dispatcher.send(1, "flooded")
+    dispatcher.send(2, "a")
+    await asyncio.sleep(0.05)
+    dispatcher.send(2, "b")
+    await asyncio.sleep(0.05)
+    assert bot.sent == [(2, "a"), (2, "b")]
+    await _run(dispatcher)
+    assert bot.sent[-1] == (1, "flooded")
+    assert dispatcher.flood_waits == 1
+    assert dispatcher.retries == 0
+
+
+async def test_short_flood_wait_does_not_block_other_chats():
+    class SleepyBot(FakeBot):
+        """Sleeps through flood waits up to flood_sleep_threshold, like Telethon."""
+
+        flood_sleep_threshold = 60
+
+        async def send_message(self, chat_id, text, **kwargs):
+            pending = self.errors.get(chat_id)
+            if pending and pending[0].seconds <= self.flood_sleep_threshold:
+                await asyncio.sleep(pending.pop(0).seconds)
+            await super().send_message(chat_id, text, **kwargs)
+
+    bot = SleepyBot()
+    bot.errors[1] = [_flood(0.3)]
+    dispatcher = _dispatcher(bot, concurrency=1)
+    assert bot.flood_sleep_threshold == 0
+    dispatcher.send(1, "flooded")
+    dispatcher.send(2, "other chat")
+    await asyncio.sleep(0.05)
+    assert bot.sent == [(2, "other chat")]
+    await _run(dispatcher)
+    assert bot.sent[-1] == (1, "flooded")
+    assert dispatcher.flood_waits == 1
+
+
+async def test_retry_then_success():
+    bot = FakeBot()
+    bot.errors[1] = [RuntimeError("timeout"), RuntimeError("timeout")]
+    dispatcher = _dispatcher(bot)
+    dispatcher.send(1, "hello")
+    await _run(dispatcher)
+    assert bot.sent == [(1, "hello")]
+    assert dispatcher.retries == 2
+    assert not dispatcher.dead_letters
+
+
+async def test_dead_letter_after_max_retries():
+    bot = FakeBot()
+    bot.errors[1] = [RuntimeError("boom")] * 5
+    dispatcher = _dispatcher(bot, max_retries=2)
+    dispatcher.send(1, "lost")
+    dispatcher.send(2, "fine")
+    await _run(dispatcher)
+    assert bot.sent == [(2, "fine")]
+    assert len(dispatcher.dead_letters) == 1
+    assert dispatcher.dead_letters[0][:2] == (1, "lost")
+    assert dispatcher.metrics()["queue_depth"] == 0
+
+
+async def test_permanent_error_is_not_retried():
+    bot = FakeBot()
+    bot.errors[1] = [UserIsBlockedError(request=None)]
+    dispatcher = _dispatcher(bot)
+    dispatcher.send(1, "blocked")
+    await _run(dispatcher)
+    assert dispatcher.retries == 0
+    assert len(dispatcher.dead_letters) == 1
+
+
+async def test_concurrency_bound():
+    active = 0
+    peak = 0
+
+    class SlowBot:
+        async def send_message(self, chat_id, text, **kwargs):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    dispatcher = _dispatcher(SlowBot(), concurrency=3)
+    for chat in range(20):
+        dispatcher.send(chat, "hi")
+    await _run(dispatcher)
+    assert peak == 3
+    assert dispatcher.sent == 20
@@ -0,0 +1,55 @@
+"""
+Tests for the message prefilter.
+"""
+
+from matcher import PreparedMessage, ProductMatcher, ProductRecord
+from prefilter import SKIP_NO_CURRENCY, SKIP_NO_TOKENS, MessagePrefilter
+
+
+def _check(records, text):
+    return MessagePrefilter(records).check(PreparedMessage(text))
+
+
+def test_chatter_is_skipped():
+    records = [ProductRecord.create(1, 100, "iphone 15", None)]
+    assert _check(records, "Buongiorno a tutti, oggi niente offerte") == SKIP_NO_TOKENS
+    assert _check(records, "Nuovo i-Phone 15 in offerta") is None
+
+
+def test_currency_required_only_if_every_product_has_a_target():
+    with_target = [ProductRecord.create(1, 100, "iphone 15", 800.0)]
+    assert _check(with_target, "iPhone 15 disponibile in negozio") == SKIP_NO_CURRENCY
+    assert _check(with_target, "iPhone 15 a 749 EUR") is None
+
+    mixed = with_target + [ProductRecord.create(2, 100, "airpods", None)]
+    assert _check(mixed, "iPhone 15 disponibile in negozio") is None
+
+
+def test_typo_tolerant_names_keep_all_trigrams():
+    records = [ProductRecord.create(1, 100, "samsung galaxy", None, typo_tolerance=1)]
+    assert _check(records, "Samsumg Galaxy in offerta") is None
+    assert _check(records, "Buongiorno a tutti") == SKIP_NO_TOKENS
+
+
+def test_short_names_disable_token_check():
+    records = [ProductRecord.create(1, 100, "tv", None)]
+    assert _check(records, "Smart TV 55 pollici") is None
+    assert _check(records, "Buongiorno a tutti") is None
+
+
+def test_no_false_skips():
+    """A message the automaton matches is never skipped."""
+    names = ["iphone 15", "airpods pro", "galaxy s24", "kindle", "mx master 3"]
+    records = [ProductRecord.create(i, 100, name, None) for i, name in enumerate(names)]
+    matcher = ProductMatcher()
+    for record in records:
+        matcher.add(record.id, record.name)
+    prefilter = MessagePrefilter(records)
+    texts = [
+        "Nuovo iPhone 15 a 749€", "AirPods Pro 2", "Galaxy-S24 Ultra", "Kindle Paperwhite",
+        "Logitech MX Master 3S", "iphone15", "Offerte del giorno", "",
+    ]
+    for text in texts:
+        message = PreparedMessage(text)
+        if matcher.find(message.norm):
+            assert prefilter.check(message) is None, text
@@ -2,7 +2,10 @@
 Tests for price parser.
 """
 
-from price_parser import extract_prices
+import random
+import re
+
+from price_parser import extract_price_layout, extract_prices, extract_prices_many
 
 
 def test_euro_symbol_before():
@@ -70,3 +73,102 @@ def test_large_price():
 
 def test_single_digit_price():
     assert extract_prices("Solo €5") == [5.0]
+
+
+def test_oversized_amount_is_not_a_price():
+    """Past the thousands groups cap nothing is found, not a partial 0.0."""
+    assert extract_prices("1.000.000.000.000.000€") == []
+    assert extract_prices("€1.000.000.000.000.000") == []
+    assert extract_prices("999.999.999.999.999€") == [999999999999999.0]
+
+
+def test_digit_run_is_one_amount():
+    """Amounts without thousands separators are read whole, never from their last digits."""
+    assert extract_prices("iPhone 1099€") == [1099.0]
+    assert extract_prices("TV 4K 1299 euro") == [1299.0]
+    assert extract_prices("€ 12345") == [12345.0]
+    assert extract_prices("1099,99€") == [1099.99]
+    assert extract_prices("1234567890123456€") == []
+
+
+# --- Layout (spans, segments, clauses) ---
+
+def test_layout_spans_match_extract_prices():
+    text = "iPhone 15 a 749€, AirPods a 129€\nSolo €1.234,56 oggi"
+    layout = extract_price_layout(text)
+    assert [p.value for p in layout.prices] == extract_prices(text)
+    assert [text[p.start:p.end] for p in layout.prices] == ["749€", "129€", "€1.234,56"]
+
+
+def test_layout_segments_and_clauses():
+    layout = extract_price_layout("AirPods 129€ / iPhone 899€\n• Galaxy 1.234,56€, Buds 99€")
+    assert [(p.value, p.segment) for p in layout.prices] == [(129.0, 0), (899.0, 1), (1234.56, 3), (99.0, 3)]
+    # The comma inside 1.234,56 is not a clause break, the one after the price is
+    assert layout.prices[2].clause != layout.prices[3].clause
+
+
+def test_layout_prices_near():
+    text = "iPhone 15\nPrezzo: 749€\n\nAirPods Pro\nPrezzo: 129€"
+    layout = extract_price_layout(text)
+    airpods = text.index("AirPods")
+    assert layout.prices_near(0, 9) == [749.0]                         # first price after
+    assert layout.prices_near(airpods, airpods + 11) == [129.0]
+
+
+def test_layout_nearest_in_segment():
+    text = "Galaxy S24, ora a 749€, Buds 99€"
+    layout = extract_price_layout(text)
+    assert layout.prices_near(0, 10) == [749.0]
+
+
+def test_layout_prices_for_up_to_next_product():
+    text = "iPhone 15, listino 999€, ora 749€\nAirPods 129€"
+    layout = extract_price_layout(text)
+    iphone = [(0, 9)]
+    airpods = [(text.index("AirPods"), text.index("AirPods") + 7)]
+    assert layout.prices_for(iphone, airpods) == [999.0, 749.0]
+    assert layout.prices_for(airpods, iphone) == [129.0]
+    # No other product in a clause of its own: every price
+    assert layout.prices_for(iphone, []) == [999.0, 749.0, 129.0]
+
+
+# --- Batch extraction ---
+
+def test_extract_prices_many_matches_per_message():
+    texts = [
+        "Costa €799", "", "Solo 1.234,56€ e poi 50 euro", "nessun prezzo", "12",
+        "€", "3€", "EUR 100\nEUR 200",
+    ]
+    batch = extract_prices_many(texts)
+    assert len(batch) == len(texts)
+    assert [batch[i] for i in range(len(batch))] == [extract_prices(text) for text in texts]
+    assert batch.values.typecode == "d"
+
+
+def test_extract_prices_many_no_price_across_messages():
+    """A number at the end of a message never pairs with € at the start of the next one."""
+    batch = extract_prices_many(["Ordine 12", "€ spediti", "Prezzo: 99 ", "euro"])
+    assert [batch[i] for i in range(len(batch))] == [[], [], [], []]
+
+
+def test_extract_prices_many_empty():
+    assert len(extract_prices_many([])) == 0
+
+
+# --- Capped thousands groups (benchmarks/bench_price_parser.py checks linear scaling) ---
+
+def test_same_prices_as_unbounded_pattern():
+    """Capping thousands groups and digit runs only changes amounts of 10^15 and above."""
+    unbounded = re.compile(
+        r"(?:€|EUR|euro)\s*((?:\d{1,3}(?:\.\d{3})*|\d+)(?!\.?\d)(?:,\d{1,2})?)"
+        r"|(?<!\d)(?<!\d\.)((?:\d{1,3}(?:\.\d{3})*|\d+)(?!\.?\d)(?:,\d{1,2})?)\s*(?:€|EUR|euro)",
+        re.IGNORECASE,
+    )
+    rng = random.Random(7)
+    alphabet = "0123456789.,€ EURuroa\n"
+    for _ in range(20000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        expected = [float((m.group(1) or m.group(2)).replace(".", "").replace(",", "."))
+                    for m in unbounded.finditer(text)]
+        if all(value < 1e15 for value in expected):
+            assert extract_prices(text) == expected, text
@@ -0,0 +1,109 @@
+"""
+Tests for PriceHistory retention and daily rollups.
+"""
+
+import pytest
+from sqlalchemy import func, select
+
+from models import ChannelMessage, PriceHistory, PriceRollup, Product, User
+from retention import HistoryRetention, daily_history
+from timestamps import DAY_MS
+
+DAY = 1704067200000  # 2024-01-01 00:00 UTC
+NOW = DAY + 40 * DAY_MS + 3_600_000  # 2024-02-10 01:00 UTC
+
+
+@pytest.fixture
+async def factory(async_session_factory):
+    async with async_session_factory() as session:
+        session.add(User(id=1, user_id=100, username="pippo"))
+        await session.flush()
+        session.add_all([Product(id=1, user_id=100, name="airpods"), Product(id=2, user_id=100, name="kindle")])
+        await session.commit()
+    return async_session_factory
+
+
+async def _add(factory, *rows):
+    async with factory() as session:
+        for product_id, price, channel, found_at in rows:
+            message = ChannelMessage(channel=channel, text="deal")
+            session.add(message)
+            await session.flush()
+            session.add(PriceHistory(product_id=product_id, user_id=100, channel_message_id=message.id,
+                                     price=price, found_at=found_at))
+        await session.commit()
+
+
+async def _rollups(factory):
+    async with factory() as session:
+        return (await session.scalars(
+            select(PriceRollup).order_by(PriceRollup.product_id, PriceRollup.day, PriceRollup.channel)
+        )).all()
+
+
+def test_cutoff_is_a_utc_midnight():
+    retention = HistoryRetention(None, retention_days=30)
+    assert retention.cutoff(NOW) == DAY + 10 * DAY_MS
+
+
+def test_retention_days_validated():
+    with pytest.raises(ValueError):
+        HistoryRetention(None, retention_days=0)
+
+
+async def test_old_rows_rolled_up_and_deleted(factory):
+    await _add(
+        factory,
+        (1, 100.0, "offerte", DAY + 1000),
+        (1, 80.0, "offerte", DAY + 2000),
+        (1, None, "offerte", DAY + 3000),
+        (1, 90.0, "sconti", DAY + 4000),
+        (2, 50.0, "offerte", DAY + DAY_MS),
+        (1, 70.0, "offerte", DAY + 10 * DAY_MS),  # on the cutoff day: kept
+    )
+    retention = HistoryRetention(factory, retention_days=30, batch_size=2, pause=0)
+    assert await retention.run_once(NOW) == 5
+    assert retention.batches == 3
+
+    rollups = [(r.product_id, r.day, r.channel, r.match_count, r.priced_count, r.price_min, r.price_max, r.price_avg)
+               for r in await _rollups(factory)]
+    assert rollups == [
+        (1, DAY, "offerte", 3, 2, 80.0, 100.0, 90.0),
+        (1, DAY, "sconti", 1, 1, 90.0, 90.0, 90.0),
+        (2, DAY + DAY_MS, "offerte", 1, 1, 50.0, 50.0, 50.0),
+    ]
+    async with factory() as session:
+        assert await session.scalar(select(func.count()).select_from(PriceHistory)) == 1
+        assert await session.scalar(select(func.count()).select_from(ChannelMessage)) == 1
+
+    assert await retention.run_once(NOW) == 0
+
+
+async def test_later_prune_merges_into_existing_rollup(factory):
+    retention = HistoryRetention(factory, retention_days=30, pause=0)
+    await _add(factory, (1, 100.0, "offerte", DAY + 1000))
+    await retention.run_once(NOW)
+    await _add(factory, (1, 60.0, "offerte", DAY + 5000))  # e.g. a late backfill
+    await retention.run_once(NOW)
+
+    (rollup,) = await _rollups(factory)
+    assert (rollup.match_count, rollup.price_min, rollup.price_max, rollup.price_avg) == (2, 60.0, 100.0, 80.0)
+
+
+async def test_daily_history_latest_days_first(factory):
+    await _add(
+        factory,
+        (1, 100.0, "offerte", DAY),
+        (1, 80.0, "sconti", DAY + 1000),
+        (1, 90.0, "offerte", DAY + DAY_MS),
+        (1, 70.0, "offerte", DAY + 2 * DAY_MS),
+    )
+    await HistoryRetention(factory, retention_days=30, pause=0).run_once(NOW)
+
+    async with factory() as session:
+        days = await daily_history(session, 1, limit=2)
+        older = await daily_history(session, 1, limit=5, before=DAY + DAY_MS)
+    assert [d.day for d in days] == [DAY + 2 * DAY_MS, DAY + DAY_MS]
+    (first,) = older
+    assert (first.price_min, first.price_max, first.price_avg, first.match_count) == (80.0, 100.0, 90.0, 2)
+    assert sorted(first.channels) == ["offerte", "sconti"]
@@ -0,0 +1,70 @@
+"""
+Tests for the daily summary scheduler.
+"""
+
+import pytest
+
+from models import ChannelMessage, PriceHistory, Product, User
+from scheduler import DailySummaryScheduler
+
+DAY = 1704067200000  # 2024-01-01 00:00 UTC
+
+
+class FakeNotifier:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, chat_id, text, priority=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+async def factory(async_session_factory):
+    async with async_session_factory() as session:
+        session.add_all([
+            User(id=1, user_id=100, username="pippo", lang_code="en"),
+            User(id=2, user_id=200, username="pluto", lang_code="it"),
+            User(id=3, user_id=300, username="paperino", paused=True),
+        ])
+        await session.flush()
+        session.add_all([
+            Product(id=1, user_id=100, name="airpods"),
+            Product(id=2, user_id=100, name="kindle"),
+            Product(id=3, user_id=200, name="switch"),
+            Product(id=4, user_id=300, name="airpods"),
+        ])
+        message = ChannelMessage(channel="Offerte", text="deal", link="https://t.me/o/1")
+        session.add(message)
+        await session.flush()
+        rows = [(1, 100, 100.0 + i, DAY + i * 1000) for i in range(7)]  # 7 airpods matches today
+        rows += [(2, 100, None, DAY + 10_000), (2, 100, 60.0, DAY - 1000)]  # kindle: one today, one yesterday
+        rows += [(3, 200, 250.0, DAY + 500), (4, 300, 90.0, DAY + 500)]
+        session.add_all([
+            PriceHistory(product_id=p, user_id=u, price=price, channel_message_id=message.id, found_at=found_at)
+            for p, u, price, found_at in rows
+        ])
+        await session.commit()
+    return async_session_factory
+
+
+async def test_one_summary_per_active_user(factory):
+    notifier = FakeNotifier()
+    scheduler = DailySummaryScheduler(None, factory, notifier=notifier)
+    await scheduler._send_summaries(since=DAY)
+
+    assert [chat_id for chat_id, _ in notifier.sent] == [100, 200]
+    lines = notifier.sent[0][1].split("\n")
+    assert lines[0] == "Daily summary (8 matches):"
+    # Products by latest match: kindle's is the most recent
+    assert lines[2] == " kindle (1 matches):"
+    assert lines[3].startswith("  N/A in Offerte")
+    assert lines[5] == " airpods (7 matches):"
+    assert [line.split()[0] for line in lines[6:11]] == ["106.00", "105.00", "104.00", "103.00", "102.00"]
+    assert lines[11] == "  ... and 2 more"
+    assert notifier.sent[1][1].startswith("Riepilogo giornaliero (1 corrispondenze):")
+
+
+async def test_no_matches_no_summary(factory):
+    notifier = FakeNotifier()
+    await DailySummaryScheduler(None, factory, notifier=notifier)._send_summaries(since=DAY + 86_400_000)
+    assert notifier.sent == []
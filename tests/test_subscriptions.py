@@ -0,0 +1,203 @@
+"""
+Tests for the in-memory subscription index.
+"""
+
+from models import User, Channel, UserChannel, Product
+from matcher import PreparedMessage, check_price_match
+from subscriptions import SubscriptionIndex
+
+
+def _seed(db_session):
+    """Two users on 'offerte', one of them also on a private channel (numeric id)."""
+    db_session.add_all([
+        User(id=1, user_id=100, username="pippo", lang_code="it"),
+        User(id=2, user_id=200, username="pluto"),
+        Channel(id=1, identifier="offerte"),
+        Channel(id=2, identifier="123456"),
+    ])
+    db_session.flush()
+    db_session.add_all([
+        UserChannel(user_id=100, channel_id=1),
+        UserChannel(user_id=200, channel_id=1),
+        UserChannel(user_id=100, channel_id=2),
+        Product(id=1, user_id=100, name="iphone 15", target_price=800.0),
+        Product(id=2, user_id=200, name="iphone 15"),
+        Product(id=3, user_id=200, name="airpods"),
+    ])
+    db_session.commit()
+
+
+def _names(records):
+    return [(r.id, r.user_id) for r in records]
+
+
+async def _match(index, username, channel_id, text):
+    return await index.match_message(username, channel_id, PreparedMessage(text))
+
+
+async def test_load_and_match(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    records = await _match(index, "offerte", None, "nuovo iphone 15 e airpods")
+    assert _names(records) == [(1, 100), (2, 200), (3, 200)]
+    assert records[0].target_price == 800.0
+    assert records[0].lang_code == "it"
+    assert records[1].lang_code == "en"
+
+
+async def test_match_message_records_mentioned_products(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    message = PreparedMessage("AirPods 129€ / iPhone 15 899€")
+    records = await index.match_message("offerte", None, message)
+    assert message.mentioned == {"iphone 15", "airpods"}
+    # The iPhone costs 899, not the AirPods' 129
+    assert check_price_match(records[0], message) is None
+
+
+async def test_match_by_numeric_id(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    assert _names(await _match(index, None, 123456, "iphone 15 e airpods a 749€")) == [(1, 100)]
+
+
+def test_channel_products(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    assert sorted(index.channel_products("offerte", 123456)) == [1, 2, 3]
+    assert sorted(index.channel_products(None, 123456)) == [1]
+    assert index.channel_products("altro", None) == {}
+
+
+async def test_unknown_channel(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    assert await _match(index, "altro", 999, "iphone 15") == []
+
+
+async def test_paused_users_are_skipped(db_session, db_session_factory):
+    db_session.add(User(id=3, user_id=300, username="paperino", paused=True))
+    db_session.add(Channel(id=3, identifier="sconti"))
+    db_session.flush()
+    db_session.add(UserChannel(user_id=300, channel_id=3))
+    db_session.add(Product(id=9, user_id=300, name="airpods"))
+    db_session.commit()
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    assert await _match(index, "sconti", None, "airpods") == []
+    index.set_paused(300, False)
+    assert _names(await _match(index, "sconti", None, "airpods")) == [(9, 300)]
+    index.set_paused(300, True)
+    assert await _match(index, "sconti", None, "airpods") == []
+
+
+async def test_watch_and_unwatch():
+    index = SubscriptionIndex()
+    index.add_user(100)
+    index.subscribe(100, "offerte")
+
+    index.add_product(1, 100, "airpods", None)
+    assert _names(await _match(index, "offerte", None, "airpods pro")) == [(1, 100)]
+
+    index.remove_product(1)
+    assert await _match(index, "offerte", None, "airpods pro") == []
+
+
+async def test_product_added_before_subscription():
+    index = SubscriptionIndex()
+    index.add_user(100)
+    index.add_product(1, 100, "airpods", None)
+    assert await _match(index, "offerte", None, "airpods") == []
+
+    index.subscribe(100, "offerte")
+    assert _names(await _match(index, "offerte", None, "airpods")) == [(1, 100)]
+
+
+async def test_unsubscribe_only_affects_that_user():
+    index = SubscriptionIndex()
+    for uid in (100, 200):
+        index.add_user(uid)
+        index.subscribe(uid, "offerte")
+    index.add_product(1, 100, "airpods", None)
+    index.add_product(2, 200, "airpods", None)
+
+    index.unsubscribe(100, "offerte")
+    assert _names(await _match(index, "offerte", None, "airpods")) == [(2, 200)]
+
+
+async def test_set_lang_updates_records():
+    index = SubscriptionIndex()
+    index.add_user(100, "en")
+    index.subscribe(100, "offerte")
+    index.add_product(1, 100, "airpods", None)
+
+    index.set_lang(100, "it")
+    assert (await _match(index, "offerte", None, "airpods"))[0].lang_code == "it"
+
+
+def test_dedupe_setting(db_session, db_session_factory):
+    db_session.add(User(id=1, user_id=100, username="pippo", dedupe_deals=False))
+    db_session.add(User(id=2, user_id=200, username="pluto"))
+    db_session.commit()
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    assert index.dedupe_enabled(100) is False
+    assert index.dedupe_enabled(200) is True
+    index.set_dedupe(100, True)
+    assert index.dedupe_enabled(100) is True
+
+
+async def test_match_message_prefilter(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    # Product 1 has a target price: on the private channel a price is required
+    assert await index.match_message(None, 123456, PreparedMessage("iPhone 15 disponibile")) == []
+    assert index.prefilter_stats["no_currency"] == 1
+    records = await index.match_message(None, 123456, PreparedMessage("iPhone 15 a 749€"))
+    assert _names(records) == [(1, 100)]
+
+    # On 'offerte' product 2 has no target, so only the token check applies
+    assert await index.match_message("offerte", None, PreparedMessage("Buongiorno a tutti")) == []
+    assert index.prefilter_stats["no_tokens"] == 1
+    records = await index.match_message("offerte", None, PreparedMessage("iPhone 15 disponibile"))
+    assert _names(records) == [(1, 100), (2, 200)]
+    assert index.prefilter_stats["checked"] == 4
+
+
+async def test_match_message_counts_a_reason_per_entry(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+
+    # Both entries of the channel skip the message, each for its own reason
+    assert await _match(index, "offerte", 123456, "Buongiorno a tutti") == []
+    assert index.prefilter_stats == {"checked": 2, "no_currency": 1, "no_tokens": 1}
+
+    # 'offerte' passes, the private channel still skips and is counted
+    assert _names(await _match(index, "offerte", 123456, "iPhone 15 disponibile")) == [(1, 100), (2, 200)]
+    assert index.prefilter_stats == {"checked": 4, "no_currency": 2, "no_tokens": 1}
+
+
+async def test_match_message_prefilter_follows_product_changes(db_session, db_session_factory):
+    _seed(db_session)
+    index = SubscriptionIndex()
+    index.load(db_session_factory)
+    message = PreparedMessage("Kindle Paperwhite")
+
+    assert await index.match_message("offerte", None, message) == []
+    index.add_product(9, 200, "kindle", None)
+    assert _names(await index.match_message("offerte", None, message)) == [(9, 200)]
@@ -0,0 +1,30 @@
+"""
+Tests for epoch-millisecond timestamp helpers.
+"""
+
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from timestamps import format_ms, iso_to_ms, start_of_day_ms, to_ms
+
+ROME = ZoneInfo("Europe/Rome")
+
+
+def test_iso_to_ms_offsets():
+    assert iso_to_ms("2024-01-01T00:00:00+00:00") == 1704067200000
+    assert iso_to_ms("2024-01-01T01:00:00+01:00") == 1704067200000
+    assert iso_to_ms("2024-01-01T00:00:00") == 1704067200000  # naive = UTC
+    assert iso_to_ms(1704067200000) == 1704067200000
+    assert iso_to_ms("not a date") == 0
+
+
+def test_start_of_day_in_timezone():
+    # 23:30 UTC on Mar 1 is already Mar 2 in Rome
+    now = datetime(2024, 3, 1, 23, 30, tzinfo=timezone.utc)
+    assert start_of_day_ms(ROME, now) == to_ms(datetime(2024, 3, 1, 23, 0, tzinfo=timezone.utc))
+    assert start_of_day_ms(timezone.utc, now) == to_ms(datetime(2024, 3, 1, tzinfo=timezone.utc))
+
+
+def test_format_ms_renders_local_time():
+    assert format_ms(1704067200000, timezone.utc) == "2024-01-01 00:00"
+    assert format_ms(1704067200000, ROME) == "2024-01-01 01:00"
@@ -0,0 +1,164 @@
+"""
+Tests for the incrementally maintained /stats counters.
+"""
+
+import random
+
+import pytest
+from sqlalchemy import select
+
+from history_writer import PriceHistoryWriter
+from models import ChannelMatchCount, Product, User, UserChannel, Channel, UserStats
+from retention import HistoryRetention
+from timestamps import DAY_MS
+from user_stats import add_counts, rebuild_stats
+
+DAY = 1704067200000  # 2024-01-01 00:00 UTC
+
+
+@pytest.fixture
+async def factory(async_session_factory):
+    async with async_session_factory() as session:
+        session.add_all([User(id=1, user_id=100, username="pippo"), User(id=2, user_id=200, username="pluto")])
+        await session.flush()
+        session.add_all([
+            Product(id=1, user_id=100, name="airpods"),
+            Product(id=2, user_id=100, name="kindle"),
+            Product(id=3, user_id=200, name="airpods"),
+        ])
+        await session.flush()
+        await session.run_sync(rebuild_stats)
+        await session.commit()
+    return async_session_factory
+
+
+_message_ids = iter(range(1, 1_000_000))
+
+
+def _row(product_id, user_id, channel, found_at=DAY, message_id=None):
+    message_id = message_id if message_id is not None else next(_message_ids)
+    return dict(product_id=product_id, user_id=user_id, price=10.0, source="realtime", found_at=found_at,
+                chat_id=-1001, message_id=message_id, channel=channel, message_text="deal", message_link=None)
+
+
+async def _write(factory, *rows):
+    writer = PriceHistoryWriter(factory, batch_size=1000, flush_interval=60)
+    for row in rows:
+        writer.add(**row)
+    await writer.flush()
+
+
+async def _snapshot(factory, user_id):
+    """(stats, product counts, channel counts) of a user."""
+    async with factory() as session:
+        stats = await session.get(UserStats, user_id)
+        products = dict((await session.execute(
+            select(Product.id, Product.match_count).where(Product.user_id == user_id)
+        )).all())
+        channels = dict((await session.execute(
+            select(ChannelMatchCount.channel, ChannelMatchCount.match_count).where(ChannelMatchCount.user_id == user_id)
+        )).all())
+        fields = (stats.product_count, stats.channel_count, stats.match_count, stats.top_product_id,
+                  stats.top_product_count, stats.top_channel, stats.top_channel_count, stats.last_match_at)
+        return fields, products, channels
+
+
+async def test_writer_updates_counters(factory):
+    await _write(
+        factory,
+        _row(1, 100, "offerte", DAY + 1),
+        _row(2, 100, "sconti", DAY + 3),
+        _row(2, 100, "offerte", DAY + 2),
+        _row(3, 200, "offerte", DAY + 5),
+    )
+    fields, products, channels = await _snapshot(factory, 100)
+    assert fields == (2, 0, 3, 2, 2, "offerte", 2, DAY + 3)
+    assert products == {1: 1, 2: 2}
+    assert channels == {"offerte": 2, "sconti": 1}
+    fields, _, _ = await _snapshot(factory, 200)
+    assert fields[2:] == (1, 3, 1, "offerte", 1, DAY + 5)
+
+
+async def test_leader_changes_only_when_overtaken(factory):
+    await _write(factory, _row(1, 100, "offerte"), _row(1, 100, "offerte"))
+    await _write(factory, _row(2, 100, "sconti"), _row(2, 100, "sconti"))
+    fields, _, _ = await _snapshot(factory, 100)
+    # Ties keep the current leader
+    assert fields[3:7] == (1, 2, "offerte", 2)
+
+    await _write(factory, _row(2, 100, "sconti"))
+    fields, _, _ = await _snapshot(factory, 100)
+    assert fields[3:7] == (2, 3, "sconti", 3)
+
+
+async def test_incremental_counters_match_rebuild(factory):
+    rng = random.Random(3)
+    owners = {1: 100, 2: 100, 3: 200}
+    for _ in range(10):
+        await _write(factory, *(
+            _row(product_id, owners[product_id], rng.choice(["a", "b", "c", "d"]), DAY + rng.randint(0, 10 * DAY_MS))
+            for product_id in rng.choices(list(owners), k=rng.randint(1, 30))
+        ))
+    incremental = [await _snapshot(factory, user_id) for user_id in (100, 200)]
+
+    async with factory() as session:
+        assert await session.run_sync(rebuild_stats) == 2
+        await session.commit()
+    rebuilt = [await _snapshot(factory, user_id) for user_id in (100, 200)]
+    # Leaders may differ on ties only
+    for (fields, products, channels), (fields_r, products_r, channels_r) in zip(incremental, rebuilt):
+        assert (products, channels) == (products_r, channels_r)
+        assert fields[:3] + fields[7:] == fields_r[:3] + fields_r[7:]
+        assert products[fields[3]] == products_r[fields_r[3]] and fields[4] == fields_r[4]
+        assert channels[fields[5]] == channels_r[fields_r[5]] and fields[6] == fields_r[6]
+
+
+async def test_user_without_stats_row_is_rebuilt(factory):
+    await _write(factory, _row(1, 100, "offerte", DAY))
+    async with factory() as session:
+        await session.delete(await session.get(UserStats, 100))
+        await session.commit()
+
+    await _write(factory, _row(1, 100, "offerte", DAY + 1))
+    fields, products, _ = await _snapshot(factory, 100)
+    assert fields[2:5] == (2, 1, 2)
+    assert products == {1: 2, 2: 0}
+
+
+async def test_rebuild_counts_rollups(factory):
+    await _write(factory, _row(1, 100, "offerte", DAY), _row(1, 100, "offerte", DAY + 1), _row(2, 100, "sconti", DAY))
+    before = await _snapshot(factory, 100)
+    await HistoryRetention(factory, retention_days=1, pause=0).run_once(DAY + 5 * DAY_MS)
+
+    async with factory() as session:
+        await session.run_sync(rebuild_stats, [100])
+        await session.commit()
+    fields, products, channels = await _snapshot(factory, 100)
+    assert (products, channels) == before[1:]
+    assert fields[:7] == before[0][:7]
+    assert fields[7] == DAY  # a rolled-up match only keeps its day
+
+
+async def test_rebuild_after_product_deleted(factory):
+    await _write(factory, _row(1, 100, "offerte"), _row(2, 100, "sconti"), _row(2, 100, "sconti"))
+    async with factory() as session:
+        await session.delete(await session.get(Product, 2))
+        await session.flush()
+        await session.run_sync(rebuild_stats, [100])
+        await session.commit()
+    fields, products, channels = await _snapshot(factory, 100)
+    assert fields[:7] == (1, 0, 1, 1, 1, "offerte", 1)
+    assert products == {1: 1}
+    assert channels == {"offerte": 1}
+
+
+async def test_add_counts(factory):
+    async with factory() as session:
+        session.add(Channel(id=1, identifier="offerte"))
+        await session.flush()
+        session.add(UserChannel(user_id=100, channel_id=1))
+        await session.run_sync(add_counts, 100, channels=1)
+        await session.run_sync(add_counts, 100, products=-1)
+        await session.commit()
+    fields, _, _ = await _snapshot(factory, 100)
+    assert fields[:2] == (1, 1)